@@ -2,5 +2,6 @@
 import DNAProbeDesigner.duplex_prob
 import DNAProbeDesigner.gui
 import DNAProbeDesigner.secondary_structure
+import DNAProbeDesigner.cross_hybridization
 import DNAProbeDesigner.blockParse
 import DNAProbeDesigner.outputClean
\ No newline at end of file
@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+# --------------------------------------------------------------------------
+# bgzf.py
+#
+# Blocked GNU Zip Format (BGZF), the gzip variant used by samtools, tabix and
+# htslib. A BGZF file is a series of independent gzip members of at most
+# 64 kb each, so it can be read by any gzip reader and also be indexed and
+# decompressed block by block.
+# --------------------------------------------------------------------------
+
+# Import module for packing binary headers.
+import struct
+
+# Import module for deflate compression.
+import zlib
+
+# Import modules for decompressing blocks ahead of the reader in a thread
+# pool; zlib releases the GIL while inflating.
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# Largest amount of data put into one block, as in htslib. This leaves room
+# for incompressible data to fit the 64 kb block size limit.
+bgzfBlockData = 0xff00
+
+# The empty block that marks the end of a BGZF file.
+bgzfEOF = bytes.fromhex('1f8b08040000000000ff0600424302001b0003000000000000'
+                        '000000')
+
+
+def bgzfBlock(data, compresslevel=6):
+    """Returns data compressed into one BGZF block."""
+    compressor = zlib.compressobj(compresslevel, zlib.DEFLATED, -15)
+    cdata = compressor.compress(data) + compressor.flush()
+    # gzip header with the BC extra field holding the block size - 1.
+    header = struct.pack('<BBBBIBBHBBHH', 31, 139, 8, 4, 0, 0, 255, 6, 66, 67,
+                         2, len(cdata) + 25)
+    return header + cdata + struct.pack('<II', zlib.crc32(data) & 0xffffffff,
+                                        len(data))
+
+
+class BgzfWriter:
+    """Writable binary file object producing BGZF output. Data is buffered
+    and compressed one block at a time; close() writes the EOF block."""
+
+    def __init__(self, fileName, compresslevel=6):
+        self.handle = open(fileName, 'wb')
+        self.compresslevel = compresslevel
+        self.buffer = bytearray()
+
+    def write(self, data):
+        self.buffer += data
+        while len(self.buffer) >= bgzfBlockData:
+            self.handle.write(bgzfBlock(bytes(self.buffer[:bgzfBlockData]),
+                                        self.compresslevel))
+            del self.buffer[:bgzfBlockData]
+        return len(data)
+
+    def flush(self):
+        if self.buffer:
+            self.handle.write(bgzfBlock(bytes(self.buffer),
+                                        self.compresslevel))
+            self.buffer = bytearray()
+        self.handle.flush()
+
+    def close(self):
+        if self.handle.closed:
+            return
+        self.flush()
+        self.handle.write(bgzfEOF)
+        self.handle.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def bgzfBlocks(handle):
+    """Yields the compressed blocks of a BGZF file one at a time, using the
+    block size stored in the BC field of each gzip header."""
+    while True:
+        header = handle.read(12)
+        if not header:
+            return
+        if len(header) < 12 or header[:4] != b'\x1f\x8b\x08\x04':
+            raise ValueError('Not a BGZF file')
+        extra = handle.read(struct.unpack_from('<H', header, 10)[0])
+        size = None
+        k = 0
+        while k + 4 <= len(extra):
+            (si1, si2, slen) = struct.unpack_from('<BBH', extra, k)
+            if (si1, si2, slen) == (66, 67, 2):
+                size = struct.unpack_from('<H', extra, k + 4)[0] + 1
+            k += 4 + slen
+        if size is None:
+            raise ValueError('BGZF block without a BC field')
+        rest = handle.read(size - 12 - len(extra))
+        if len(rest) != size - 12 - len(extra):
+            raise ValueError('Truncated BGZF file')
+        yield header + extra + rest
+
+
+def inflateBlocks(blocks):
+    """Returns the data of a list of BGZF blocks, checking the CRC32 and size
+    of each."""
+    parts = []
+    for block in blocks:
+        start = 12 + struct.unpack_from('<H', block, 10)[0]
+        data = zlib.decompress(block[start:-8], -15)
+        (crc, size) = struct.unpack_from('<II', block, len(block) - 8)
+        if len(data) != size or zlib.crc32(data) & 0xffffffff != crc:
+            raise ValueError('Corrupt BGZF block')
+        parts.append(data)
+    return b''.join(parts)
+
+
+class BgzfReader:
+    """Reads the data of a BGZF file. Blocks are independent, so batches of
+    blocks are decompressed ahead of the reader by a pool of worker
+    threads, keeping at most two batches per worker in flight."""
+
+    def __init__(self, fileName, workers=1, batchSize=64):
+        self.fileName = fileName
+        self.workers = max(1, workers)
+        self.batchSize = batchSize
+
+    def batches(self, handle):
+        batch = []
+        for block in bgzfBlocks(handle):
+            batch.append(block)
+            if len(batch) == self.batchSize:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def chunks(self):
+        """Yields the decompressed data, one batch of blocks at a time, in
+        file order."""
+        with open(self.fileName, 'rb') as handle:
+            if self.workers == 1:
+                for batch in self.batches(handle):
+                    yield inflateBlocks(batch)
+                return
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                pending = deque()
+                for batch in self.batches(handle):
+                    pending.append(executor.submit(inflateBlocks, batch))
+                    if len(pending) >= 2 * self.workers:
+                        yield pending.popleft().result()
+                while pending:
+                    yield pending.popleft().result()
+
+    def read(self):
+        """Returns all of the decompressed data."""
+        return b''.join(self.chunks())
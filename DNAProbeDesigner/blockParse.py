@@ -40,6 +40,10 @@ Version = '1.7'
 # Import module for handling input arguments.
 import argparse
 
+# Import modules for handling file paths and the standard streams.
+import os
+import sys
+
 # Import timeit module and record start time. This provides a rough estimate of
 # the wall clock time it takes to run the script.
 import timeit
@@ -51,16 +55,377 @@ import math
 from Bio.SeqUtils import MeltingTemp as mt
 from Bio.Seq import Seq
 from Bio.SeqUtils import GC
-from Bio import SeqIO
+
+# Import module for mining FASTA records in parallel.
+from concurrent.futures import ProcessPoolExecutor
+
+# Import module for grouping the mined tiles by record.
+from itertools import groupby
 
 # Import regex module.
 import re
 
+# Import module for compressed output.
+import gzip
+
+# Import module for binary search in sorted hit lists.
+from bisect import bisect_left
+
+# Import module for the typed buffers of the Report log.
+from array import array
+
+# Import numpy module.
+import numpy as np
+
+# Import the .2bit genome store, the shared Tm engine and the BGZF writer.
+try:
+    from DNAProbeDesigner.genomeStore import isTwoBit, openTwoBit
+    from DNAProbeDesigner.tmEngine import getTmEngine
+    from DNAProbeDesigner.bgzf import BgzfWriter
+except ImportError:
+    from genomeStore import isTwoBit, openTwoBit
+    from tmEngine import getTmEngine
+    from bgzf import BgzfWriter
+
+# Integer codes used by the vectorized engine: A, C, G, T, N and anything else.
+baseCodes = np.full(256, 5, dtype=np.uint8)
+for code, base in enumerate('ACGTN'):
+    baseCodes[ord(base)] = code
+
+# Every dinucleotide stack looked up in the reformatted NN table.
+stackPairs = [a + b for a in 'ACGT' for b in 'ACGT']
+
+
+def roundTm(tmvals):
+    """Vectorized equivalent of float('%0.2f' % x). Values too close to a
+    rounding boundary for np.rint to be trusted are formatted one by one."""
+    scaled = tmvals * 100.0
+    rounded = np.rint(scaled) / 100.0
+    close = np.flatnonzero(np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6)
+    for k in close:
+        rounded[k] = float('%0.2f' % tmvals[k])
+    return rounded
+
+
+# Reason codes of the Report log entries, one per class of failure plus one
+# for picked candidates, and the names of their classes in the summaries.
+(failNInt, failNBlock, failProhib, failTmLow, failTmHigh, failGCLow,
+ failGCHigh, pickProbe) = range(8)
+reportClasses = ['N_int_fail', 'N_block_fail', 'prohib_fail', 'Tm_fail_low',
+                 'Tm_fail_high', 'gc_fail_low', 'gc_fail_high', 'probe']
+
+
+def reportLine(code, position, length, value, match, limits):
+    """Renders one Report log entry as the sentence written to the log.
+    limits holds the (tm, TM, gcPercent, GCPercent) settings."""
+    (tm, TM, gcPercent, GCPercent) = limits
+    if code == failNInt:
+        return ('Sequence window of %d bases beginning at %d failed due to '
+                'the presence of an interspersed \'N\' base'
+                % (length, position))
+    if code == failNBlock:
+        return ('Skipping %d base window %d-%d because it contains only '
+                '\'N\' bases' % (length, position, position + length - 1))
+    if code == failProhib:
+        return ('Sequence window of %d bases beginning at %d failed due to '
+                'the presence of prohibited sequence(s) %s'
+                % (length, position, match))
+    if code == failTmLow or code == failTmHigh:
+        return ('Sequence window of %d bases beginning at %d failed due to Tm '
+                'of %0.2f being %s the allowed range of %d-%d'
+                % (length, position, value,
+                   'below' if code == failTmLow else 'above', tm, TM))
+    if code == failGCLow or code == failGCHigh:
+        return ('Sequence window of %d bases beginning at %d failed due to '
+                '%%G+C of %0.2f being below the allowed range of %d-%d'
+                % (length, position, value, gcPercent, GCPercent))
+    return ('Picking a candidate probe of %d bases starting at base %d'
+            % (length, position))
+
+
+class ReportLog:
+    """Report info of a run, kept as reason codes, window positions, window
+    lengths and values (Tm or %G+C) in typed arrays, with a counter per
+    reason code. Each entry also keeps the index of the walk step that
+    logged it, so that tiled runs can be stitched. The sentences of the log
+    are only rendered when it is written."""
+
+    def __init__(self):
+        self.codes = array('B')
+        self.positions = array('q')
+        self.lengths = array('I')
+        self.values = array('d')
+        self.steps = array('q')
+        self.matches = []
+        self.counts = [0] * len(reportClasses)
+
+    def __len__(self):
+        return len(self.codes)
+
+    def add(self, code, position, length, value=0.0, match=None, step=None):
+        """Records one entry. Prohibited sequence failures also keep the
+        matched sequences. The step defaults to the window position."""
+        self.codes.append(code)
+        self.positions.append(position)
+        self.lengths.append(length)
+        self.values.append(value)
+        self.steps.append(position if step is None else step)
+        self.counts[code] += 1
+        if code == failProhib:
+            self.matches.append(match)
+
+    def addArrays(self, codes, positions, lengths, values, steps, matches):
+        """Records a batch of entries given as NumPy arrays, with the matched
+        sequences of the prohibited sequence failures among them."""
+        self.codes.frombytes(codes.astype(np.uint8).tobytes())
+        self.positions.frombytes(positions.astype(np.int64).tobytes())
+        self.lengths.frombytes(lengths.astype(np.uint32).tobytes())
+        self.values.frombytes(values.astype(np.float64).tobytes())
+        self.steps.frombytes(steps.astype(np.int64).tobytes())
+        self.matches.extend(matches)
+        self.counts = [a + b for a, b in
+                       zip(self.counts, np.bincount(codes, minlength=len(
+                           reportClasses)).tolist())]
+
+    def extend(self, other):
+        """Appends the entries of another ReportLog, e.g. the next record."""
+        self.codes.extend(other.codes)
+        self.positions.extend(other.positions)
+        self.lengths.extend(other.lengths)
+        self.values.extend(other.values)
+        self.steps.extend(other.steps)
+        self.matches.extend(other.matches)
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+
+    def since(self, step):
+        """Returns a new ReportLog with the entries logged from walk step
+        onwards. Steps only grow along a walk."""
+        k = bisect_left(self.steps, step)
+        part = ReportLog()
+        part.codes = self.codes[k:]
+        part.positions = self.positions[k:]
+        part.lengths = self.lengths[k:]
+        part.values = self.values[k:]
+        part.steps = self.steps[k:]
+        part.matches = self.matches[self.codes[:k].count(failProhib):]
+        part.counts = np.bincount(np.frombuffer(part.codes, dtype=np.uint8),
+                                  minlength=len(reportClasses)).tolist()
+        return part
+
+    def lines(self, limits):
+        """Yields the rendered log entries in the order they were added."""
+        matches = iter(self.matches)
+        for code, position, length, value in zip(self.codes, self.positions,
+                                                 self.lengths, self.values):
+            match = next(matches) if code == failProhib else None
+            yield reportLine(code, position, length, value, match, limits)
+
+    def writeSummary(self, outName, windowCount):
+        """Writes the counters to a TSV file and every entry to an NPZ file
+        holding the codes, positions, lengths, values and matched prohibited
+        sequences, with the class names indexed by code."""
+        with open('%s_blockParse_summary.tsv' % outName, 'w') as f:
+            f.write('class\twindows\tpercent\n')
+            for name, count in zip(reportClasses, self.counts):
+                f.write('%s\t%d\t%0.4f\n'
+                        % (name, count,
+                           100.0 * count / windowCount if windowCount else 0))
+        np.savez('%s_blockParse_summary.npz' % outName,
+                 codes=np.frombuffer(self.codes, dtype=np.uint8),
+                 positions=np.frombuffer(self.positions, dtype=np.int64),
+                 lengths=np.frombuffer(self.lengths, dtype=np.uint32),
+                 values=np.frombuffer(self.values, dtype=np.float64),
+                 matches=np.array(self.matches, dtype=str),
+                 classes=np.array(reportClasses),
+                 counts=np.array(self.counts, dtype=np.int64))
+
+
+def indexFasta(inputFile):
+    """Builds a faidx-like index of a FASTA file without loading any sequence.
+    Returns one dict per record, in file order, holding the header line, the
+    number of bases, the byte offsets of the sequence data, the number of
+    bases/bytes in its first line and whether all lines but the last have
+    that same layout."""
+    records = []
+    record = None
+    offset = 0
+    with open(inputFile, 'rb') as f:
+        for line in f:
+            if line.startswith(b'>'):
+                if record is not None:
+                    record['end'] = offset
+                header = line.decode('latin-1').rstrip('\r\n') + '\n'
+                record = {'header': header, 'length': 0,
+                          'offset': offset + len(line), 'end': None,
+                          'lineBases': 0, 'lineWidth': 0, 'regular': True}
+                records.append(record)
+                shortLine = False
+            elif record is not None:
+                bases = len(b''.join(line.split()))
+                if record['lineWidth'] == 0:
+                    record['lineBases'] = bases
+                    record['lineWidth'] = len(line)
+                elif (shortLine and bases) or bases > record['lineBases'] \
+                     or (bases == record['lineBases']
+                         and len(line) != record['lineWidth']):
+                    record['regular'] = False
+                shortLine = shortLine or bases < record['lineBases']
+                record['length'] += bases
+            offset += len(line)
+    if record is not None:
+        record['end'] = offset
+    return records
+
+
+def readFasta(inputFile, record, start=0, end=None):
+    """Reads bases [start, end) of an indexed FASTA record, in upper case.
+    Records with a regular line layout are read directly from the right byte
+    range; others are read in full and sliced."""
+    if end is None:
+        end = record['length']
+    with open(inputFile, 'rb') as f:
+        if record['regular'] and record['lineBases']:
+            first = record['offset'] + start // record['lineBases'] \
+                    * record['lineWidth'] + start % record['lineBases']
+            last = record['offset'] + end // record['lineBases'] \
+                   * record['lineWidth'] + end % record['lineBases']
+            f.seek(first)
+            return ''.join(f.read(last - first).decode('latin-1')
+                           .split()).upper()
+        f.seek(record['offset'])
+        data = f.read(record['end'] - record['offset'])
+    return ''.join(data.decode('latin-1').split())[start:end].upper()
+
+
+def indexGenome(inputFile):
+    """Indexes a FASTA file or a .2bit genome store. Records from a .2bit
+    store also carry their sequence name, which readGenome uses to fetch
+    them from the memory-mapped store."""
+    if isTwoBit(inputFile):
+        store = openTwoBit(inputFile)
+        return [{'header': '>%s\n' % name, 'length': store.length(name),
+                 'name': name} for name in store.names]
+    return indexFasta(inputFile)
+
+
+def readRegions(regionsFile, records):
+    """Reads target regions from a BED file and returns one record per region,
+    in file order. Regions refer to genome records by the first word of their
+    header and are named after the BED name column, or after their
+    chrom:start-end coordinates if it is missing."""
+    genome = {}
+    for record in records:
+        genome[record.get('name') or record['header'][1:].split()[0]] = record
+    regions = []
+    with open(regionsFile) as f:
+        for lineNum, line in enumerate(f, 1):
+            fields = line.rstrip('\r\n').split('\t')
+            if not line.strip() or line.startswith(('#', 'track', 'browser')):
+                continue
+            try:
+                chrom = fields[0]
+                (start, end) = (int(fields[1]), int(fields[2]))
+            except (IndexError, ValueError):
+                raise ValueError('Line %d of %s is not a valid BED region'
+                                 % (lineNum, regionsFile))
+            if chrom not in genome:
+                raise ValueError('Region on line %d of %s is on %s, which is '
+                                 'not in the genome' % (lineNum, regionsFile,
+                                                        chrom))
+            if not 0 <= start < end <= genome[chrom]['length']:
+                raise ValueError('Region on line %d of %s lies outside of %s'
+                                 % (lineNum, regionsFile, chrom))
+            if len(fields) > 3 and fields[3].strip():
+                regionName = fields[3].strip()
+            else:
+                regionName = '%s:%d-%d' % (chrom, start + 1, end)
+            regions.append({'source': genome[chrom], 'chrom': chrom,
+                            'regionStart': start, 'length': end - start,
+                            'regionName': regionName})
+    return regions
+
+
+def readGenome(inputFile, record, start=0, end=None):
+    """Reads bases [start, end) of a record returned by indexGenome or
+    readRegions, in upper case."""
+    if 'source' in record:
+        if end is None:
+            end = record['length']
+        return readGenome(inputFile, record['source'],
+                          record['regionStart'] + start,
+                          record['regionStart'] + end)
+    if 'name' in record:
+        return openTwoBit(inputFile).fetch(record['name'], start, end)
+    return readFasta(inputFile, record, start, end)
+
+
+class ProbeWriter:
+    """Streams candidate probes to a .bed or .fastq file as they are mined.
+    Lines are formatted a batch at a time and written through a buffered
+    binary file, compressed with gzip or BGZF (.gz) if desired, so memory
+    use does not grow with the number of candidates. As before, lines are
+    separated by newlines with no newline after the last one. If a stream
+    (a writable binary file object) is given, the lines are written to it
+    instead of a file, e.g. to pipe FASTQ into an aligner; closing the
+    writer closes the stream."""
+
+    def __init__(self, outName, bedVal, compress=None, bufferSize=1 << 20,
+                 stream=None):
+        self.bedVal = bedVal
+        if bedVal:
+            self.fileName = '%s.bed' % outName
+        else:
+            self.fileName = '%s.fastq' % outName
+        if compress is not None:
+            self.fileName += '.gz'
+        if stream is not None:
+            if compress is not None:
+                raise ValueError('Compressed output cannot be streamed')
+            self.fileName = None
+            self.handle = stream
+        elif compress == 'gzip':
+            self.handle = gzip.open(self.fileName, 'wb', compresslevel=6)
+        elif compress == 'bgzip':
+            self.handle = BgzfWriter(self.fileName)
+        elif compress is None:
+            self.handle = open(self.fileName, 'wb', buffering=bufferSize)
+        else:
+            raise ValueError('Unknown compression %s' % compress)
+        self.count = 0
+
+    def write(self, chrom, cands, tms=None, regionName=None):
+        """Writes the candidates (start, end, seq) of one record or tile.
+        BED output needs their Tms; probes mined from target regions carry
+        the region name in an extra column (.bed) or read comment (.fastq)."""
+        if not cands:
+            return
+        if self.bedVal:
+            regionCol = '' if regionName is None else '\t%s' % regionName
+            lines = ['%s\t%s\t%s\t%s\t%s%s' % (chrom, start, end, seq, tmval,
+                                               regionCol)
+                     for (start, end, seq), tmval in zip(cands, tms)]
+        else:
+            regionCol = '' if regionName is None else ' %s' % regionName
+            lines = ['@%s:%s-%s%s\n%s\n+\n%s' % (chrom, start, end, regionCol,
+                                                seq, '~' * len(seq))
+                     for (start, end, seq) in cands]
+        text = '\n'.join(lines)
+        if self.count:
+            text = '\n' + text
+        self.handle.write(text.encode())
+        self.count += len(cands)
+
+    def close(self):
+        self.handle.close()
+
+
 class SequenceCrawler:
     def __init__(self, inputFile, l, L, gcPercent, GCPercent, nn_table, tm, TM,
                  X, sal, form, sp, conc1, conc2, headerVal, bedVal,
                  OverlapModeVal, verbocity, reportVal, debugVal, metaVal,
-                 outNameVal):
+                 outNameVal, engineVal='crawl', workersVal=1, tileSizeVal=0,
+                 verifyVal=False, regionsVal=None, compressVal=None,
+                 summaryOnlyVal=False, outStreamVal=None):
         """Initializes a SequenceCrawler, which is used to efficiently scan a
         large sequence for satisfactory probe sequences."""
 
@@ -86,6 +451,14 @@ class SequenceCrawler:
         self.debugVal = debugVal
         self.metaVal = metaVal
         self.outNameVal = outNameVal
+        self.engineVal = engineVal
+        self.workersVal = workersVal
+        self.tileSizeVal = tileSizeVal
+        self.verifyVal = verifyVal
+        self.compressVal = compressVal
+        self.summaryOnlyVal = summaryOnlyVal
+        self.outStreamVal = outStreamVal
+        self.regionsVal = regionsVal
 
         # Build the variables required for efficient melting temperature
         # checking. For melting temperature calculations, the nearest neighbor
@@ -111,9 +484,36 @@ class SequenceCrawler:
         self.comps = {'A': 'T', 'T': 'A', 'C': 'G', 'G': 'C'}
         self.stackTable = self.reformatTable(nn_table)
 
-        # Build parser for FASTA sequence block.
-        for seq_record in SeqIO.parse(self.inputFile, 'fasta'):
-            self.block = str(seq_record.seq).upper()
+        # Build the Tm engine for these conditions, which holds the salt and
+        # strand concentration terms and computes the Tm of output probes.
+        self.tmEngine = getTmEngine(nn_table, self.sal, self.form, self.conc1,
+                                    self.conc2)
+
+        # Compile the prohibited sequences once. If they are all plain bases
+        # they are also combined into a single matcher that finds every hit in
+        # a block up front; shorter sequences come first so that the match at
+        # each position is the shortest one.
+        self.prohibList = str(self.X).split(',')
+        self.prohibRegexes = [re.compile(pro, re.I) for pro in self.prohibList]
+        if all(re.match(r'[A-Za-z]+$', pro) is not None
+               for pro in self.prohibList):
+            self.prohibHitRegex = re.compile('(?=(%s))' % '|'.join(
+                sorted(self.prohibList, key=len)), re.I)
+        else:
+            self.prohibHitRegex = None
+
+        # The sequence block is loaded record by record when mining.
+        self.block = None
+        self.hitStarts = None
+        self.hitMinEnds = None
+        self.prohibStarts = None
+        self.nStarts = None
+        self.nEnds = None
+
+        # Report info is logged record by record, each entry with the index
+        # of the walk step that logged it.
+        self.reportLog = None
+        self.reportStep = 0
 
     def reformatTable(self, table):
         """Given a NN table of the format in Bio.SeqUtils.MeltingTemp,
@@ -319,16 +719,15 @@ class SequenceCrawler:
             self.currInd = ind
 
         # Adjust estimate based on salt concentration. Note that this logic
-        # corresponds to saltcorr = 5 in the MeltingTemp library.
-        concval = (self.conc1 - (self.conc2 / 2.0)) * 1e-9
-        saltval = mt.salt_correction(Na=self.sal, K=0, Tris=0, Mg=0, dNTPs=0, \
-                                     method=5, seq=seq1)
+        # corresponds to saltcorr = 5 in the MeltingTemp library. The salt
+        # and strand concentration terms are precomputed by the Tm engine.
         tmval = (1000.0 * self.currdH) / \
-                (self.currdS + saltval + (1.987 * math.log(concval))) - 273.15
+                (self.currdS + self.tmEngine.saltTerm(len(seq1))
+                 + self.tmEngine.concTerm) - 273.15
 
         # ! return mt.chem_correction(tmval, fmd=self.form)
         approxtmval = float('%0.2f' % tmval)
-        return mt.chem_correction(approxtmval, fmd=self.form)
+        return self.tmEngine.chemCorrect(approxtmval)
 
 
     def tmCheck(self, seq2, ind, i, j):
@@ -346,61 +745,88 @@ class SequenceCrawler:
 
     def prohibitCheck(self, seq4):
         """Check for prohibited sequence matches."""
-        prohibList = str(self.X).split(',')
-        for pro in prohibList:
-            if re.search(pro, seq4, re.I) is not None:
+        for pro in self.prohibRegexes:
+            if pro.search(seq4) is not None:
                 return False
         return True
 
 
+    def prohibitCheckInd(self, ind, length):
+        """Check the block window [ind, ind + length) for prohibited sequence
+        matches. Uses the hit index of the block when there is one: the window
+        is clean if the first hit starting in it ends past its end."""
+        if self.hitStarts is None:
+            return self.prohibitCheck(self.block[ind:ind + length])
+        return self.hitMinEnds[bisect_left(self.hitStarts, ind)] \
+               > ind + length
+
+
+    def skipN(self, ind):
+        """Returns the first index at or after ind whose window of l bases
+        contains no N, jumping over whole N runs. This is where the window by
+        window skipping in crawl() ends up."""
+        k = bisect_left(self.nStarts, ind + self.l) - 1
+        while k >= 0 and self.nEnds[k] > ind:
+            ind = self.nEnds[k]
+            k = bisect_left(self.nStarts, ind + self.l) - 1
+        return ind
+
+
+    def setBlock(self, block):
+        """Sets the sequence block to mine and indexes it for the window
+        checks: the runs of N bases, and the prohibited sequence hits."""
+        self.block = block
+        if block is not None:
+            runs = [m.span() for m in re.finditer('N+', block)]
+            self.nStarts = [a for (a, b) in runs]
+            self.nEnds = [b for (a, b) in runs]
+        else:
+            self.nStarts = None
+            self.nEnds = None
+        if block is not None and self.prohibHitRegex is not None:
+            (starts, minEnds) = self.prohibitedHits()
+            self.hitStarts = starts.tolist()
+            self.hitMinEnds = minEnds.tolist()
+        else:
+            self.hitStarts = None
+            self.hitMinEnds = None
+
+
     def Ncheckopt(self, seq6):
         """Check for N bases in a sequence, searching from the back."""
         return seq6.rfind('N')
 
 
+    def NcheckInd(self, ind, length):
+        """Equivalent of Ncheckopt for the block window [ind, ind + length),
+        answered from the N run index of the block without slicing it.
+        Returns the position of the last N base relative to ind, or -1."""
+        k = bisect_left(self.nStarts, ind + length) - 1
+        if k < 0 or self.nEnds[k] <= ind:
+            return -1
+        return min(self.nEnds[k], ind + length) - 1 - ind
+
+
     def seqCheck(self, seq8, i):
         """Aggregate results from the N and prohibited sequences checks."""
-        if self.Ncheckopt(seq8) == -1 and self.prohibitCheck(seq8):
-            return True
+        if not (self.reportVal or self.debugVal):
+            return self.NcheckInd(i, len(seq8)) == -1 \
+                   and self.prohibitCheckInd(i, len(seq8))
 
         # Report reasons for failure if desired.
-        if self.reportVal or self.debugVal:
-            # Report on N-base check first.
-            if self.Ncheckopt(seq8) != -1:
-                if self.reportVal:
-                    self.reportList.append('Sequence window of %d bases '
-                                           'beginning at %d failed due to the '
-                                           'presence of an interspersed \'N\' '
-                                           'base' \
-                                           % (self.l, (self.start + i)))
-                self.N_int_fail_.append(1)
-                if self.debugVal:
-                    print('Sequence window of %d bases beginning at %d failed '
-                          'due to the presence of an interspersed \'N\' base' \
-                          % (self.l, (self.start + i)))
-
-            # Report if failure is due to the presence of prohibited sequences.
-            if not self.prohibitCheck(seq8):
-                prohibList = str(self.X).split(',')
-                match_list = []
-                for pro in prohibList:
-                    match_group = re.search(pro, seq8, re.I)
-                    if match_group:
-                        foundSeq = match_group.group(0)
-                        match_list.append(foundSeq)
-                        format_match = ', '.join('%s' % x for x in match_list)
-                if self.reportVal:
-                    self.reportList.append('Sequence window of %d bases '
-                                           'beginning at %d failed due to the '
-                                           'presence of prohibited sequence(s) '
-                                           '%s' \
-                                           % (self.l, (self.start + i),
-                                              format_match))
-                    self.prohib_fail.append(1)
-                if self.debugVal:
-                    print('Sequence window of %d bases beginning at %d failed '
-                          'due to the presence of prohibited sequence(s) %s' \
-                          % (self.l, (self.start + i), format_match))
+        nPass = self.NcheckInd(i, len(seq8)) == -1
+        prohibPass = self.prohibitCheckInd(i, len(seq8))
+        if nPass and prohibPass:
+            return True
+
+        # Report on N-base check first.
+        if not nPass:
+            self.logReport(failNInt, self.start + i, self.l)
+
+        # Report if failure is due to the presence of prohibited sequences.
+        if not prohibPass:
+            self.logReport(failProhib, self.start + i, self.l,
+                           match=self.prohibitedMatches(seq8))
 
 
     def probeCheck(self, seq5, ind, i, j):
@@ -411,180 +837,91 @@ class SequenceCrawler:
         # Next check Tm, % G+C
         # NOTE: Because of the variable setup, the tmCheck MUST come before the
         # gcCheck for this to work properly.
-        if self.Ncheckopt(seq5) == -1 and self.prohibitCheck(seq5) \
-           and self.tmCheck(seq5, ind, i, j) and self.gcCheck(seq5):
+        if not (self.reportVal or self.debugVal):
+            return self.NcheckInd(ind, len(seq5)) == -1 \
+                   and self.prohibitCheckInd(ind, len(seq5)) \
+                   and self.tmCheck(seq5, ind, i, j) and self.gcCheck(seq5)
+
+        # Report reasons for failure if desired. Each check is evaluated
+        # once; computing the Tm also brings the %G+C count up to date. A
+        # window with an 'N' base has no Tm or %G+C to report.
+        nPass = self.NcheckInd(ind, len(seq5)) == -1
+        prohibPass = self.prohibitCheckInd(ind, len(seq5))
+
+        # Report on N-base check first
+        if not nPass:
+            self.logReport(failNInt, self.start + i, self.l)
+
+        # Report if failure is due to the presence of prohibited sequences.
+        if not prohibPass:
+            self.logReport(failProhib, self.start + i, self.l,
+                           match=self.prohibitedMatches(seq5))
+        if not nPass:
+            return False
+
+        tmval = self.probeTmOpt(seq5, ind, i, j)
+        gcval = self.numGC * 100.0 / len(seq5)
+        if prohibPass and float(self.tm) < tmval < float(self.TM) \
+           and float(self.gcPercent) <= gcval <= float(self.GCPercent):
             return True
 
-        # Report reasons for failure if desired.
-        if self.reportVal or self.debugVal:
-            # Report on N-base check first
-            if self.Ncheckopt(seq5) != -1:
-                if self.reportVal:
-                    self.reportList.append('Sequence window of %d bases '
-                                           'beginning at %d failed due to the '
-                                           'presence of an interspersed \'N\' '
-                                           'base' \
-                                           % (self.l, (self.start + i)))
-                    self.N_int_fail.append(1)
-                if self.debugVal:
-                    print('Sequence window of %d bases beginning at %d '
-                          'failed due to the presence of an interspersed \'N\' '
-                          'base' % (self.l, (self.start + i)))
-
-            # Report if failure is due to the presence of prohibited sequences.
-            if not self.prohibitCheck(seq5):
-                prohibList = str(self.X).split(',')
-                match_list = []
-                for pro in prohibList:
-                    match_group = re.search(pro, seq5, re.I)
-                    if match_group:
-                        foundSeq = match_group.group(0)
-                        match_list.append(foundSeq)
-                        format_match = ', '.join('%s' % x for x in match_list)
-                if self.reportVal:
-                    self.reportList.append('Sequence window of %d bases '
-                                           'beginning at %d failed due to the '
-                                           'presence of prohibited sequence(s) '
-                                           '%s' \
-                                           % (self.l, (self.start + i),
-                                              format_match))
-                    self.prohib_fail.append(1)
-                if self.debugVal:
-                    print('Sequence window of %d bases beginning at %d failed '
-                          'due to the presence of prohibited sequence(s) %s' \
-                          % (self.l, (self.start + i), format_match))
-
-            # Report if Tm too low/high.
-            if not self.tmCheck(seq5, ind, i, j):
-                if self.probeTmOpt(seq5, ind, i, j) < self.tm:
-                    if self.reportVal:
-                        self.reportList.append('Sequence window of %d bases '
-                                               'beginning at %d failed due to '
-                                               'Tm of %0.2f being below the '
-                                               'allowed range of %d-%d' \
-                                                % ((self.l + j),
-                                                   (self.start + i),
-                                                   self.probeTmOpt(seq5, ind,
-                                                                   i, j),
-                                                   self.tm, self.TM))
-                        self.Tm_fail_low.append(1)
-                    if self.debugVal:
-                        print('Sequence window of %d bases beginning at %d '
-                              'failed due to Tm of %0.2f being below the '
-                              'allowed range of %d-%d' \
-                              % ((self.l + j), (self.start + i),
-                                 self.probeTmOpt(seq5, ind, i, j),
-                                 self.tm, self.TM))
-                if self.probeTmOpt(seq5, ind, i, j) > self.TM:
-                    if self.reportVal:
-                        self.reportList.append('Sequence window of %d bases '
-                                               'beginning at %d failed due to '
-                                               'Tm of %0.2f being above the '
-                                               'allowed range of %d-%d' \
-                                               % ((self.l + j),
-                                                  (self.start + i),
-                                                  self.probeTmOpt(seq5, ind,
-                                                                  i, j),
-                                                  self.tm, self.TM))
-                        self.Tm_fail_high.append(1)
-                    if self.debugVal:
-                        print('Sequence window of %d bases beginning at %d '
-                              'failed due to Tm of %0.2f being above the '
-                              'allowed range of %d-%d' \
-                              % ((self.l + j), (self.start + i),
-                                 self.probeTmOpt(seq5, ind, i, j),
-                                 self.tm, self.TM))
-
-            # Report if %G+C too low/high.
-            if not self.gcCheck(seq5):
-                if (self.numGC * 100.0 / len(seq5)) < self.gcPercent:
-                    if self.reportVal:
-                        self.reportList.append('Sequence window of %d bases '
-                                               'beginning at %d failed due to '
-                                               '%%G+C of %0.2f being below the '
-                                               'allowed range of %d-%d' \
-                                               % ((self.l + j),
-                                                  (self.start + i),
-                                                  (self.numGC * 100.0 \
-                                                   / len(seq5)), \
-                                                  self.gcPercent,
-                                                  self.GCPercent))
-                        self.gc_fail_low.append(1)
-                    if self.debugVal:
-                        print('Sequence window of %d bases beginning at %d '
-                              'failed due to %%G+C of %0.2f being below the '
-                              'allowed range of %d-%d' \
-                              % ((self.l + j), (self.start + i), \
-                                 (self.numGC * 100.0 / len(seq5)), \
-                                 self.gcPercent, self.GCPercent))
-                if (self.numGC * 100.0 / len(seq5)) > self.GCPercent:
-                    if self.reportVal:
-                        self.reportList.append('Sequence window of %d bases '
-                                               'beginning at %d failed due to '
-                                               '%%G+C of %0.2f being below the '
-                                               'allowed range of %d-%d' \
-                                               % ((self.l + j),
-                                                  (self.start + i), \
-                                                  (self.numGC * 100.0 \
-                                                   / len(seq5)), \
-                                                  self.gcPercent,
-                                                  self.GCPercent))
-                        self.gc_fail_high.append(1)
-                    if self.debugVal:
-                        print('Sequence window of %d bases beginning at %d '
-                              'failed due to %%G+C of %0.2f being below the '
-                              'allowed range of %d-%d' \
-                              % ((self.l + j), (self.start + i),
-                                 (self.numGC * 100.0 / len(seq5)), \
-                                 self.gcPercent, self.GCPercent))
+        # Report if Tm too low/high.
+        if tmval < self.tm:
+            self.logReport(failTmLow, self.start + i, self.l + j, tmval)
+        if tmval > self.TM:
+            self.logReport(failTmHigh, self.start + i, self.l + j, tmval)
 
-    def BedprobeTm(self, seq7):
-        """Tm calculation function for use with .bed output."""
-        bedTmVal = float(('%0.2f' % mt.Tm_NN(seq7, Na=self.sal, 
-                                             dnac1=self.conc1,
-                                             dnac2=self.conc2)))
-        bed_fcorrected = ('%0.2f' % mt.chem_correction(bedTmVal, fmd=self.form))
-        return bed_fcorrected
+        # Report if %G+C too low/high.
+        if gcval < self.gcPercent:
+            self.logReport(failGCLow, self.start + i, self.l + j, gcval)
+        if gcval > self.GCPercent:
+            self.logReport(failGCHigh, self.start + i, self.l + j, gcval)
 
-    def run(self):
-        """Runs the crawler through the given block sequence to identify probes
-        within the FASTA file satisfying the given constraints."""
 
-        # Parse out FASTA coordinate, scaffold info.
-        with open(self.inputFile, 'r') as f:
-            headerLine = f.readline()
+    def prohibitedMatches(self, seq):
+        """The first match of each prohibited sequence in a window, as listed
+        in the Report log."""
+        return ', '.join(match.group(0) for match in
+                         (pro.search(seq) for pro in self.prohibRegexes)
+                         if match)
 
-        if self.headerVal is None:
-            headerParse = headerLine.split(':')
 
-            if len(headerParse) == 1:
-                chrom = headerLine.split('>')[1].split('\n')[0]
-                self.start = 1
-                stop = len(self.block)
-            elif 'range=' in headerLine:
-                chrom = headerLine.split('=')[1].split(':')[0]
-                self.start = int(str(headerLine).split(':')[1].split('-')[0])
-                stop = str(headerLine).split('-')[1].split(' ')[0]
+    def logReport(self, code, position, length, value=0.0, match=None):
+        """Adds an entry to the Report log and/or prints it in Debug mode."""
+        if self.reportVal:
+            self.reportLog.add(code, position, length, value, match,
+                               self.reportStep)
+        if self.debugVal:
+            print(reportLine(code, position, length, value, match,
+                             (self.tm, self.TM, self.gcPercent,
+                              self.GCPercent)))
 
-            else:
-                chrom = 'chrom'
-                self.start = 1
-                stop = len(self.block)
-        else:
-            chrom = self.headerVal.split(':')[0]
-            self.start = int(str(self.headerVal).split(':')[1].split('-')[0])
-            stop = str(self.headerVal).split(':')[1].split('-')[1]
+    def BedprobeTm(self, seq7):
+        """Tm calculation function for use with .bed output."""
+        bedTmVal = float(('%0.2f' % self.tmEngine.tm(seq7)))
+        bed_fcorrected = ('%0.2f' % self.tmEngine.chemCorrect(bedTmVal))
+        return bed_fcorrected
 
-        # Make lists to hold Report info if desired.
-        if self.reportVal:
-            self.reportList = []
-            self.N_int_fail = []
-            self.N_block_fail = []
-            self.prohib_fail = []
-            self.Tm_fail_low = []
-            self.Tm_fail_high = []
-            self.gc_fail_low = []
-            self.gc_fail_high = []
+
+    def BedprobeTms(self, seqs):
+        """Batch version of BedprobeTm for all the probes of a record."""
+        bedTmVals = self.tmEngine.tmBatch(seqs).tolist()
+        return [self.BedprobeTm(seq) if math.isnan(bedTmVal) else
+                '%0.2f' % self.tmEngine.chemCorrect(float('%0.2f' % bedTmVal))
+                for seq, bedTmVal in zip(seqs, bedTmVals)]
+
+    def crawl(self, i=0, stop=None, until=None, visited=None, visitLimit=0,
+              entry='start'):
+        """Walks the block one base at a time, returning a list of
+        (start, stop, sequence) tuples for the candidate probes found. Tiled
+        runs start the walk at index i and end it before the first index that
+        reaches stop or is contained in until. Indices below visitLimit that
+        the walk passes through are appended to visited, and the index the
+        walk ended at is stored in self.exitInd. entry says how the walk
+        enters at i: 'start' for a new walk, which first skips the windows
+        with 'N' bases, 'head' at a step of a walk, or 'step' in the middle of
+        a step that skipped 'N' bases up to i. How a walk continuing from
+        self.exitInd enters is stored in self.exitEntry."""
 
         # Determine the size range the probe sequence can vary over.
         sizeRange = int(self.L) - int(self.l) + 1
@@ -595,50 +932,64 @@ class SequenceCrawler:
         # Make a list to store candidate probe coordinates and sequences.
         cands = []
 
-        previousend = 0
-        i = 0
+        # Determine the last index to walk from. A bounded walk leaves the
+        # windows from stop onwards to the next tile.
+        bounded = stop is not None and stop < int(blockLen) - int(self.l)
+        if not bounded:
+            stop = int(blockLen) - int(self.l)
 
-        # Skip to first sequence without an unknown base.
-        ncheckval = self.Ncheckopt(self.block[i:i + self.l])
-        while ncheckval != -1:
-            i += ncheckval + 1
-            ncheckval = self.Ncheckopt(self.block[i:i + self.l])
-            if self.reportVal:
-                self.reportList.append('Skipping %d base window %d-%d because '
-                                       'it contains only \'N\' bases' \
-                                       % (self.l, (self.start + i - self.l),
-                                          (self.start + i - 1)))
-                self.N_block_fail.append(1)
-            if self.debugVal:
-                print('Skipping %d base window %d-%d because it contains only '
-                      '\'N\' bases' \
-                      % (self.l, (self.start + i - self.l),
-                         (self.start + i - 1)))
-        self.resetTmVals(i, self.l)
+        previousend = 0
+        self.exitEntry = 'head'
+        if visited is not None and i < visitLimit:
+            visited.append(i)
+        self.reportStep = self.start + i
+
+        # Skip to first sequence without an unknown base. Whole N runs are
+        # jumped at once unless every skipped window has to be reported. A
+        # bounded walk leaves the windows past stop, which its block may not
+        # hold in full, to the next tile.
+        if entry != 'head':
+            if not (self.reportVal or self.debugVal):
+                i = self.skipN(i)
+            ncheckval = self.NcheckInd(i, self.l)
+            while ncheckval != -1 and not (bounded and i >= stop):
+                i += ncheckval + 1
+                ncheckval = self.NcheckInd(i, self.l)
+                if self.reportVal or self.debugVal:
+                    self.logReport(failNBlock, self.start + i - self.l,
+                                   self.l)
+        if i < stop:
+            self.resetTmVals(i, self.l)
+        elif bounded:
+            self.exitEntry = entry
+        elif entry == 'step':
+            # What is left of the block is still checked by the step.
+            self.seqCheck(self.block[i:i + self.l], i)
 
         # Iterate over input sequence, vetting candidate probe sequences.
-        while i < int(blockLen) - int(self.l):
+        while i < stop:
+            if until is not None and i in until:
+                break
+            if visited is not None and i < visitLimit:
+                visited.append(i)
+            self.reportStep = self.start + i
+
             # Print status to terminal.
             if i % 100000 == 0:
                 print('%d of %d' % (i, blockLen))
 
             # Find next sequence without an unknown base.
-            ncheckval = self.Ncheckopt(self.block[i:i + self.l])
-            while ncheckval != -1:
+            if not (self.reportVal or self.debugVal):
+                i = self.skipN(i)
+            ncheckval = self.NcheckInd(i, self.l)
+            while ncheckval != -1 and not (bounded and i >= stop):
                 i += ncheckval + 1
-                ncheckval = self.Ncheckopt(self.block[i:i + self.l])
-                if self.reportVal:
-                    self.reportList.append('Skipping %d base window %d-%d '
-                                           'because it contains only \'N\' '
-                                           'bases' \
-                                           % (self.l, (self.start + i - self.l),
-                                              (self.start + i - 1)))
-                    self.N_block_fail.append(1)
-                if self.debugVal:
-                    print('Skipping %d base window %d-%d because it contains '
-                          'only \'N\' bases' \
-                          % (self.l, (self.start + i - self.l),
-                             (self.start + i - 1)))
+                ncheckval = self.NcheckInd(i, self.l)
+                if self.reportVal or self.debugVal:
+                    self.logReport(failNBlock, self.start + i - self.l, self.l)
+            if bounded and i >= stop:
+                self.exitEntry = 'step'
+                break
             if self.seqCheck(self.block[i:i + self.l], i):
 
                 # Search for a sequence that starts at this index and satisfies
@@ -658,13 +1009,8 @@ class SequenceCrawler:
                     if self.verbocity:
                         print ('Picking a candidate probe of %d bases starting '
                                'at base %d' % (self.l + j, startPos))
-                    if self.reportVal:
-                        self.reportList.append('Picking a candidate probe of '
-                                          '%d bases starting at base %d' \
-                                          % (self.l + j, startPos))
-                    if self.debugVal:
-                        print('Picking a candidate probe of %d bases starting '
-                              'at base %d' % (self.l + j, startPos))
+                    if self.reportVal or self.debugVal:
+                        self.logReport(pickProbe, startPos, self.l + j)
                     previousend = i + j + self.l - 1
 
                 # Update the next index to search from. Probes must be
@@ -676,58 +1022,687 @@ class SequenceCrawler:
             else:
                 i += 1
 
-        # Determine the stem of the input filename.
-        fileName = str(self.inputFile).split('.')[0]
+        self.exitInd = i
+        return cands
+
+
+    def scanSupported(self):
+        """Check whether the vectorized engine can reproduce the crawler on
+        this block. Debug output, regular expression prohibited sequences,
+        bases other than A/C/G/T/N and stack tables that cannot be summed
+        exactly all fall back to the crawler."""
+        if self.debugVal:
+            reason = 'debug mode requires it'
+        elif self.prohibHitRegex is None:
+            reason = 'prohibited sequences are not plain bases'
+        elif re.search('[^ACGTN]', self.block) is not None:
+            reason = 'the sequence contains bases other than A, C, G, T and N'
+        elif self.stackScale() is None:
+            reason = 'the stack table cannot be summed exactly'
+        else:
+            return True
+        print('Using the crawl engine because %s' % reason)
+        return False
+
+
+    def stackScale(self):
+        """Find the power of ten that turns every dinucleotide stack value into
+        an integer, so that window sums can be taken from exact integer prefix
+        sums. Returns None if no such scale exists."""
+        if not all(pair in self.stackTable for pair in stackPairs):
+            return None
+        vals = [v for pair in stackPairs for v in self.stackTable[pair]]
+        for scale in (1, 10, 100, 1000, 10000):
+            if all(abs(v * scale - round(v * scale)) < 1e-6 for v in vals):
+                return scale
+        return None
+
+
+    def prohibitedHits(self):
+        """Locate every occurrence of the prohibited sequences in the block in
+        a single pass of the combined matcher. Returns the sorted hit starts
+        and, for each of them, the smallest hit end at or after it (with a
+        sentinel entry for 'no further hit')."""
+        starts = []
+        ends = []
+        for m in self.prohibHitRegex.finditer(self.block):
+            starts.append(m.start())
+            ends.append(m.end(1))
+        starts = np.asarray(starts, dtype=np.int64)
+        ends = np.asarray(ends, dtype=np.int64)
+        if len(ends):
+            minEnds = np.minimum.accumulate(ends[::-1])[::-1]
+        else:
+            minEnds = ends
+        minEnds = np.append(minEnds, len(self.block) + self.L + 1)
+        return starts, minEnds
+
+
+    def scan(self, i=0, stop=None, visited=None, visitLimit=0,
+             entry='start', chunkSize=1 << 20):
+        """Vectorized alternative to crawl(). Encodes the block as a uint8
+        array and evaluates Tm, %G+C, 'N' bases and prohibited sequences for
+        every (start, length) window of a chunk at once using integer prefix
+        sums of the stack table, then applies the same greedy selection as
+        crawl(). Returns the same list of (start, stop, sequence) tuples,
+        takes the same tiling arguments and logs the same Report info."""
+
+        block = self.block
+        blockLen = len(block)
+        l = int(self.l)
+        L = int(self.L)
+        codes = baseCodes[np.frombuffer(block.encode('latin-1'),
+                                          dtype=np.uint8)]
+
+        # Per-base edge contributions, indexed by base code. These follow
+        # getFrontVals and getBackVals.
+        frontH = np.zeros(5)
+        frontS = np.zeros(5)
+        backH = np.zeros(5)
+        backS = np.zeros(5)
+        for code, letter in enumerate('ACGTN'):
+            (frontH[code], frontS[code]) = self.getFrontVals(letter)
+            (backH[code], backS[code]) = self.getBackVals(letter)
+
+        # Integer stack values, indexed by 4 * first base + second base. Pairs
+        # touching an 'N' are never summed over a window that is kept.
+        scale = self.stackScale()
+        stackH = np.zeros(25, dtype=np.int64)
+        stackS = np.zeros(25, dtype=np.int64)
+        for pair in stackPairs:
+            ind = 5 * 'ACGTN'.index(pair[0]) + 'ACGTN'.index(pair[1])
+            stackH[ind] = round(self.stackTable[pair][self.dH] * scale)
+            stackS[ind] = round(self.stackTable[pair][self.dS] * scale)
+
+        initH = self.stackTable['init'][self.dH]
+        initS = self.stackTable['init'][self.dS]
+        allATH = self.stackTable['init_allA/T'][self.dH]
+        allATS = self.stackTable['init_allA/T'][self.dS]
+        oneGCH = self.stackTable['init_oneG/C'][self.dH]
+        oneGCS = self.stackTable['init_oneG/C'][self.dS]
+
+        # Length-dependent salt correction and the strand concentration term,
+        # as in probeTmOpt.
+        concTerm = self.tmEngine.concTerm
+        saltVals = {n: self.tmEngine.saltTerm(n) for n in range(l, L + 1)}
+
+        hitStarts = np.asarray(self.hitStarts, dtype=np.int64)
+        hitMinEnds = np.asarray(self.hitMinEnds, dtype=np.int64)
 
-        # Determine the name of the output file.
-        if self.outNameVal is None:
-            outName = fileName
+        cands = []
+        previousend = 0
+        self.exitEntry = 'head'
+        bounded = stop is not None and stop < blockLen - l
+        if not bounded:
+            stop = blockLen - l
+
+        # In Report mode the walk goes window by window like crawl(), and the
+        # log entries of each chunk are built from its arrays. The walk first
+        # skips the windows with 'N' bases at its start, as crawl() does.
+        head = None
+        if self.reportVal:
+            self.prohibStarts = []
+            for pro in self.prohibList:
+                # Every hit of a prohibited sequence starts at a hit start.
+                proStarts = hitStarts[hitStarts + len(pro) <= blockLen]
+                for t, base in enumerate(pro.upper()):
+                    proStarts = proStarts[codes[proStarts + t]
+                                          == 'ACGTN'.find(base)]
+                self.prohibStarts.append(proStarts)
+        if self.reportVal and entry == 'start':
+            if visited is not None and i < visitLimit:
+                visited.append(i)
+            self.reportStep = self.start + i
+            ncheckval = self.NcheckInd(i, l)
+            while ncheckval != -1 and not (bounded and i >= stop):
+                i += ncheckval + 1
+                ncheckval = self.NcheckInd(i, l)
+                self.logReport(failNBlock, self.start + i - l, l)
+            if bounded and i >= stop:
+                self.exitEntry = 'start'
+
+        for c0 in range(i, max(stop, i), chunkSize):
+            if i >= stop:
+                break
+            c1 = min(c0 + chunkSize, stop)
+            if i >= c1:
+                continue
+            print('%d of %d' % (c0, blockLen))
+
+            seg = codes[c0:min(c1 + L + 1, blockLen)]
+            pairs = 5 * seg[:-1].astype(np.int64) + seg[1:]
+            cumH = np.concatenate(([0], np.cumsum(stackH[pairs])))
+            cumS = np.concatenate(([0], np.cumsum(stackS[pairs])))
+            cumGC = np.concatenate(([0], np.cumsum((seg == 1) | (seg == 2))))
+            cumN = np.concatenate(([0], np.cumsum(seg == 4)))
+            nextHitEnd = hitMinEnds[np.searchsorted(hitStarts,
+                                                    np.arange(c0, c1))]
+
+            # Windows of the minimum length decide where crawl() would
+            # attempt to extend a probe (see seqCheck).
+            r = np.arange(c1 - c0)
+            okMask = (cumN[r + l] == cumN[r]) & (nextHitEnd > c0 + r + l)
+
+            # Record the shortest passing length for each start, and the Tm of
+            # every window for the Report log.
+            first = np.zeros(c1 - c0, dtype=np.int64)
+            if self.reportVal:
+                tmAll = np.zeros((L - l + 1, c1 - c0))
+            for n in range(l, L + 1):
+                m = min(c1 - c0, blockLen - c0 - n)
+                if m <= 0:
+                    continue
+                r = np.arange(m)
+                numGC = cumGC[r + n] - cumGC[r]
+                noGC = numGC == 0
+                dH = (cumH[r + n - 1] - cumH[r]) / scale + initH \
+                     + frontH[seg[r]] + backH[seg[r + n - 1]] \
+                     + np.where(noGC, allATH, oneGCH)
+                dS = (cumS[r + n - 1] - cumS[r]) / scale + initS \
+                     + frontS[seg[r]] + backS[seg[r + n - 1]] \
+                     + np.where(noGC, allATS, oneGCS)
+                tmval = (1000.0 * dH) / (dS + saltVals[n] + concTerm) - 273.15
+                approxtmval = roundTm(tmval)
+                approxtmval = self.tmEngine.chemCorrect(approxtmval)
+                gcval = numGC * 100.0 / n
+                passed = (cumN[r + n] == cumN[r]) \
+                         & (nextHitEnd[:m] > c0 + r + n) \
+                         & (float(self.tm) < approxtmval) \
+                         & (approxtmval < float(self.TM)) \
+                         & (float(self.gcPercent) <= gcval) \
+                         & (gcval <= float(self.GCPercent))
+                first[:m][passed & (first[:m] == 0)] = n
+                if self.reportVal:
+                    tmAll[n - l, :m] = approxtmval
+
+            candIdx = np.flatnonzero(first) + c0
+            okIdx = np.flatnonzero(okMask) + c0
+
+            # Greedy selection, reproducing the index updates of crawl().
+            while i < c1:
+                if self.reportVal:
+                    (i, head, starts, heads, skips) = self.reportWalk(
+                        i, head, c0, c1, stop, bounded, okMask, first,
+                        candIdx, cumN[l:c1 - c0 + l] == cumN[:c1 - c0],
+                        visited, visitLimit)
+                    picks = self.reportChunk(c0, starts, heads, skips,
+                                             okMask, first, tmAll, cumN,
+                                             cumGC, nextHitEnd)
+                elif self.OverlapModeVal:
+                    if visited is not None and i < visitLimit:
+                        visited.extend(range(i, min(c1, visitLimit)))
+                    picks = candIdx[candIdx >= i]
+                    i = c1
+                else:
+                    if visited is not None and i < visitLimit:
+                        visited.append(i)
+                    k = np.searchsorted(okIdx, i)
+                    if k == len(okIdx):
+                        i = c1
+                        break
+                    i = int(okIdx[k])
+                    n = int(first[i - c0])
+                    if n:
+                        picks = [i]
+                        previousend = i + n - 1
+                    else:
+                        picks = []
+                    i = max(i + 1, previousend + 1) + self.sp
+                    if not n and self.sp == 0:
+                        k = np.searchsorted(candIdx, i)
+                        i = int(candIdx[k]) if k < len(candIdx) else c1
+                for ind in picks:
+                    ind = int(ind)
+                    n = int(first[ind - c0])
+                    startPos = self.start + ind
+                    cands.append((str(startPos), str(startPos + n - 1),
+                                  block[ind:ind + n]))
+                    if self.verbocity:
+                        print('Picking a candidate probe of %d bases starting '
+                              'at base %d' % (n, startPos))
+
+        # A walk that skips 'N' bases past the last full window still checks
+        # what is left of the block, as crawl() does, unless the next tile
+        # finishes the step.
+        if head is not None and bounded:
+            self.exitEntry = 'step'
+        if head is not None and not bounded:
+            self.reportStep = self.start + head
+            self.seqCheck(block[i:i + l], i)
+            i += 1
+
+        self.exitInd = i
+        return cands
+
+
+    def reportWalk(self, i, head, c0, c1, stop, bounded, okMask, first,
+                   candIdx, nFree, visited, visitLimit):
+        """Walks the starts [i, c1) of a scan() chunk window by window, as
+        crawl() does in Report mode. Starts the walk steps over one at a time
+        are taken as whole ranges. A start reached by skipping windows with
+        'N' bases is visited in the step that skipped them; head is that step
+        when the skip crossed into this chunk, and None otherwise. Returns the
+        index and head the walk continues from, the visited starts with the
+        step each was visited in, and the skipped windows as (step, position)
+        pairs."""
+        l = int(self.l)
+        nIdx = (np.flatnonzero(~nFree) + c0).tolist()
+        candIdx = candIdx.tolist()
+        runs = []
+        skips = []
+        while i < c1:
+            if head is None:
+                if visited is not None and i < visitLimit:
+                    visited.append(i)
+                k = bisect_left(nIdx, i)
+                if k < len(nIdx) and nIdx[k] == i:
+                    head = i
+                    ncheckval = self.NcheckInd(i, l)
+                    while ncheckval != -1 and not (bounded and i >= stop):
+                        i += ncheckval + 1
+                        ncheckval = self.NcheckInd(i, l)
+                        skips.append((head, i - l))
+                    if i >= stop:
+                        break
+                    continue
+
+                # Without spacing, every start up to the next candidate (or
+                # the next window with 'N' bases) is visited in turn.
+                if self.OverlapModeVal or self.sp == 0:
+                    end = nIdx[k] if k < len(nIdx) else c1
+                    if not self.OverlapModeVal:
+                        k = bisect_left(candIdx, i)
+                        end = min(end, candIdx[k] if k < len(candIdx) else c1)
+                    if end > i:
+                        runs.append((i, end, -1))
+                        if visited is not None and i + 1 < visitLimit:
+                            visited.extend(range(i + 1, min(end, visitLimit)))
+                        i = end
+                        continue
+                runs.append((i, i + 1, -1))
+            else:
+                runs.append((i, i + 1, head))
+                head = None
+            r = i - c0
+            if not okMask[r] or self.OverlapModeVal:
+                i += 1
+            else:
+                i += (int(first[r]) or 1) + self.sp
+
+        # Expand the ranges into the visited starts and their steps.
+        runs = np.array(runs, dtype=np.int64).reshape(-1, 3)
+        lengths = runs[:, 1] - runs[:, 0]
+        starts = np.repeat(runs[:, 0] - np.cumsum(lengths) + lengths,
+                           lengths) + np.arange(lengths.sum())
+        heads = np.repeat(runs[:, 2], lengths)
+        heads = np.where(heads < 0, starts, heads)
+        skips = np.array(skips, dtype=np.int64).reshape(-1, 2)
+        return i, head, starts, heads, skips
+
+
+    def reportChunk(self, c0, starts, heads, skips, okMask, first, tmAll,
+                    cumN, cumGC, nextHitEnd):
+        """Adds the Report log entries of the starts a scan() chunk visited,
+        in the order crawl() logs them: the prohibited sequences of a start
+        whose minimum length window fails, otherwise every failed check of
+        each extension of the window up to the candidate picked, followed by
+        the candidate. The windows with 'N' bases a step skipped come first
+        in that step. Returns the starts of the candidates."""
+        l = int(self.l)
+        L = int(self.L)
+        r = starts - c0
+        ok = okMask[r]
+        picked = first[r]
+
+        # One row per window checked from each start. A start without a
+        # candidate extends its window as far as the block allows.
+        fails = np.where(picked > 0, picked - l,
+                         np.clip(np.minimum(L, len(self.block) - starts - 1)
+                                 - l + 1, 0, None))
+        rows = np.where(ok, fails + (picked > 0), 1)
+        row = np.repeat(np.arange(len(starts)), rows)
+        k = np.arange(len(row)) - np.repeat(np.cumsum(rows) - rows, rows)
+        (rr, n) = (r[row], l + k)
+        rowOk = ok[row]
+        failed = rowOk & (k < fails[row])
+        hasN = cumN[rr + n] != cumN[rr]
+        clean = failed & ~hasN
+        tmval = tmAll[np.where(failed, k, 0), rr]
+        gcval = (cumGC[rr + n] - cumGC[rr]) * 100.0 / n
+        checks = np.column_stack((
+            failed & hasN,
+            (failed & (nextHitEnd[rr] <= starts[row] + n)) | ~rowOk,
+            clean & (tmval < self.tm), clean & (tmval > self.TM),
+            clean & (gcval < self.gcPercent), clean & (gcval > self.GCPercent),
+            rowOk & ~failed))
+        (entry, check) = np.nonzero(checks)
+        codes = np.array([failNInt, failProhib, failTmLow, failTmHigh,
+                          failGCLow, failGCHigh, pickProbe])[check]
+        entryRow = row[entry]
+        lengths = np.where(check < 2, l, n[entry])
+        values = np.where(check < 4, tmval[entry], gcval[entry])
+        values[(check < 2) | (check == 6)] = 0.0
+        positions = self.start + starts[entryRow]
+        steps = self.start + heads[entryRow]
+
+        # The matched prohibited sequences depend only on which of them
+        # occur in the window.
+        prohib = check == 1
+        windowStarts = starts[entryRow[prohib]]
+        windowEnds = windowStarts + n[entry[prohib]]
+        found = np.zeros(len(windowStarts), dtype=np.int64)
+        for bit, (pro, proStarts) in enumerate(zip(self.prohibList,
+                                                   self.prohibStarts)):
+            found |= (np.searchsorted(proStarts, windowStarts)
+                      < np.searchsorted(proStarts, windowEnds - len(pro),
+                                        side='right')) << bit
+        names = {}
+        for key in np.unique(found).tolist():
+            names[key] = ', '.join(pro.upper() for bit, pro in
+                                   enumerate(self.prohibList)
+                                   if key >> bit & 1)
+        matches = [names[key] for key in found.tolist()]
+
+        # Windows with 'N' bases skipped by a step go before its entries.
+        if len(skips):
+            at = np.searchsorted(steps, self.start + skips[:, 0])
+            codes = np.insert(codes, at, failNBlock)
+            lengths = np.insert(lengths, at, l)
+            values = np.insert(values, at, 0.0)
+            positions = np.insert(positions, at, self.start + skips[:, 1])
+            steps = np.insert(steps, at, self.start + skips[:, 0])
+        self.reportLog.addArrays(codes, positions, lengths, values, steps,
+                                 matches)
+        return starts[ok & (picked > 0)]
+
+
+    def parseHeader(self, headerLine):
+        """Parse out FASTA coordinate, scaffold info for a record. Sets the
+        1-based start coordinate of the block and returns the chromosome
+        name."""
+
+        if self.headerVal is None:
+            headerParse = headerLine.split(':')
+
+            if len(headerParse) == 1:
+                chrom = headerLine.split('>')[1].split('\n')[0]
+                self.start = 1
+            elif 'range=' in headerLine:
+                chrom = headerLine.split('=')[1].split(':')[0]
+                self.start = int(str(headerLine).split(':')[1].split('-')[0])
+
+            else:
+                chrom = 'chrom'
+                self.start = 1
         else:
-            outName = self.outNameVal
+            chrom = self.headerVal.split(':')[0]
+            self.start = int(str(self.headerVal).split(':')[1].split('-')[0])
 
+        return chrom
+
+
+    def recordChrom(self, record):
+        """Sets the 1-based start coordinate of a record and returns its
+        chromosome name. Target regions carry their own coordinates, FASTA
+        records are parsed from their header."""
+        if 'regionName' in record:
+            self.start = record['regionStart'] + 1
+            return record['chrom']
+        return self.parseHeader(record['header'])
 
-        if self.bedVal:
-            # Create the output file.
-            output = open('%s.bed' % outName, 'w')
 
-            # Create a list to hold the output.
-            outList = []
+    def mine(self, record):
+        """Mines a single FASTA record for candidate probes. Returns the
+        chromosome name, the list of candidates and, in Report mode, the
+        ReportLog of the record."""
 
-            # Build the output file.
-            for i, (start, end, seq) in enumerate(cands):
-                outList.append('%s\t%s\t%s\t%s\t%s' % (chrom, start, end, seq,
-                                                       self.BedprobeTm(seq)))
+        self.setBlock(readGenome(self.inputFile, record))
+        chrom = self.recordChrom(record)
 
-            # Write the output file.
-            output.write('\n'.join(outList))
-            output.close()
+        # Make a log to hold Report info if desired.
+        if self.reportVal:
+            self.reportLog = ReportLog()
+
+        # Mine the block for candidate probes with the requested engine.
+        if self.engineVal == 'vector' and self.scanSupported():
+            cands = self.scan()
+        else:
+            cands = self.crawl()
 
+        if self.reportVal:
+            return chrom, cands, self.reportLog
+        return chrom, cands, None
+
+
+    def mineTile(self, record, a, b):
+        """Mines the starts [a, b) of a record as one tile of a tiled run. The
+        tile is read with a halo so that windows starting before b can reach
+        their full length. Returns the candidates, the indices the walk passed
+        through near the start of the tile and the index it ended at, both in
+        record coordinates, how a walk continuing from there enters (see
+        crawl) and, in Report mode, the ReportLog of the tile."""
+
+        self.setBlock(readGenome(self.inputFile, record, a,
+                                 min(b + int(self.L) + 1, record['length'])))
+        self.recordChrom(record)
+        self.start += a
+        if self.reportVal:
+            self.reportLog = ReportLog()
+
+        # Only the start of a tile's walk is needed to find where the walk
+        # coming from the previous tile joins it. Past the first tile, the
+        # walk enters the tile at a step.
+        visited = []
+        visitLimit = 100 * (int(self.L) + self.sp + 1)
+        entry = 'head' if a else 'start'
+        if self.engineVal == 'vector' and self.scanSupported():
+            cands = self.scan(0, b - a, visited, visitLimit, entry)
         else:
-            # Create the output file.
-            output = open('%s.fastq' % outName, 'w')
+            cands = self.crawl(0, b - a, visited=visited, visitLimit=visitLimit,
+                               entry=entry)
+        report = self.reportLog if self.reportVal else None
+        return (cands, [v + a for v in visited], self.exitInd + a,
+                self.exitEntry, report)
+
+
+    def stitchTiles(self, record, tiles):
+        """Reproduces the sequential walk over a tiled record. Each tile was
+        walked as if the walk entered it at its first base, but the real walk
+        enters wherever the previous tile's walk ended (within L + sp bases of
+        the seam). From there the crawler is run until it reaches an index the
+        tile's own walk passed through; since the walk only depends on its
+        current index, both walks agree from that point on. The same goes for
+        the Report log entries, which are kept from the step the walks join
+        at. Yields (chrom, cands, report) for each tile, and reads the tiles
+        lazily so that only the tile being stitched is held in memory."""
+
+        chrom = self.recordChrom(record)
+        recordStart = self.start
+        i = 0
+        entry = 'start'
+        for (a, b), (tileCands, visited, exitInd, exitEntry,
+                     tileReport) in tiles:
+            if i >= b:
+                continue
+            cands = []
+            report = ReportLog() if self.reportVal else None
+            joined = i in set(visited) and (entry == 'head' or i == 0)
+            if not joined:
+                self.setBlock(readGenome(self.inputFile, record, i,
+                                         min(b + int(self.L) + 1,
+                                             record['length'])))
+                self.start = recordStart + i
+                self.reportLog = report
+                cands.extend(self.crawl(0, b - i,
+                                        until=set(v - i for v in visited),
+                                        entry=entry))
+                i += self.exitInd
+                entry = self.exitEntry
+                self.start = recordStart
+                if i >= b:
+                    yield chrom, cands, report
+                    continue
+            cands.extend(cand for cand in tileCands
+                         if int(cand[0]) - recordStart >= i)
+            if self.reportVal:
+                report.extend(tileReport.since(recordStart + i))
+            i = exitInd
+            entry = exitEntry
+            yield chrom, cands, report
+
+        self.setBlock(None)
+
+
+    def mineRecords(self, records, tileSize):
+        """Mines every record, in worker processes if more than one worker was
+        requested. Records longer than tileSize are split into tiles that are
+        mined separately and stitched back together; Debug mode always mines
+        whole records. Yields (k, chrom, cands, report) in input order as soon
+        as the candidates are ready, where k is the index of the record; a
+        tiled record is yielded one stitched tile at a time."""
+
+        tasks = []
+        for k, record in enumerate(records):
+            if tileSize and not self.debugVal \
+               and record['length'] > tileSize:
+                for a in range(0, record['length'], tileSize):
+                    b = min(a + tileSize, record['length'])
+                    tasks.append((k, self.mineTile, (record, a, b), b - a))
+            else:
+                tasks.append((k, self.mine, (record,), record['length']))
+
+        executor = None
+        if self.workersVal > 1 and len(tasks) > 1:
+            # Start the largest tasks first, but keep results in input order.
+            executor = ProcessPoolExecutor(max_workers=self.workersVal)
+            futures = [None] * len(tasks)
+            for t in sorted(range(len(tasks)), key=lambda t: -tasks[t][3]):
+                (k, func, args, size) = tasks[t]
+                futures[t] = executor.submit(func, *args)
+
+        def output(t):
+            # Outputs are dropped once they have been handed on.
+            if executor is None:
+                (k, func, args, size) = tasks[t]
+                return func(*args)
+            result = futures[t].result()
+            futures[t] = None
+            return result
+
+        try:
+            t = 0
+            for k, record in enumerate(records):
+                first = t
+                while t < len(tasks) and tasks[t][0] == k:
+                    t += 1
+                if tasks[first][1] == self.mine:
+                    (chrom, cands, report) = output(first)
+                    yield k, chrom, cands, report
+                else:
+                    tiles = ((tasks[u][2][1:], output(u))
+                             for u in range(first, t))
+                    for chrom, cands, report in self.stitchTiles(record,
+                                                                 tiles):
+                        yield k, chrom, cands, report
+        finally:
+            if executor is not None:
+                executor.shutdown(cancel_futures=True)
 
-            # Create a list to hold the output.
-            outList = []
 
-            # A list to hold arbitrary quality scores for each base in the
-            # candidate probe.
-            quals = ['~' * len(cands[i][2]) for i in range(len(cands))]
+    def run(self):
+        """Runs the crawler through every record of the FASTA file to identify
+        probes satisfying the given constraints. Records are mined in parallel
+        worker processes if more than one worker was requested, and split into
+        tiles if a tile size was given."""
+
+        records = indexGenome(self.inputFile)
+        if self.regionsVal is not None:
+            if self.headerVal is not None:
+                raise ValueError('A custom header cannot be used with target '
+                                 'regions.')
+            records = readRegions(self.regionsVal, records)
+        elif self.headerVal is not None and len(records) > 1:
+            raise ValueError('A custom header can only be used with a '
+                             'single-entry FASTA file.')
 
-            # Build the output file.
-            for i, (start, end, seq) in enumerate(cands):
-                outList.append('@%s:%s-%s\n%s\n+\n%s' % (chrom, start, end, seq,
-                                                         quals[i]))
+        # Determine the stem of the input filename.
+        fileName = str(self.inputFile).split('.')[0]
 
-            # Write the output file.
-            output.write('\n'.join(outList))
-            output.close()
+        # Determine the name of the output file. When the candidates are
+        # streamed (-o -), the Report and Meta files take the input stem.
+        if self.outNameVal is None or self.outStreamVal is not None:
+            outName = fileName
+        else:
+            outName = self.outNameVal
+        if self.regionsVal is not None and self.bedVal and \
+           os.path.abspath('%s.bed' % outName) == \
+           os.path.abspath(self.regionsVal):
+            raise ValueError('The output file %s.bed would overwrite the '
+                             'target regions' % outName)
+
+        # Make a log to hold the merged Report info of all records.
+        reportLog = ReportLog()
+
+        # Write the candidates of each record, or each tile of a record, as
+        # soon as they are mined. The covered span is summed over records.
+        writer = ProbeWriter(outName, self.bedVal, self.compressVal,
+                             stream=self.outStreamVal)
+        if self.verifyVal:
+            sequential = self.mineRecords(records, 0)
+        probeNum = 0
+        probeWindow = 0
+        try:
+            pieces = self.mineRecords(records, self.tileSizeVal)
+            for k, recordPieces in groupby(pieces, key=lambda piece: piece[0]):
+                regionName = records[k].get('regionName')
+                firstStart = lastEnd = None
+                recordCands = []
+                for (k, chrom, cands, report) in recordPieces:
+                    if self.reportVal:
+                        reportLog.extend(report)
+                    tms = None
+                    if self.bedVal:
+                        tms = self.BedprobeTms([seq for (start, end, seq)
+                                                in cands])
+                    writer.write(chrom, cands, tms, regionName)
+                    probeNum += len(cands)
+                    if cands:
+                        if firstStart is None:
+                            firstStart = cands[0][0]
+                        lastEnd = cands[-1][1]
+                    if self.verifyVal:
+                        recordCands.extend(cands)
+                if firstStart is not None:
+                    probeWindow += float((int(lastEnd) - int(firstStart))) \
+                                   / 1000
+
+                # Check the tiled record against a sequential run if desired.
+                if self.verifyVal:
+                    (seqK, seqChrom, seqCands, seqReport) = next(sequential)
+                    if recordCands != seqCands:
+                        diff = next((n for n, (c, d) in
+                                     enumerate(zip(recordCands, seqCands))
+                                     if c != d),
+                                    min(len(recordCands), len(seqCands)))
+                        raise RuntimeError('Tiled and sequential runs differ '
+                                           'on %s at candidate %d (%d vs %d '
+                                           'candidates)'
+                                           % (chrom, diff + 1,
+                                              len(recordCands), len(seqCands)))
+        finally:
+            writer.close()
+            if self.verifyVal:
+                sequential.close()
+        if self.verifyVal:
+            print('Verified tiled run against a sequential run: %d candidate '
+                  'probes identical' % probeNum)
+        if self.reportVal:
+            self.reportLog = reportLog
 
         # Print info about the results to terminal.
-        probeNum = len(cands)
         if probeNum == 0:
             print('No candidate probes discovered')
         else:
-            probeWindow = float((int(cands[-1][1]) - int(cands[0][0]))) / 1000
             probeDensity = float((float(probeNum) / probeWindow))
             print ('%d candidate probes identified in %0.2f kb yielding %0.2f '
                    'candidates/kb' % (probeNum, probeWindow, probeDensity))
@@ -745,91 +1720,84 @@ class SequenceCrawler:
                                   probeWindow, probeDensity))
                 metaText.close()
 
-        # If desired, create report file.
+        # If desired, create report files: the counters as a TSV file, every
+        # entry as an NPZ file and, unless only the summary was requested, the
+        # log with its entries rendered as they are written.
         if self.reportVal:
-            self.N_int_failCount = len(self.N_int_fail)
-            self.N_block_failCount = len(self.N_block_fail)
-            self.prohib_failCount = len(self.prohib_fail)
-            self.Tm_fail_lowCount = len(self.Tm_fail_low)
-            self.Tm_fail_highCount = len(self.Tm_fail_high)
-            self.gc_fail_lowCount = len(self.gc_fail_low)
-            self.gc_fail_highCount = len(self.gc_fail_high)
-            windowCount = (self.N_int_failCount + self.N_block_failCount \
-                           + self.prohib_failCount + self.Tm_fail_lowCount \
-                           + self.Tm_fail_highCount + self.gc_fail_lowCount \
-                           + self.gc_fail_highCount + probeNum)
-            reportOut = open('%s_blockParse_log.txt' % outName, 'w')
-            self.reportList.insert(0, 'Results produced by %s %s' \
-                                 % (scriptName, Version))
+            counts = dict(zip(reportClasses, reportLog.counts))
+            windowCount = sum(reportLog.counts[:pickProbe]) + probeNum
+            reportLog.writeSummary(outName, windowCount)
+            if self.summaryOnlyVal:
+                return
+            headerList = ['Results produced by %s %s' % (scriptName, Version)]
             if probeNum == 0:
-                self.reportList.insert(1, 'No candidate probes discovered')
+                headerList.append('No candidate probes discovered')
             else:
-                self.reportList.insert(1, '%d candidate probes identified in %0.2f '
-                                     'kb yielding %0.2f candidates/kb'
-                                     % (probeNum, probeWindow, probeDensity))
-            self.reportList.insert(2, 'Note: only the first failure encountered is '
-                                 'reported. The order of checks is \'N\' bases '
-                                 '> prohib. sequences > Tm > %G+C')
-            self.reportList.insert(3, '-' * 100)
-            self.reportList.insert(4, '%d of %d / %0.4f%% of sequence windows '
-                                 'examined resulted in candidate probes'
-                                 % (probeNum, windowCount, \
-                                    float(probeNum) / float(windowCount) * 100))
-            self.reportList.insert(5, '%d of %d / %0.4f%% of sequence windows '
-                                 'examined were skipped due to interspersed '
-                                 '\'N\' bases' \
-                                 % (self.N_int_failCount, windowCount,
-                                    float(self.N_int_failCount) \
-                                    / float(windowCount) * 100))
-            self.reportList.insert(6, '%d of %d / %0.4f%% of sequence windows '
-                                 'examined were skipped because they '
-                                 'exclusively contained \'N\' bases' \
-                                 % (self.N_block_failCount, windowCount,
-                                    float(self.N_block_failCount) \
-                                    / float(windowCount) * 100))
-            self.reportList.insert(7, '%d of %d / %0.4f%% of sequence windows '
-                                 'examined failed because they contained '
-                                 'prohibited sequences' \
-                                 % (self.prohib_failCount, windowCount,
-                                    float(self.prohib_failCount) \
-                                    / float(windowCount) * 100))
-            self.reportList.insert(8, '%d of %d / %0.4f%% of sequence windows '
-                                 'examined failed because the Tm was below %d' \
-                                 % (self.Tm_fail_lowCount, windowCount,
-                                    float(self.Tm_fail_lowCount) \
-                                    / float(windowCount) * 100, self.tm))
-            self.reportList.insert(9, '%d of %d / %0.4f%% of sequence windows '
-                                 'examined failed because the Tm was above %d' \
-                                 % (self.Tm_fail_highCount, windowCount,
-                                    float(self.Tm_fail_highCount) \
-                                    / float(windowCount) * 100, self.TM))
-            self.reportList.insert(10, '%d of %d / %0.4f%% of sequence windows '
-                                 'examined failed because the %%G+C was below '
-                                 '%d' \
-                                 % (self.gc_fail_lowCount, windowCount,
-                                    float(self.gc_fail_lowCount) \
-                                    / float(windowCount) * 100, self.gcPercent))
-            self.reportList.insert(11, '%d of %d / %0.4f%% of sequence windows '
-                                 'examined failed because the %%G+C was above '
-                                 '%d' \
-                                 % (self.gc_fail_highCount, windowCount,
-                                    float(self.gc_fail_highCount) \
-                                    / float(windowCount) * 100, self.GCPercent))
-            self.reportList.insert(12, '-' * 100)
-            reportOut.write('\n'.join(self.reportList))
-            reportOut.close()
+                headerList.append('%d candidate probes identified in %0.2f kb '
+                                  'yielding %0.2f candidates/kb'
+                                  % (probeNum, probeWindow, probeDensity))
+            headerList.append('Note: only the first failure encountered is '
+                              'reported. The order of checks is \'N\' bases '
+                              '> prohib. sequences > Tm > %G+C')
+            headerList.append('-' * 100)
+            headerList.append('%d of %d / %0.4f%% of sequence windows examined '
+                              'resulted in candidate probes'
+                              % (probeNum, windowCount,
+                                 float(probeNum) / float(windowCount) * 100))
+            for name, reason in [('N_int_fail', 'were skipped due to '
+                                  'interspersed \'N\' bases'),
+                                 ('N_block_fail', 'were skipped because they '
+                                  'exclusively contained \'N\' bases'),
+                                 ('prohib_fail', 'failed because they '
+                                  'contained prohibited sequences'),
+                                 ('Tm_fail_low', 'failed because the Tm was '
+                                  'below %d' % self.tm),
+                                 ('Tm_fail_high', 'failed because the Tm was '
+                                  'above %d' % self.TM),
+                                 ('gc_fail_low', 'failed because the %%G+C '
+                                  'was below %d' % self.gcPercent),
+                                 ('gc_fail_high', 'failed because the %%G+C '
+                                  'was above %d' % self.GCPercent)]:
+                headerList.append('%d of %d / %0.4f%% of sequence windows '
+                                  'examined %s'
+                                  % (counts[name], windowCount,
+                                     float(counts[name]) / float(windowCount)
+                                     * 100, reason))
+            headerList.append('-' * 100)
+            with open('%s_blockParse_log.txt' % outName, 'w') as reportOut:
+                reportOut.write('\n'.join(headerList))
+                limits = (self.tm, self.TM, self.gcPercent, self.GCPercent)
+                for line in reportLog.lines(limits):
+                    reportOut.write('\n')
+                    reportOut.write(line)
+
+
+def stdoutStream(bufferSize=1 << 20):
+    """Returns a binary file object writing to the original standard output
+    and points file descriptor 1 at standard error, so that candidates can be
+    piped into another program while progress messages, including those of
+    worker processes, still reach the terminal."""
+    sys.stdout.flush()
+    stream = os.fdopen(os.dup(1), 'wb', buffering=bufferSize)
+    os.dup2(2, 1)
+    return stream
 
 
 def runSequenceCrawler(inputFile, l, L, gcPercent, GCPercent, nn_table, tm, TM,
                        X, sal, form, sp, conc1, conc2, headerVal, bedVal,
                        OverlapModeVal, verbocity, reportVal, debugVal, metaVal,
-                       outNameVal):
+                       outNameVal, engineVal='crawl', workersVal=1,
+                       tileSizeVal=0, verifyVal=False, regionsVal=None,
+                       compressVal=None, summaryOnlyVal=False,
+                       outStreamVal=None):
     """Creates and runs a SequenceCrawler instance."""
 
     sc = SequenceCrawler(inputFile, l, L, gcPercent, GCPercent, nn_table, tm,
                          TM, X, sal, form, sp, conc1, conc2, headerVal, bedVal,
                          OverlapModeVal, verbocity, reportVal, debugVal,
-                         metaVal, outNameVal)
+                         metaVal, outNameVal, engineVal, workersVal,
+                         tileSizeVal, verifyVal, regionsVal, compressVal,
+                         summaryOnlyVal, outStreamVal)
     sc.run()
 
 
@@ -842,14 +1810,20 @@ def main():
 
     # Allow user to input parameters on command line.
     userInput = argparse.ArgumentParser(description=\
-        '%s version %s. Requires a FASTA file as input. Currently, only '
-        'single-entry FASTA files are supported.  Returns a .fastq file, which '
+        '%s version %s. Requires a FASTA file as input. Every entry of a '
+        'multi-entry FASTA file is mined, optionally in parallel with -w, and '
+        'the results are merged in input order. Alternatively, the target '
+        'regions listed in a BED file can be mined from a genome with '
+        '\'--regions\' and \'--genome\'. Returns a .fastq file, which '
         'can be inputted into short read alignment programs. Optionally, a '
         '.bed file can be outputted instead if \'-b\' is flagged. Tm values '
         'are corrected for [Na+] and [formamide].' % (scriptName, Version))
     requiredNamed = userInput.add_argument_group('required arguments')
-    requiredNamed.add_argument('-f', '--file', action='store', required=True,
-                               help='The FASTA file to find probes in')
+    requiredNamed.add_argument('-f', '--file', action='store', default=None,
+                               help='The FASTA file to find probes in, or a '
+                                    '.2bit genome store made by '
+                                    'genomeStore.py. Not needed with '
+                                    '\'--regions\'')
     userInput.add_argument('-l', '--minLength', action='store', default=36,
                            type=int,
                            help='The minimum allowed probe length; default is '
@@ -907,7 +1881,8 @@ def main():
     userInput.add_argument('-H', '--header', action='store', type=str,
                            help='Allows the use of a custom header in the '
                                 'format chr:start-stop. E.g. '
-                                '\'chr2:12500-13500\'')
+                                '\'chr2:12500-13500\'. Only valid for '
+                                'single-entry FASTA files')
     userInput.add_argument('-b', '--bed', action='store_true', default=False,
                            help='Output a .bed file of candidate probes '
                                 'instead of a .fastq file.')
@@ -927,9 +1902,9 @@ def main():
                                 'each window of sequence considered by the '
                                 'script. The first set of lines give the '
                                 'occurrence of each possible failure mode for '
-                                'quick reference. Off by default. Note, '
-                                'selecting this option will slow the script '
-                                'considerably')
+                                'quick reference. The counts are also written '
+                                'to a _summary.tsv file and every entry to a '
+                                '_summary.npz file. Off by default')
     userInput.add_argument('-D', '--Debug', action='store_true', default=False,
                            help='The same as -Report, but prints info to '
                                 'terminal instead of writing a log file. Off '
@@ -943,11 +1918,72 @@ def main():
                                 'probes per kb')
     userInput.add_argument('-o', '--output', action='store', default=None,
                            type=str, help='Specify the stem of the output '
-                                          'filename')
+                                          'filename, or \'-\' to write the '
+                                          'candidates to standard output, '
+                                          'e.g. to pipe them into an aligner. '
+                                          'Progress messages then go to '
+                                          'standard error')
+    userInput.add_argument('-e', '--engine', action='store', default='crawl',
+                           choices=['crawl', 'vector'],
+                           help='The candidate scanning engine. \'crawl\' '
+                                'walks the sequence one base at a time, '
+                                '\'vector\' evaluates all windows of a chunk '
+                                'at once with NumPy and returns identical '
+                                'candidates. Debug mode always uses '
+                                '\'crawl\'. Default is crawl')
+    userInput.add_argument('-w', '--workers', action='store', default=1,
+                           type=int,
+                           help='The number of worker processes used to mine '
+                                'the entries of a multi-entry FASTA file in '
+                                'parallel. Default is 1')
+    userInput.add_argument('--tileSize', action='store', default=0, type=int,
+                           help='Split entries longer than this many bases '
+                                'into tiles that are mined separately (in '
+                                'parallel with -w) and stitched back together. '
+                                'The result is identical to an untiled run. '
+                                'Ignored in Debug mode. Default is 0 (no '
+                                'tiling)')
+    userInput.add_argument('--verify', action='store_true', default=False,
+                           help='Also mine the input without tiling and stop '
+                                'with an error if the candidates differ from '
+                                'the tiled run. Off by default')
+    userInput.add_argument('--regions', action='store', default=None, type=str,
+                           help='A BED file of target regions to mine from '
+                                'the genome given with \'--genome\'. All '
+                                'regions are mined in one run and written to '
+                                'a single output file, with the BED name of '
+                                'each region carried through as an extra '
+                                'column (.bed) or read comment (.fastq)')
+    userInput.add_argument('--genome', action='store', default=None, type=str,
+                           help='The FASTA file or .2bit genome store that '
+                                'the \'--regions\' refer to')
+    userInput.add_argument('-z', '--compress', action='store', default=None,
+                           choices=['gzip', 'bgzip'],
+                           help='Compress the output file with gzip or with '
+                                'bgzip (BGZF, readable by gzip, samtools and '
+                                'tabix) and add a .gz suffix, e.g. '
+                                '.fastq.gz. Bowtie2 reads gzipped FASTQ '
+                                'directly. Off by default')
+    userInput.add_argument('--summaryOnly', action='store_true', default=False,
+                           help='In Report mode, only write the _summary.tsv '
+                                'and _summary.npz files and skip rendering '
+                                'the log. Off by default')
 
     # Import user-specified command line values.
     args = userInput.parse_args()
-    inputFile = args.file
+    if args.regions is not None:
+        if args.genome is None:
+            userInput.error('--regions requires --genome')
+        inputFile = args.genome
+    elif args.file is None:
+        userInput.error('the following arguments are required: -f/--file')
+    else:
+        inputFile = args.file
+    regionsVal = args.regions
+    compressVal = args.compress
+    summaryOnlyVal = args.summaryOnly
+    if args.output == '-' and compressVal is not None:
+        userInput.error('-z/--compress cannot be used with -o -')
     l = args.minLength
     L = args.maxLength
     gcPercent = args.min_GC
@@ -968,6 +2004,10 @@ def main():
     debugVal = args.Debug
     metaVal = args.Meta
     outNameVal = args.output
+    engineVal = args.engine
+    workersVal = args.workers
+    tileSizeVal = args.tileSize
+    verifyVal = args.verify
     nn_table = args.nn_table
 
     # Assign concentration variables based on magnitude.
@@ -985,10 +2025,17 @@ def main():
     #exec ('nn_table = mt.%s' % args.nn_table)
     nn_table = mt.DNA_NN3
 
+    # Stream the candidates to standard output if desired.
+    outStreamVal = None
+    if outNameVal == '-':
+        outStreamVal = stdoutStream()
+
     runSequenceCrawler(inputFile, l, L, gcPercent, GCPercent, nn_table, tm, TM,
                        X, sal, form, sp, conc1, conc2, headerVal, bedVal, 
                        OverlapModeVal, verbocity, reportVal, debugVal, metaVal,
-                       outNameVal)
+                       outNameVal, engineVal, workersVal, tileSizeVal,
+                       verifyVal, regionsVal, compressVal, summaryOnlyVal,
+                       outStreamVal)
 
     # Print wall-clock runtime to terminal.
     print('Program took %f seconds' % (timeit.default_timer() - startTime))
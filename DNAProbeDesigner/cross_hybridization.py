@@ -0,0 +1,231 @@
+import heapq
+import numpy as np
+from Bio.SeqUtils import MeltingTemp as mt
+try:
+    from DNAProbeDesigner.probeTable import readProbes, writeProbes
+    from DNAProbeDesigner.foldEnergies import getFoldEnergies
+    from DNAProbeDesigner.tmEngine import tmCodes
+except ImportError:
+    from probeTable import readProbes, writeProbes
+    from foldEnergies import getFoldEnergies
+    from tmEngine import tmCodes
+
+# length of the perfectly complementary stretch two probes must share to be scored as a pair #
+SEED_LENGTH = 10
+# duplex free energy in kcal/mol at or below which two probes of a pool are taken to hybridize, about that of #
+# 15 perfectly paired bases #
+CROSS_HYB_DG = -20.0
+# largest number of k-mer matches expanded, and of candidate pairs scored, at a time #
+SEED_BLOCK_SIZE = 2000000
+SCORE_BLOCK_SIZE = 50000
+# energy of a step of a duplex that no table covers (two mismatches in a row, or past the end of a probe), #
+# high enough that no duplex reaches across it #
+BARRIER = 1000.0
+
+###################################################################################################
+
+def probe_codes(seqs):
+    '''
+    Codes the bases of probes for the k-mer index and the duplex energies.
+        Arguments:
+            - seqs [list] : probe sequences
+        Outputs:
+            - codes [np.ndarray] : (n, longest length) base codes, A, C, G, T as 0 to 3 and 4 for any other base
+                                   and past the end of each probe
+            - lengths [np.ndarray] : probe lengths
+    '''
+    lengths = np.array([len(seq) for seq in seqs], dtype=np.int64)
+    codes = np.full((len(seqs), max(lengths.max(initial=0), 1)), 4, dtype=np.uint8)
+    if len(seqs):
+        flat = tmCodes[np.frombuffer(''.join(seqs).upper().encode('latin-1'), dtype=np.uint8)]
+        rows = np.repeat(np.arange(len(seqs)), lengths)
+        columns = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        codes[rows, columns] = flat
+    return codes, lengths
+
+###################################################################################################
+
+def candidate_pairs(codes, k=SEED_LENGTH):
+    '''
+    Finds the pairs of probes that share a perfectly complementary stretch of k bases, from an index of the k-mers
+    of all probes that is searched with the reverse complement of every k-mer, in near-linear time.
+        Arguments:
+            - codes [np.ndarray] : base codes of the probes, from probe_codes
+            - k [int] : seed length, at most 31 (default = SEED_LENGTH)
+        Outputs:
+            - a, b [np.ndarray] : indices of the two probes of each pair, a < b
+            - d [np.ndarray] : diagonal of the pair, along which base x of probe a pairs with base d - x of probe b
+    '''
+    (n, width) = codes.shape
+    windows = width - k + 1
+    if n < 2 or windows < 1:
+        return tuple(np.zeros(0, dtype=np.int64) for _ in range(3))
+    # k-mers as 2 bits per base, read 5' to 3' and, for the reverse complement, 3' to 5' on the complement #
+    forward = np.zeros((n, windows), dtype=np.int64)
+    reverse = np.zeros((n, windows), dtype=np.int64)
+    valid = np.ones((n, windows), dtype=bool)
+    for t in range(k):
+        base = codes[:, t:t + windows].astype(np.int64)
+        valid &= base < 4
+        forward |= (base & 3) << (2 * (k - 1 - t))
+        reverse |= (3 - (base & 3)) << (2 * t)
+    (probe, position) = np.nonzero(valid)
+    order = np.argsort(forward[probe, position], kind='stable')
+    (keys, seed_probe, seed_position) = (forward[probe, position][order], probe[order], position[order])
+    # every k-mer that is the reverse complement of an indexed one, with the range of its matches #
+    queries = reverse[probe, position]
+    first = np.searchsorted(keys, queries, side='left')
+    counts = np.searchsorted(keys, queries, side='right') - first
+    hit = counts > 0
+    (probe, position, first, counts) = (probe[hit], position[hit], first[hit], counts[hit])
+
+    # the matches are expanded a block at a time, and each (a, b, diagonal) is kept once #
+    span = 2 * width
+    found = [np.zeros(0, dtype=np.int64)]
+    ends = np.cumsum(counts)
+    start = 0
+    while start < len(counts):
+        stop = max(start + 1, int(np.searchsorted(ends, (ends[start - 1] if start else 0) + SEED_BLOCK_SIZE)))
+        block = slice(start, stop)
+        repeats = counts[block]
+        match = np.repeat(first[block] - np.cumsum(repeats) + repeats, repeats) + np.arange(repeats.sum())
+        a = seed_probe[match]
+        b = np.repeat(probe[block], repeats)
+        d = seed_position[match] + np.repeat(position[block], repeats) + k - 1
+        keep = a < b
+        found.append(np.unique((a[keep] * n + b[keep]) * span + d[keep]))
+        start = stop
+    pairs = np.unique(np.concatenate(found))
+    return (pairs // span // n, pairs // span % n, pairs % span)
+
+###################################################################################################
+
+def duplex_energies(codes, lengths, a, b, d, temp=37.0):
+    '''
+    Calculates the free energy of the most stable duplex of each candidate pair along its diagonal, from the
+    nearest-neighbor stacks and single internal mismatches of seqfold's DNA tables, with duplex initiation and
+    terminal A/T penalties.
+        Arguments:
+            - codes [np.ndarray] : base codes of the probes, from probe_codes
+            - lengths [np.ndarray] : probe lengths
+            - a, b, d [np.ndarray] : candidate pairs, from candidate_pairs
+            - temp [float] : hybridization temperature in C (default = 37)
+        Outputs:
+            - dGs [np.ndarray] : duplex free energies in kcal/mol
+    '''
+    energies = getFoldEnergies(temp)
+    init = energies.dG(*mt.DNA_NN4['init'])
+    terminal_AT = energies.dG(*mt.DNA_NN4['init_A/T'])
+    width = codes.shape[1]
+    dGs = np.empty(len(a))
+    t = np.arange(width)
+    for start in range(0, len(a), SCORE_BLOCK_SIZE):
+        block = slice(start, start + SCORE_BLOCK_SIZE)
+        (A, B, D) = (a[block, None], b[block, None], d[block, None])
+        # base x of probe a pairs with base d - x of probe b, from the first to the last base both probes cover #
+        x = np.maximum(0, D - lengths[B] + 1) + t
+        y = D - x
+        inside = (x < lengths[A]) & (y >= 0)
+        top = np.where(inside, codes[A, np.minimum(x, width - 1)], 4).astype(np.intp)
+        bottom = np.where(inside, codes[B, np.clip(y, 0, width - 1)], 4).astype(np.intp)
+        paired = (top < 4) & (top + bottom == 3)
+        # steps 'ab/cd' from each pair to the next, as stacks or half of a single mismatch #
+        key = ((top[:, :-1] * 5 + top[:, 1:]) * 5 + bottom[:, :-1]) * 5 + bottom[:, 1:]
+        step = energies.stacks.take(key)
+        step = np.where(np.isnan(step), energies.internalMismatches.take(key), step)
+        step = np.where(np.isnan(step), BARRIER, step)
+        cumulative = np.zeros(top.shape)
+        cumulative[:, 1:] = np.cumsum(step, axis=1)
+        # the lowest duplex starts and ends on a pair, with a penalty for each A/T end #
+        penalty = np.where(paired & ((top == 0) | (top == 3)), terminal_AT, 0.0)
+        opened = np.maximum.accumulate(np.where(paired, cumulative - penalty, -np.inf), axis=1)
+        dGs[block] = np.where(paired, cumulative + penalty - opened, np.inf).min(axis=1) + init
+    return dGs
+
+###################################################################################################
+
+def greedy_removal(count, a, b):
+    '''
+    Picks probes to remove so that no offending pair is left, always removing the probe in the most remaining
+    pairs (the later probe of a tie).
+        Arguments:
+            - count [int] : number of probes
+            - a, b [np.ndarray] : indices of the probes of each offending pair
+        Outputs:
+            - removed [np.ndarray] : boolean mask of the removed probes
+    '''
+    neighbors = [[] for _ in range(count)]
+    for (i, j) in zip(a.tolist(), b.tolist()):
+        neighbors[i].append(j)
+        neighbors[j].append(i)
+    degree = np.array([len(probes) for probes in neighbors], dtype=np.int64)
+    removed = np.zeros(count, dtype=bool)
+    heap = [(-int(degree[i]), -i) for i in np.flatnonzero(degree)]
+    heapq.heapify(heap)
+    while heap:
+        (negative_degree, negative_index) = heapq.heappop(heap)
+        i = -negative_index
+        # entries left behind by earlier removals are skipped #
+        if removed[i] or -negative_degree != degree[i] or degree[i] == 0:
+            continue
+        removed[i] = True
+        for j in neighbors[i]:
+            if not removed[j]:
+                degree[j] -= 1
+                if degree[j]:
+                    heapq.heappush(heap, (-int(degree[j]), -j))
+    return removed
+
+###################################################################################################
+
+def filter_cross_hybridization(bed_filename, filter_dG=CROSS_HYB_DG, k=SEED_LENGTH, temp=37.0, drop=True):
+    '''
+    Screens a probe pool for probes that hybridize to each other. Candidate pairs share a perfectly complementary
+    stretch of k bases; only those are scored, by the nearest-neighbor free energy of their most stable duplex.
+    Probes are removed greedily until no pair is at or below filter_dG. Writes the offending pairs to a
+    _xhyb_pairs.tsv file and the probes to a new .bed file, without the removed probes, or with every probe if
+    they are only flagged.
+        Arguments:
+            - bed_filename [str] : relative path to .bed file of the probes, as written by filter_secondary_structure
+            - filter_dG [float] : duplex free energy threshold in kcal/mol (default = CROSS_HYB_DG)
+            - k [int] : seed length; duplexes without k consecutive pairs are not found (default = SEED_LENGTH)
+            - temp [float] : hybridization temperature in C (default = 37)
+            - drop [bool] : remove the probes picked by the greedy pass, or only flag them in the pairs file
+                            (default = True)
+    '''
+    try:
+        filter_dG = float(filter_dG)
+    except ValueError:
+        raise TypeError(f"Duplex free energy must be a float, unacceptable value: {filter_dG}")
+    if not 1 <= k <= 31:
+        raise ValueError(f"Seed length must be between 1 and 31, unacceptable value: {k}")
+    table = readProbes(bed_filename)
+    seqs = [seq.decode() for seq in table['seq']]
+
+    # score only the pairs sharing a seed, and remove the fewest probes that leaves no offending pair #
+    (codes, lengths) = probe_codes(seqs)
+    (a, b, d) = candidate_pairs(codes, k)
+    dGs = duplex_energies(codes, lengths, a, b, d, temp)
+    offending = dGs <= filter_dG
+    (a, b, dGs) = (a[offending], b[offending], dGs[offending])
+    # a pair found along several diagonals is reported with its most stable duplex #
+    order = np.lexsort((dGs, b, a))
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = (a[order][1:] != a[order][:-1]) | (b[order][1:] != b[order][:-1])
+    (a, b, dGs) = (a[order][first], b[order][first], dGs[order][first])
+    removed = greedy_removal(len(seqs), a, b)
+
+    # write the offending pairs as probe numbers with their duplex energies and which probes are removed #
+    stem = bed_filename.split('_pDup_MFE_filtered')[0]
+    with open(stem + '_xhyb_pairs.tsv', 'w') as file:
+        file.write('probe_a\tprobe_b\tdG\tremoved\n')
+        for (i, j, dG) in zip(a.tolist(), b.tolist(), dGs.tolist()):
+            dropped = [str(table['number'][probe]) for probe in (i, j) if removed[probe]]
+            file.write(f"{table['number'][i]}\t{table['number'][j]}\t{round(dG, 2)}\t{','.join(dropped)}\n")
+
+    kept = ~removed if drop else np.ones(len(seqs), dtype=bool)
+    table = np.array(table[kept])
+    output_filename = stem + '_pDup_MFE_xhyb_filtered.bed'
+    header = (f'{len(table)} probes passed filtering with thresholds set to T=XXXC and PDup=XXX and MFE=XXX and '
+              f'cross-hybridization dG={filter_dG} ({int(removed.sum())} flagged) \n')
+    writeProbes(output_filename, header, table)
@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+# --------------------------------------------------------------------------
+# dedupFastq.py
+#
+# Removes reads with identical sequences from the FASTQ file of blockParse
+# before alignment. Repeats, segmental duplications and Overlap Mode give
+# many candidates with the same sequence; each distinct sequence is aligned
+# once and outputClean fans the alignments back out to every original locus
+# using the map of duplicates written here, giving the same output as
+# aligning every candidate.
+# --------------------------------------------------------------------------
+
+# Specific script name.
+scriptName = 'dedupFastq'
+
+# Import module for handling input arguments.
+import argparse
+
+# Import modules for reading from standard input and writing to standard
+# output.
+import os
+import sys
+
+# Import groupby for collecting the alignments of each read.
+from itertools import groupby
+
+# Import timeit module to estimate the wall clock time of the run.
+import timeit
+
+
+class DuplicateMap:
+    """The reads removed by dedupFastq. Each duplicate is stored under its
+    anchor, the next read in the original order that was kept (None at the
+    end), together with the kept read of the same sequence. Duplicates can
+    be added while the alignments are expanded, as long as they are added
+    before their anchor is passed to the aligner; complete is set once all
+    duplicates have been added."""
+
+    def __init__(self):
+        self.anchors = {}
+        self.added = {}
+        self.count = 0
+        self.complete = False
+
+    def add(self, name, repName, anchorName):
+        self.anchors.setdefault(anchorName, []).append((name, repName))
+        self.added[repName] = self.added.get(repName, 0) + 1
+        self.count += 1
+
+    def write(self, fileName):
+        """Writes the duplicates as tab-separated name, kept read and anchor
+        ('*' at the end), in their original order."""
+        with open(fileName, 'w') as f:
+            for anchorName, dups in self.anchors.items():
+                for (name, repName) in dups:
+                    f.write('%s\t%s\t%s\n' % (name, repName,
+                                              '*' if anchorName is None
+                                              else anchorName))
+
+    @classmethod
+    def read(cls, fileName):
+        """Loads the duplicates written by write()."""
+        dupMap = cls()
+        with open(fileName) as f:
+            for line in f:
+                (name, repName, anchorName) = line.rstrip('\r\n').split('\t')
+                dupMap.add(name, repName, None if anchorName == '*'
+                           else anchorName)
+        dupMap.complete = True
+        return dupMap
+
+    def expand(self, records):
+        """Yields the SamRecords of the deduplicated reads with, before each
+        anchor and at the end, the alignments of the kept read repeated for
+        every duplicate under the coordinates of the duplicate. This
+        restores the alignments of every candidate in the original order.
+        Alignments of kept reads are held until their duplicates are
+        written, or, while duplicates are still being added, for every
+        read."""
+        saved = {}
+        emitted = {}
+        pruned = False
+
+        def fanOut(anchorName):
+            for (name, repName) in self.anchors.pop(anchorName, ()):
+                (chrom, _, span) = name.partition(':')
+                (start, _, stop) = span.partition('-')
+                for rec in saved.get(repName, ()):
+                    yield rec._replace(chrom=chrom, start=start, stop=stop)
+                emitted[repName] = emitted.get(repName, 0) + 1
+                if self.complete and emitted[repName] == self.added[repName]:
+                    saved.pop(repName, None)
+
+        for key, group in groupby(records, key=lambda rec:
+                                  (rec.chrom, rec.start, rec.stop)):
+            name = '%s:%s-%s' % key
+            yield from fanOut(name)
+            group = list(group)
+            yield from group
+            if self.complete and not pruned:
+                saved = {repName: recs for repName, recs in saved.items()
+                         if emitted.get(repName, 0) < self.added.get(repName,
+                                                                     0)}
+                pruned = True
+            if not self.complete or \
+               emitted.get(name, 0) < self.added.get(name, 0):
+                saved[name] = group
+        yield from fanOut(None)
+
+
+def fastqReads(lines):
+    """Yields (header, seq, qual) of each read of a FASTQ file given as an
+    iterable of byte lines, without the line endings."""
+    lines = iter(lines)
+    for header in lines:
+        header = header.rstrip(b'\r\n')
+        if not header:
+            continue
+        seq = next(lines).rstrip(b'\r\n')
+        next(lines)
+        qual = next(lines).rstrip(b'\r\n')
+        yield header, seq, qual
+
+
+def dedupFastq(lines, outStream, dupMap, batchSize=4096):
+    """Writes the first read of each distinct sequence of a FASTQ file to a
+    binary stream and adds every later read with the same sequence to the
+    DuplicateMap. Returns the numbers of reads and of distinct sequences."""
+    seen = {}
+    pending = []
+    batch = []
+    readNum = 0
+    for header, seq, qual in fastqReads(lines):
+        readNum += 1
+        name = header[1:].split(None, 1)[0].decode()
+        repName = seen.get(seq)
+        if repName is not None:
+            pending.append((name, repName))
+            continue
+        seen[seq] = name
+        # Duplicates have to be known before their anchor is aligned.
+        for (dupName, dupRep) in pending:
+            dupMap.add(dupName, dupRep, name)
+        pending = []
+        batch.append(b'%s\n%s\n+\n%s\n' % (header, seq, qual))
+        if len(batch) >= batchSize:
+            outStream.write(b''.join(batch))
+            batch = []
+    for (dupName, dupRep) in pending:
+        dupMap.add(dupName, dupRep, None)
+    outStream.write(b''.join(batch))
+    outStream.flush()
+    dupMap.complete = True
+    return readNum, len(seen)
+
+
+def main():
+    """Given a FASTQ file produced by blockParse, writes a FASTQ file with
+    one read per distinct sequence and the map of removed duplicates for
+    outputClean's --dups option."""
+
+    startTime = timeit.default_timer()
+
+    # Allow user to input parameters on command line.
+    userInput = argparse.ArgumentParser(description=\
+        '%s. Requires a .fastq file from blockParse as input. Writes a '
+        '.fastq file keeping the first read of each distinct sequence and a '
+        '_dups.tsv file listing the removed reads. Align the .fastq file as '
+        'usual and pass the _dups.tsv file to outputClean with --dups to '
+        'apply the results to every candidate.' % scriptName)
+    requiredNamed = userInput.add_argument_group('required arguments')
+    requiredNamed.add_argument('-f', '--file', action='store', required=True,
+                               help='The .fastq file to be processed, or '
+                                    '\'-\' to read standard input')
+    requiredNamed.add_argument('-o', '--output', action='store',
+                               required=True, type=str,
+                               help='Specify the stem of the output filenames. '
+                                    'With \'-o -\' the reads are written to '
+                                    'standard output and -m names the map')
+    userInput.add_argument('-m', '--map', action='store', default=None,
+                           type=str,
+                           help='The file to write the map of duplicates '
+                                'to, default is the output stem + _dups.tsv')
+
+    # Import user-specified command line values.
+    args = userInput.parse_args()
+    if args.output == '-':
+        if args.map is None:
+            userInput.error('-m/--map is required with -o -')
+        # Progress messages go to standard error.
+        sys.stdout.flush()
+        outStream = os.fdopen(os.dup(1), 'wb')
+        os.dup2(2, 1)
+    else:
+        outStream = open('%s.fastq' % args.output, 'wb')
+    mapName = args.map or '%s_dups.tsv' % args.output
+
+    dupMap = DuplicateMap()
+    if args.file == '-':
+        (readNum, distinctNum) = dedupFastq(sys.stdin.buffer, outStream,
+                                            dupMap)
+    else:
+        with open(args.file, 'rb') as f:
+            (readNum, distinctNum) = dedupFastq(f, outStream, dupMap)
+    outStream.close()
+    dupMap.write(mapName)
+
+    # Print info about the results to terminal.
+    print('dedupFastq kept %d of %d / %0.4f%% reads as distinct sequences'
+          % (distinctNum, readNum,
+             float(distinctNum) / float(max(readNum, 1)) * 100))
+
+    # Print wall-clock runtime to terminal.
+    print('Program took %f seconds' % (timeit.default_timer() - startTime))
+
+if __name__ == '__main__':
+    main()
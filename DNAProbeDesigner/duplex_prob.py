@@ -1,81 +1,136 @@
 import numpy as np
 import os
 import matplotlib.pyplot as plt
-from sklearn.discriminant_analysis import LinearDiscriminantAnalysis
-from Bio.SeqUtils import GC
+from matplotlib.collections import LineCollection
+from matplotlib.colors import LogNorm
+try:
+    from DNAProbeDesigner.ldaModel import ldaScorer
+    from DNAProbeDesigner.probeTable import newTable, writeProbes, readProbes
+except ImportError:
+    from ldaModel import ldaScorer
+    from probeTable import newTable, writeProbes, readProbes
 
 ###################################################################################################
 
-def calc_duplex_prob(sam_filename, bed_filename, temp):
+# characters allowed in probe sequences, removed by str.translate to check a sequence #
+GATC_TABLE = str.maketrans('', '', 'GATC')
+
+# number of probes above which all probes are plotted as a density heatmap instead of curves #
+PLOT_AGGREGATE_THRESHOLD = 5000
+# probability bins of the density heatmap, and quantiles drawn over it as bands and median #
+PLOT_DENSITY_BINS = 100
+PLOT_QUANTILES = [0.05, 0.25, 0.5, 0.75, 0.95]
+
+###################################################################################################
+
+def read_probeset(bed_filename):
     '''
-    Calculates probability of all probes in a probeset forming a duplex with target sequence at a given temp.
+    Reads the probe sequences of a probeset BED file.
         Arguments:
-            - sam_filename [str] : relative path to .sam file containing alignment scores for probe candidates
             - bed_filename [str] : relative path to .bed file containing sequences of final probeset
-            - temp [int] : temp at which to predict duplex probability
         Outputs:
-            - probs [np.ndarray] : duplex probabilities of probes in probeset
+            - probeset [list] : probe sequences in file order
     '''
-    # read in final probeset BED file #
     with open(bed_filename) as file:
-        probeset = [line.split('\t')[3] for line in file]
+        return [line.split('\t')[3] for line in file]
+
+###################################################################################################
+
+def gc_content(seqs):
+    '''
+    Calculates the GC content of many sequences at once, as Bio.SeqUtils.GC does for sequences of G, A, T, C.
+        Arguments:
+            - seqs [list] : probe sequences
+        Outputs:
+            - GC_content [np.ndarray] : percentage of G and C in each sequence
+    '''
+    lengths = np.array([len(seq) for seq in seqs], dtype=np.int64)
+    bases = np.frombuffer(''.join(seqs).encode(), dtype=np.uint8)
+    is_GC = (bases == ord('G')) | (bases == ord('C'))
+    # GC count of each sequence from the running count at the sequence boundaries #
+    counts = np.concatenate([[0], np.cumsum(is_GC)])
+    ends = np.cumsum(lengths)
+    GC_counts = counts[ends] - counts[ends - lengths]
+    return np.divide(GC_counts * 100.0, lengths, out=np.zeros(len(seqs)), where=lengths > 0)
 
-    # read and check SAM file format #
+###################################################################################################
+
+def calc_duplex_probs(sam_filename, probeset):
+    '''
+    Calculates probability of all probes in a probeset forming a duplex with target sequence at all six temps.
+    The SAM file is read and checked once, its records are joined to the probeset through a hash index of the
+    probe sequences, and all temps are scored from one feature matrix.
+        Arguments:
+            - sam_filename [str] : relative path to .sam file containing alignment scores for probe candidates
+            - probeset [list] : sequences of final probeset, e.g. from read_probeset
+        Outputs:
+            - rows [np.ndarray] : index in the probeset of the probe of each SAM record of a probe in the probeset,
+                                  in SAM file order
+            - probs [np.ndarray] : (n, 6) duplex probabilities of these records, one column per temp in ldaScorer.temps
+    '''
+    probe_index = {}
+    for k, seq in enumerate(probeset):
+        probe_index.setdefault(seq, k)
+
+    # read and check SAM file format, keeping the records of probes in the probeset #
+    rows = []
+    align_scores = []
     with open(sam_filename) as file:
-        sam = []
         for line in file:
             parts = line.split('\t')
             # should be 19 columns #
             if len(parts) < 19:
                 raise ValueError("SAM file format is incorrect.")
             # probe sequence should only have GATC #
-            if not set(parts[9]).issubset(set("GATC")):
+            probe_seq = parts[9]
+            if probe_seq.translate(GATC_TABLE):
                 raise ValueError("Probe sequence must contain only G, A, T, C in SAM file.")
             # alignment score format checking #
             if ':' not in parts[12]:
                 raise ValueError("Alignment score in SAM file does not contain expected characters.")
             align_parts = parts[12].split(':')
             if len(align_parts) < 3 or not align_parts[2].isnumeric():
-                raise ValueError("Alignment score format is incorrect in SAM file.") 
-            sam.append(line)
+                raise ValueError("Alignment score format is incorrect in SAM file.")
 
-    
-    # set up LDA model to predict duplex probability based on probe length, GC content, and alignment score to target seq #
-    # Values from models published in Beliveau, et al. (2018) #
-    temps = np.array([32, 37, 42, 47, 52, 57])
-    if temp not in temps:
-        raise ValueError(f"Invalid temperature value: {temp}. Valid values are {temps}")
-    coefs = np.array([[-0.14494789, 0.18791679, 0.02588474],
-                    [-0.13364364, 0.22510179, 0.05494031],
-                    [-0.09006122, 0.25660706, 0.1078303],
-                    [-0.01593182, 0.24498485, 0.15753649],
-                    [0.01860365, 0.1750174, 0.17003374],
-                    [0.03236755, 0.11624593, 0.24306498]])
-    intercepts = np.array([-1.17545204, -5.40436344, -12.45549846,
-                        -19.32670233, -20.11992898, -23.98652919])
-    classes = np.array([-1, 1])
-
-    # initialize LDA model with temp-specific parameters #
-    index = np.where(temps==temp)
-    clf = LinearDiscriminantAnalysis()
-    clf.coef_ = coefs[index]
-    clf.intercept_ = intercepts[index]
-    clf.classes_ = classes
+            row = probe_index.get(probe_seq)
+            if row is not None:
+                rows.append(row)
+                align_scores.append(int(align_parts[2]))
 
     # collate inputs for LDA model as [probe length, alignment score, GC content] #
-    clf_inputs = []
-    for k in range(len(sam)):
-        probe_seq = sam[k].split('\t')[9]
-        align_score = sam[k].split('\t')[12].split(':')[2]
-        GC_content = GC(probe_seq)
+    # LDA model predicting duplex probability from probe length, GC content, and alignment score to target seq #
+    # Values from models published in Beliveau, et al. (2018) #
+    seqs = [probeset[row] for row in rows]
+    clf_inputs = np.empty((len(seqs), 3))
+    clf_inputs[:, 0] = [len(seq) for seq in seqs]
+    clf_inputs[:, 1] = align_scores
+    clf_inputs[:, 2] = gc_content(seqs)
+
+    # predict probabilities of forming a duplex #
+    probs = ldaScorer.probs(clf_inputs)
+
+    return np.array(rows, dtype=np.int64), probs
 
-        if probe_seq in probeset:
-            clf_inputs.append([len(probe_seq), int(align_score), GC_content])
+###################################################################################################
+
+def calc_duplex_prob(sam_filename, bed_filename, temp):
+    '''
+    Calculates probability of all probes in a probeset forming a duplex with target sequence at a given temp.
+        Arguments:
+            - sam_filename [str] : relative path to .sam file containing alignment scores for probe candidates
+            - bed_filename [str] : relative path to .bed file containing sequences of final probeset
+            - temp [int] : temp at which to predict duplex probability
+        Outputs:
+            - probs [np.ndarray] : duplex probabilities of probes in probeset
+    '''
+    # read in final probeset BED file, and SAM file scored at all temps #
+    (rows, probs) = calc_duplex_probs(sam_filename, read_probeset(bed_filename))
 
-    # predict probabilities (results are [prob_no_dup, prob_dup]) #
-    probs = (clf.predict_proba(clf_inputs))[:, 1]
+    temps = np.array(ldaScorer.temps)
+    if temp not in temps:
+        raise ValueError(f"Invalid temperature value: {temp}. Valid values are {temps}")
 
-    return probs
+    return probs[:, ldaScorer.tempIndex(temp)]
 
 ###################################################################################################
 
@@ -105,6 +160,10 @@ def filter_duplex_prob(sam_filename, bed_filename, filter_temp, filter_prob):
     # read and check BED file format #
     with open(bed_filename) as file:
         seqs = []
+        chroms = []
+        starts = []
+        ends = []
+        Tms = []
         for line in file:
             parts = line.split('\t')
             if len(parts) < 5:
@@ -133,59 +192,109 @@ def filter_duplex_prob(sam_filename, bed_filename, filter_temp, filter_prob):
             except ValueError:
                 raise ValueError("Score must be a floating-point number in BED file.")
             
-            # store the sequence
+            # store the sequence, coordinates and Tm #
             seqs.append(sequence)
+            chroms.append(parts[0])
+            starts.append(start)
+            ends.append(end)
+            Tms.append(score)
 
-    # collate probabilities #
-    temps = [32, 37, 42, 47, 52, 57]
-
-    # run the duplex prob calculation #
-    all_probs = [calc_duplex_prob(sam_filename, bed_filename, temp) for temp in temps]
-    all_probs = np.swapaxes(all_probs, 0, 1)
+    # run the duplex prob calculation at all temps #
+    (rows, all_probs) = calc_duplex_probs(sam_filename, seqs)
 
-    # filter out probes which do not meet temp / prob thresholds #
+    # filter out probes which do not meet temp / prob thresholds, keeping each sequence with its probabilities #
     filter_temp = int(filter_temp)
-    temp_to_index = {32: 0, 37: 1, 42:2, 47: 3, 52: 4, 57: 5}
-    all_probs = np.array([probs for probs in all_probs if probs[temp_to_index[filter_temp]] > filter_prob])
+    passed = all_probs[:, ldaScorer.tempIndex(filter_temp)] > filter_prob
+    rows = rows[passed]
+    table = newTable([seqs[row] for row in rows], all_probs[passed], [chroms[row] for row in rows],
+                     np.array(starts)[rows], np.array(ends)[rows], np.array(Tms)[rows])
 
     # for probes which passed filter, write sequences and probabilities to a .bed file #
+    # as probe_number, probe_sequence, and duplex_probabilities, with the table of the probes as .npy sidecar #
     output_filename = bed_filename.split('.')[0] + '_pDup_filtered.bed'
-    with open(output_filename, 'w') as file:
-        # header line #
-        file.write(f'{len(all_probs)} probes passed filtering with thresholds set to T={filter_temp}C and PDup={filter_prob} \n')
-        # write as probe_number, probe_sequence, and duplex_probabilities #
-        for k, seq, probs in zip(range(len(seqs)), seqs, all_probs):
-            file.write(f'{k+1} \t {seq} \t {[round(prob, 8) for prob in probs]} \n')
+    header = f'{len(table)} probes passed filtering with thresholds set to T={filter_temp}C and PDup={filter_prob} \n'
+    writeProbes(output_filename, header, table)
 
 ###################################################################################################
 
-def plot_duplex_prob(filtered_filename, probe_num='all'):
+def plot_probe_curves(temps, all_probs):
+    '''
+    Draws the duplex probability curves of all probes as a single LineCollection, more transparent the more probes there are.
+        Arguments:
+            - temps [list] : temperatures of the probability columns
+            - all_probs [np.ndarray] : (n, 6) duplex probabilities of the probes
+    '''
+    segments = np.stack([np.broadcast_to(np.asarray(temps, dtype=np.float64), all_probs.shape), all_probs], axis=-1)
+    colors = plt.rcParams['axes.prop_cycle'].by_key()['color']
+    alpha = min(1.0, max(0.05, 20 / max(len(all_probs), 1)))
+    plt.gca().add_collection(LineCollection(segments, colors=[colors[k % len(colors)] for k in range(len(segments))],
+                                            alpha=alpha))
+    # collections do not rescale the axes #
+    plt.xlim([temps[0], temps[-1]])
+
+###################################################################################################
+
+def plot_probe_density(temps, all_probs, bins=PLOT_DENSITY_BINS):
+    '''
+    Draws the distribution of duplex probabilities at each temp as a 2D density heatmap, with quantile bands.
+    The counts of all temps are taken in one bincount, so drawing time does not grow with the number of probes.
+        Arguments:
+            - temps [list] : temperatures of the probability columns
+            - all_probs [np.ndarray] : (n, 6) duplex probabilities of the probes
+            - bins [int] : number of probability bins
+    '''
+    # count the probes in each (temp, probability bin) cell #
+    prob_bins = np.clip((np.asarray(all_probs) * bins).astype(np.int64), 0, bins - 1)
+    cells = prob_bins + bins * np.arange(len(temps))
+    counts = np.bincount(cells.ravel(), minlength=bins * len(temps)).reshape(len(temps), bins)
+
+    # each temp is a column centered on it, spanning half the distance to its neighbours #
+    temps = np.asarray(temps, dtype=np.float64)
+    mids = (temps[1:] + temps[:-1]) / 2
+    temp_edges = np.concatenate([[2 * temps[0] - mids[0]], mids, [2 * temps[-1] - mids[-1]]])
+    masked = np.ma.masked_equal(counts.T, 0)
+    mesh = plt.pcolormesh(temp_edges, np.linspace(0, 1, bins + 1), masked, cmap='viridis',
+                          norm=LogNorm(vmin=1, vmax=max(counts.max(), 2)))
+    plt.colorbar(mesh, label='Number of Probes')
+
+    # quantile bands around the median #
+    quantiles = np.quantile(all_probs, PLOT_QUANTILES, axis=0)
+    for k in range(len(PLOT_QUANTILES) // 2):
+        plt.fill_between(temps, quantiles[k], quantiles[-k - 1], color='w', alpha=0.2,
+                         label=f'{PLOT_QUANTILES[k]:.0%}-{PLOT_QUANTILES[-k - 1]:.0%} of Probes')
+    return quantiles[len(PLOT_QUANTILES) // 2]
+
+###################################################################################################
+
+def plot_duplex_prob(filtered_filename, probe_num='all', aggregate=None):
     '''
     Plots probabilities of probe forming a duplex with target sequence at all 6 temps.
+    All probes are drawn as individual curves up to PLOT_AGGREGATE_THRESHOLD probes and as a density heatmap above it.
         Arguments:
             - filtered_filename [str] : relative path to .txt file containing sequences and probabilities for filtered probes
             - probe_num [int] : choose to plot duplex prob for a single probe (default = 'all')
+            - aggregate [bool] : draw the density heatmap (True) or the curves (False) of all probes
+                                 (default = None, by number of probes)
     '''
-    # read in seqs and probs #
-    with open(filtered_filename, 'r') as file:
-        next(file)
-        seqs = [line.split('\t')[1].strip() for line in file]
-    with open(filtered_filename, 'r') as file:
-        next(file)
-        all_probs = [line.split('\t')[2:] for line in file]
-
-    # formatting probs back to floats #
-    all_probs = [probs[0].split(',') for probs in all_probs]
-    all_probs = [[float(prob.strip(' [').strip('] \n')) for prob in probs] for probs in all_probs]
+    # read in seqs and probs, from the .npy sidecar of the file if there is one #
+    table = readProbes(filtered_filename)
+    seqs = table['seq']
+    all_probs = table['probs']
 
     # set temps
     temps = [32, 37, 42, 47, 52, 57]
 
-    # plot all probes #
+    # plot all probes, with their median #
     if probe_num == 'all':
+        if aggregate is None:
+            aggregate = len(all_probs) > PLOT_AGGREGATE_THRESHOLD
         plt.figure(figsize=(8, 6))
-        for k in range(len(all_probs)):
-            plt.plot(temps, all_probs[k])
+        if aggregate and len(all_probs):
+            median = plot_probe_density(temps, all_probs)
+        else:
+            plot_probe_curves(temps, all_probs)
+            median = np.median(all_probs, axis=0) if len(all_probs) else np.full(len(temps), np.nan)
+        plt.plot(temps, median, color='r', label=f'Median of {len(all_probs)} Probes')
         plt.xticks(temps)
         plt.ylim([-0.075, 1])
         plt.xlabel('Temperature (C)', size=15)
@@ -195,10 +304,10 @@ def plot_duplex_prob(filtered_filename, probe_num='all'):
         plt.legend()
         plt.show()
 
-    # single probe #
+    # single probe, probe_num counting from 1 #
     elif type(probe_num) == int:
         plt.figure(figsize=(8, 6))
-        plt.plot(temps, all_probs[probe_num], label=f'Probe {probe_num}: {seqs[probe_num - 1]}')
+        plt.plot(temps, all_probs[probe_num - 1], label=f'Probe {probe_num}: {seqs[probe_num - 1].decode()}')
         plt.xticks(temps)
         plt.ylim([-0.075, 1])
         plt.xlabel('Temperature (C)', size=15)
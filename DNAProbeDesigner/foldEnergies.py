@@ -0,0 +1,257 @@
+#!/usr/bin/env python
+# --------------------------------------------------------------------------
+# foldEnergies.py
+#
+# The DNA energy model of seqfold (SantaLucia and Hicks, 2004), for the
+# NumPy folding code of secondary_structure and foldEngine. The nearest
+# neighbor, mismatch and dangling end tables are Biopython's MeltingTemp
+# tables, which seqfold uses with both orientations of every key and two
+# corrected stacks; the loop tables are seqfold's. FoldEnergies turns them
+# into free energies at a folding temperature, as dense arrays indexed by
+# base codes, so the energies of many sequences and positions are looked up
+# at once. seqfold folds sequences without any T with its RNA parameters
+# instead, which are not modelled here.
+# --------------------------------------------------------------------------
+
+# Import the math module.
+import math
+
+# Import Biopython modules.
+from Bio.SeqUtils import MeltingTemp as mt
+
+# Import numpy module.
+import numpy as np
+
+# Integer codes for the bases: A, C, G, T and 4 for anything else.
+try:
+    from DNAProbeDesigner.tmEngine import tmCodes
+except ImportError:
+    from tmEngine import tmCodes
+
+# Code of the '.' of dangling end keys, which shares the code of other bases.
+endCode = 4
+
+# Stacks that seqfold corrects in the SantaLucia and Hicks (2004) table.
+foldStacks = {'TA/AT': (-7.2, -21.3), 'GG/CC': (-8.0, -19.9)}
+
+# Enthalpies and entropies of the hairpin tri- and tetraloops with known
+# values, keyed by the loop with its closing pair.
+triTetraLoops = {
+    'AGAAT': (-1.5, 0.0), 'AGCAT': (-1.5, 0.0), 'AGGAT': (-1.5, 0.0),
+    'AGTAT': (-1.5, 0.0), 'CGAAG': (-2.0, 0.0), 'CGCAG': (-2.0, 0.0),
+    'CGGAG': (-2.0, 0.0), 'CGTAG': (-2.0, 0.0), 'GGAAC': (-2.0, 0.0),
+    'GGCAC': (-2.0, 0.0), 'GGGAC': (-2.0, 0.0), 'GGTAC': (-2.0, 0.0),
+    'TGAAA': (-1.5, 0.0), 'TGCAA': (-1.5, 0.0), 'TGGAA': (-1.5, 0.0),
+    'TGTAA': (-1.5, 0.0), 'AAAAAT': (0.5, 0.6), 'AAAACT': (0.7, -1.6),
+    'AAACAT': (1.0, -1.6), 'ACTTGT': (0.0, -4.2), 'AGAAAT': (-1.1, -1.6),
+    'AGAGAT': (-1.1, -1.6), 'AGATAT': (-1.5, -1.6), 'AGCAAT': (-1.6, -1.6),
+    'AGCGAT': (-1.1, -1.6), 'AGCTTT': (0.2, -1.6), 'AGGAAT': (-1.1, -1.6),
+    'AGGGAT': (-1.1, -1.6), 'AGGGGT': (0.5, -0.6), 'AGTAAT': (-1.6, -1.6),
+    'AGTGAT': (-1.1, -1.6), 'AGTTCT': (0.8, -1.6), 'ATTCGT': (-0.2, -1.6),
+    'ATTTGT': (0.0, -1.6), 'ATTTTT': (-0.5, -1.6), 'CAAAAG': (0.5, 1.3),
+    'CAAACG': (0.7, 0.0), 'CAACAG': (1.0, 0.0), 'CAACCG': (0.0, 0.0),
+    'CCTTGG': (0.0, -2.6), 'CGAAAG': (-1.1, 0.0), 'CGAGAG': (-1.1, 0.0),
+    'CGATAG': (-1.5, 0.0), 'CGCAAG': (-1.6, 0.0), 'CGCGAG': (-1.1, 0.0),
+    'CGCTTG': (0.2, 0.0), 'CGGAAG': (-1.1, 0.0), 'CGGGAG': (-1.0, 0.0),
+    'CGGGGG': (0.5, 1.0), 'CGTAAG': (-1.6, 0.0), 'CGTGAG': (-1.1, 0.0),
+    'CGTTCG': (0.8, 0.0), 'CTTCGG': (-0.2, 0.0), 'CTTTGG': (0.0, 0.0),
+    'CTTTTG': (-0.5, 0.0), 'GAAAAC': (0.5, 3.2), 'GAAACC': (0.7, 0.0),
+    'GAACAC': (1.0, 0.0), 'GCTTGC': (0.0, -2.6), 'GGAAAC': (-1.1, 0.0),
+    'GGAGAC': (-1.1, 0.0), 'GGATAC': (-1.6, 0.0), 'GGCAAC': (-1.6, 0.0),
+    'GGCGAC': (-1.1, 0.0), 'GGCTTC': (0.2, 0.0), 'GGGAAC': (-1.1, 0.0),
+    'GGGGAC': (-1.1, 0.0), 'GGGGGC': (0.5, 1.0), 'GGTAAC': (-1.6, 0.0),
+    'GGTGAC': (-1.1, 0.0), 'GGTTCC': (0.8, 0.0), 'GTTCGC': (-0.2, 0.0),
+    'GTTTGC': (0.0, 0.0), 'GTTTTC': (-0.5, 0.0), 'GAAAAT': (0.5, 3.2),
+    'GAAACT': (1.0, 0.0), 'GAACAT': (1.0, 0.0), 'GCTTGT': (0.0, -1.6),
+    'GGAAAT': (-1.1, 0.0), 'GGAGAT': (-1.1, 0.0), 'GGATAT': (-1.6, 0.0),
+    'GGCAAT': (-1.6, 0.0), 'GGCGAT': (-1.1, 0.0), 'GGCTTT': (-0.1, 0.0),
+    'GGGAAT': (-1.1, 0.0), 'GGGGAT': (-1.1, 0.0), 'GGGGGT': (0.5, 1.0),
+    'GGTAAT': (-1.6, 0.0), 'GGTGAT': (-1.1, 0.0), 'GTATAT': (-0.5, 0.0),
+    'GTTCGT': (-0.4, 0.0), 'GTTTGT': (-0.4, 0.0), 'GTTTTT': (-0.5, 0.0),
+    'TAAAAA': (0.5, -0.3), 'TAAACA': (0.7, -1.6), 'TAACAA': (1.0, -1.6),
+    'TCTTGA': (0.0, -4.2), 'TGAAAA': (-1.1, -1.6), 'TGAGAA': (-1.1, -1.6),
+    'TGATAA': (-1.6, -1.6), 'TGCAAA': (-1.6, -1.6), 'TGCGAA': (-1.1, -1.6),
+    'TGCTTA': (0.2, -1.6), 'TGGAAA': (-1.1, -1.6), 'TGGGAA': (-1.1, -1.6),
+    'TGGGGA': (0.5, -0.6), 'TGTAAA': (-1.6, -1.6), 'TGTGAA': (-1.1, -1.6),
+    'TGTTCA': (0.8, -1.6), 'TTTCGA': (-0.2, -1.6), 'TTTTGA': (0.0, -1.6),
+    'TTTTTA': (-0.5, -1.6), 'TAAAAG': (0.5, 1.6), 'TAAACG': (1.0, -1.6),
+    'TAACAG': (1.0, -1.6), 'TCTTGG': (0.0, -3.2), 'TGAAAG': (-1.0, -1.6),
+    'TGAGAG': (-1.0, -1.6), 'TGATAG': (-1.5, -1.6), 'TGCAAG': (-1.5, -1.6),
+    'TGCGAG': (-1.0, -1.6), 'TGCTTG': (-0.1, -1.6), 'TGGAAG': (-1.0, -1.6),
+    'TGGGAG': (-1.0, -1.6), 'TGGGGG': (0.5, -0.6), 'TGTAAG': (-1.5, -1.6),
+    'TGTGAG': (-1.0, -1.6), 'TTTCGG': (-0.4, -1.6), 'TTTTAG': (-1.0, -1.6),
+    'TTTTGG': (-0.4, -1.6), 'TTTTTG': (-0.5, -1.6),
+}
+
+# Entropies of hairpin, bulge and internal loops of 1 to 30 nucleotides, in
+# cal/(K mol). The enthalpies of all loops are 0.
+hairpinLoopS = [0.0, 0.0, -11.3, -11.3, -10.6, -12.9, -13.5, -13.9, -14.5,
+                -14.8, -15.5, -16.1, -16.1, -16.4, -16.8, -17.1, -17.4, -17.7,
+                -18.1, -18.4, -18.7, -18.7, -19.0, -19.3, -19.7, -19.7, -19.7,
+                -20.0, -20.0, -20.3]
+bulgeLoopS = [-12.9, -9.4, -10.0, -10.3, -10.6, -11.3, -11.9, -12.6, -13.2,
+              -13.9, -14.2, -14.5, -14.8, -15.5, -15.8, -16.1, -16.4, -16.8,
+              -16.8, -17.1, -17.4, -17.4, -17.7, -17.7, -18.1, -18.1, -18.4,
+              -18.7, -18.7, -19.0]
+internalLoopS = [0.0, 0.0, -10.3, -11.6, -12.9, -14.2, -14.8, -15.5, -15.8,
+                 -15.8, -16.1, -16.8, -16.4, -17.4, -17.7, -18.1, -18.4, -18.7,
+                 -18.7, -19.0, -19.0, -19.3, -19.7, -20.0, -20.3, -20.3, -20.6,
+                 -21.0, -21.0, -21.3]
+
+# Multibranch loop penalty: a constant, a term per branch, a term per
+# unpaired nucleotide and the term used instead when none is unpaired.
+multibranch = (2.6, 0.2, 0.2, 2.0)
+
+# Universal gas constant in kcal/(K mol), as used by seqfold.
+gasConstant = 1.9872e-3
+
+# FoldEnergies built so far, see getFoldEnergies.
+foldEnergies = {}
+
+
+def bothStrands(table):
+    """A nearest neighbor table with the key of each entry read from the
+    other strand added, as seqfold looks them up. Keys that are already in
+    the table keep their values."""
+    both = {key[::-1]: value for key, value in table.items()}
+    both.update(table)
+    return both
+
+
+def getFoldEnergies(temp=37.0):
+    """Returns the FoldEnergies at a temperature, building them on first
+    use."""
+    temp = float(temp)
+    if temp not in foldEnergies:
+        foldEnergies[temp] = FoldEnergies(temp)
+    return foldEnergies[temp]
+
+
+class FoldEnergies:
+    """Free energies in kcal/mol of the terms of seqfold's DNA model at a
+    folding temperature in C. Stacks, mismatches and dangling ends are
+    (5, 5, 5, 5) arrays indexed by the codes of the four bases of a key
+    'ab/cd', with endCode for '.' and NaN for keys without a value; loop
+    penalties are arrays indexed by loop length."""
+
+    def __init__(self, temp=37.0):
+        self.temp = float(temp)
+        self.kelvin = self.temp + 273.15
+        self.stacks = self.denseTable(dict(mt.DNA_NN4, **foldStacks))
+        self.internalMismatches = self.denseTable(mt.DNA_IMM1)
+        self.terminalMismatches = self.denseTable(mt.DNA_TMM1)
+        self.danglingEnds = self.denseTable(mt.DNA_DE1)
+        # Bonus of the tri- and tetraloops, indexed by the base 4 number of
+        # the loop with its closing pair, and 0 for the others.
+        self.triLoops = np.zeros(4 ** 5)
+        self.tetraLoops = np.zeros(4 ** 6)
+        for loop, (dH, dS) in triTetraLoops.items():
+            loops = self.triLoops if len(loop) == 5 else self.tetraLoops
+            loops[int(''.join(str(tmCodes[ord(base)]) for base in loop),
+                      4)] = self.dG(dH, dS)
+        self.multibranch = multibranch
+
+    def dG(self, dH, dS):
+        """Free energy of an enthalpy in kcal/mol and an entropy in
+        cal/(K mol)."""
+        return dH - self.kelvin * (dS / 1000.0)
+
+    def denseTable(self, table):
+        dense = np.full((5, 5, 5, 5), np.nan)
+        for key, (dH, dS) in bothStrands(table).items():
+            if len(key) == 5 and key[2] == '/' and not \
+               (key[:2] + key[3:]).strip('ACGT.'):
+                index = tuple(endCode if base == '.' else tmCodes[ord(base)]
+                              for base in key[:2] + key[3:])
+                dense[index] = self.dG(dH, dS)
+        return dense
+
+    def loopEnergies(self, entropies, maxLength):
+        """Penalties of loops of 0 to maxLength nucleotides. Loops longer
+        than the table are extrapolated from the longest one as by seqfold;
+        length 0 is infinite."""
+        energies = np.full(max(maxLength, len(entropies)) + 1, np.inf)
+        energies[1:len(entropies) + 1] = [self.dG(0.0, dS)
+                                          for dS in entropies]
+        longest = self.dG(0.0, entropies[-1])
+        for length in range(len(entropies) + 1, len(energies)):
+            energies[length] = longest + 2.44 * gasConstant * self.kelvin * \
+                math.log(length / float(len(entropies)))
+        return energies
+
+    def hairpinLoops(self, maxLength):
+        return self.loopEnergies(hairpinLoopS, maxLength)
+
+    def bulgeLoops(self, maxLength):
+        return self.loopEnergies(bulgeLoopS, maxLength)
+
+    def internalLoops(self, maxLength):
+        return self.loopEnergies(internalLoopS, maxLength)
+
+    def stackKeys(self, codes, rows, i, i1, j, j1):
+        """Keys 'ab/cd' of the bases at positions i, i1, j and j1 of rows of
+        codes, (n, length) base codes of sequences of the same length, as
+        flat indices of the (5, 5, 5, 5) tables. Positions before or after
+        a sequence are read as '.'."""
+        length = codes.shape[1]
+        # Bases with the ends coded as '.'.
+        padded = np.full((len(codes), length + 2), endCode, dtype=np.intp)
+        padded[:, 1:-1] = codes
+        offsets = rows * (length + 2) + 1
+        base = [padded.take(offsets + np.clip(index, -1, length))
+                for index in (i, i1, j, j1)]
+        return ((base[0] * 5 + base[1]) * 5 + base[2]) * 5 + base[3]
+
+    def stackEnergies(self, codes, rows, i, i1, j, j1):
+        """Energies of the stacks of pairs (i, j) and (i1, j1) of rows of
+        codes, as seqfold gives them for a helix, a single mismatch, a
+        bulge of 1 or a dangling end (an index of -1), including the
+        dangling ends next to the ends of the sequences. Stacks beyond the
+        ends are 0; stacks missing from the tables are NaN."""
+        length = codes.shape[1]
+        pair = self.stackKeys(codes, rows, i, i1, j, j1)
+        nn = self.stacks.take(pair)
+        internal = np.where(np.isnan(nn), self.internalMismatches.take(pair),
+                            nn)
+        terminal = np.where(np.isnan(nn), self.terminalMismatches.take(pair),
+                            nn)
+        end = np.full_like(i, -1)
+        left = np.nan_to_num(self.danglingEnds.take(
+            self.stackKeys(codes, rows, i - 1, i, end, j)))
+        right = np.nan_to_num(self.danglingEnds.take(
+            self.stackKeys(codes, rows, end, i, j + 1, j)))
+        stacks = np.where((i > 0) & (j < length - 1), internal,
+                          terminal + np.where((i > 0) & (j == length - 1),
+                                              left, 0)
+                          + np.where((i == 0) & (j < length - 1), right, 0))
+        stacks = np.where((i == -1) | (i1 == -1) | (j == -1) | (j1 == -1),
+                          self.danglingEnds.take(pair), stacks)
+        return np.where((i >= length) | (i1 >= length) | (j >= length)
+                        | (j1 >= length), 0.0, stacks)
+
+    def hairpinEnergies(self, codes, rows, i, j):
+        """Energies of the hairpins closed by pairs (i, j) of rows of codes
+        with only A/C/G/T, as seqfold gives them: the penalty of the loop
+        length, the bonus of known tri- and tetraloops, the terminal
+        mismatch of loops over 3 and the A closing penalty of triloops.
+        Hairpins of less than 3 are infinite."""
+        length = codes.shape[1]
+        loop = j - i - 1
+        bases = codes.astype(np.intp)
+        offsets = rows * length
+        base = lambda index: bases.take(offsets + np.clip(index, 0,
+                                                          length - 1))
+        hairpins = self.hairpinLoops(length)[np.clip(loop, 0, length)]
+        # Known loops, by the base 4 number of the loop with its closing
+        # pair.
+        for (size, loops) in ((3, self.triLoops), (4, self.tetraLoops)):
+            number = sum(base(i + k) << 2 * (size + 1 - k)
+                         for k in range(size + 2))
+            hairpins = hairpins + np.where(loop == size, loops.take(number),
+                                           0)
+        mismatch = self.terminalMismatches.take(
+            self.stackKeys(codes, rows, i, i + 1, j, j - 1))
+        hairpins = hairpins + np.where(loop > 3, np.nan_to_num(mismatch), 0)
+        closingA = (base(i) == 0) | (base(j) == 0)
+        hairpins = hairpins + np.where((loop == 3) & closingA, 0.5, 0)
+        return np.where(loop >= 3, hairpins, np.inf)
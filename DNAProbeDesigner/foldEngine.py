@@ -0,0 +1,568 @@
+#!/usr/bin/env python
+# --------------------------------------------------------------------------
+# foldEngine.py
+#
+# Minimum free energies of DNA probes by the Zuker recursions of seqfold,
+# folding a batch of sequences of the same length at once. The V and W
+# matrices of the whole batch are filled span by span with NumPy, so every
+# sequence of a batch is folded by the same array operations. The energies
+# are those of foldEnergies, and the recursions follow seqfold's, including
+# the way it builds the branches of multibranch loops, its penalty of 16
+# kcal/mol for isolated pairs and its -inf for sequences without any pair.
+# The matrices are filled with unrounded energies; seqfold.dg then sums the
+# loops of its traceback, each rounded to 0.1 kcal/mol, which fold() does
+# the same way, so the MFEs are those of seqfold.dg exactly. Sequences that
+# seqfold folds with its RNA parameters (those without any T) or that hold
+# bases other than A/C/G/T are passed on to seqfold.
+# --------------------------------------------------------------------------
+
+# Import numpy module.
+import numpy as np
+
+# Import seqfold, for the sequences this engine does not fold.
+import seqfold
+
+# Energy tables and integer codes for the bases: A, C, G, T and 4 for
+# anything else.
+try:
+    from DNAProbeDesigner.foldEnergies import getFoldEnergies
+    from DNAProbeDesigner.tmEngine import tmCodes
+except ImportError:
+    from foldEnergies import getFoldEnergies
+    from tmEngine import tmCodes
+
+# Sequences folded together, which bounds the memory of a batch to a few
+# hundred MB for 40-mers.
+foldBatchSize = 256
+
+# Energy of a pair stacked neither on its outer nor on its inner side.
+isolatedPair = 1600.0
+
+# Kinds of the structures of V and W that seqfold's traceback tells apart:
+# hairpins, and multibranch loops of W (bifurcations).
+hairpinKind = 1
+bifurcationKind = 2
+
+# Engines built so far, see getFoldEngine.
+foldEngines = {}
+
+
+def getFoldEngine(temp=37.0):
+    """Returns the FoldEngine at a temperature, building it on first use."""
+    temp = float(temp)
+    if temp not in foldEngines:
+        foldEngines[temp] = FoldEngine(temp)
+    return foldEngines[temp]
+
+
+def deElse(ulNZ, ur, full, right):
+    """Dangling end energy seqfold gives a branch of a multibranch loop that
+    is followed by another branch, from whether bases are unpaired before
+    it, the number ur unpaired after it and its stacks with both or only
+    its 3' neighbour."""
+    return np.where(ur == 0, 0.0,
+                    np.where(ulNZ, full,
+                             np.where(ur == 1, np.minimum(right, full),
+                                      right)))
+
+
+def concatLists(P, Q, M):
+    """Concatenates groups of lists of pairs. P and Q (..., groups, width)
+    hold the pairs of each list, M (..., groups) their counts; the lists of
+    a group are joined in order into (..., width) arrays with their
+    counts."""
+    width = P.shape[-1]
+    offsets = np.cumsum(M, axis=-1) - M
+    keep = np.arange(width) < M[..., None]
+    where = np.nonzero(keep)
+    position = offsets[where[:-1]] + where[-1]
+    keep = position < width
+    outP = np.zeros(P.shape[:-2] + (width,), dtype=P.dtype)
+    outQ = np.zeros_like(outP)
+    index = tuple(axis[keep] for axis in where[:-2]) + (position[keep],)
+    outP[index] = P[where][keep]
+    outQ[index] = Q[where][keep]
+    return (outP, outQ, M.sum(axis=-1))
+
+
+class FoldEngine:
+    """Minimum free energies of sequences at a folding temperature in C, as
+    seqfold.dg gives them. mfes() handles a list of sequences of any
+    lengths, foldBatch() a batch of base codes of the same length."""
+
+    def __init__(self, temp=37.0):
+        self.temp = float(temp)
+        self.energies = getFoldEnergies(self.temp)
+
+    def mfes(self, seqs):
+        """MFEs of a list of sequences in kcal/mol."""
+        seqs = [seq.upper() for seq in seqs]
+        MFEs = np.full(len(seqs), np.nan)
+        lengths = np.array([len(seq) for seq in seqs], dtype=np.int64)
+        folded = np.zeros(len(seqs), dtype=bool)
+        for length in np.unique(lengths):
+            where = np.flatnonzero(lengths == length)
+            codes = tmCodes[np.frombuffer(''.join(seqs[k] for k in where)
+                                          .encode('latin-1'), dtype=np.uint8)
+                            ].reshape(len(where), length)
+            # seqfold folds sequences without T with RNA parameters.
+            valid = (codes < 4).all(axis=1) & (codes == 3).any(axis=1)
+            where = where[valid]
+            codes = codes[valid]
+            for start in range(0, len(where), foldBatchSize):
+                batch = where[start:start + foldBatchSize]
+                MFEs[batch] = self.foldBatch(codes[start:start +
+                                                   foldBatchSize])
+                folded[batch] = True
+        for k in np.flatnonzero(~folded):
+            MFEs[k] = seqfold.dg(seqs[k], self.temp)
+        return MFEs
+
+    def pairGrids(self, codes, closes):
+        """Energies of the loop terms of the pairs (i, j) that close, as
+        (length, length, n) arrays that are infinite elsewhere."""
+        energies = self.energies
+        grids = {}
+        (i, j, rows) = np.nonzero(closes)
+
+        def grid(values, fill=np.inf):
+            full = np.full(closes.shape, fill)
+            full[i, j, rows] = values
+            return full
+
+        stack = lambda *index: energies.stackEnergies(codes, rows, *index)
+        raw = lambda table, *index: table.take(
+            energies.stackKeys(codes, rows, *index))
+        end = np.full_like(i, -1)
+        grids['hairpin'] = grid(energies.hairpinEnergies(codes, rows, i, j))
+        grids['stack'] = grid(np.nan_to_num(stack(i, i + 1, j, j - 1),
+                                            nan=np.inf))
+        grids['mismatch'] = grid(np.nan_to_num(
+            stack(i, i + 2, j, j - 2) + stack(i + 1, i + 2, j - 1, j - 2),
+            nan=np.inf))
+        grids['bulgeLeft'] = grid(np.nan_to_num(stack(i, i + 2, j, j - 1),
+                                                nan=np.inf))
+        grids['bulgeRight'] = grid(np.nan_to_num(stack(i, i + 1, j, j - 2),
+                                                 nan=np.inf))
+        grids['mismatchOut'] = grid(np.nan_to_num(
+            raw(energies.terminalMismatches, i, i + 1, j, j - 1), nan=np.inf))
+        grids['mismatchIn'] = grid(np.nan_to_num(
+            raw(energies.terminalMismatches, i - 1, i, j + 1, j), nan=np.inf))
+        # Dangling ends of the branches and closing pairs of multibranch
+        # loops.
+        danglings = {'full': (i - 1, i, j + 1, j), 'right': (end, i, j + 1, j),
+                     'closing': (i, end, j, j - 1),
+                     'open': (i, i + 1, j, end), 'five': (i - 1, i, end, j)}
+        for name, index in danglings.items():
+            grids[name] = grid(np.nan_to_num(stack(*index)), 0.0)
+        return grids
+
+    def foldBatch(self, codes):
+        """MFEs of (n, length) base codes of sequences of the same length
+        with only A/C/G/T and at least one T."""
+        if codes.shape[1] < 5:
+            return np.full(len(codes), -np.inf)
+        return BatchFold(self, codes).fold()
+
+
+
+
+class BatchFold:
+    """The V and W matrices of a batch of sequences of the same length,
+    filled span by span by fold(). The matrices are (length, length, n)
+    arrays indexed by (i, j, sequence).
+
+    The structures are kept as entries of a table with a row for the V of
+    every pair and for the multibranch loop of the W of every cell, each
+    with the pairs of the structure, the list of pairs that seqfold takes
+    from it as branches of a multibranch loop and the terms of that list
+    needed to join branches into loops. W points to the entry of its
+    structure, which it shares with the cells it was taken from."""
+
+    def __init__(self, engine, codes):
+        self.energies = engine.energies
+        (self.count, self.length) = codes.shape
+        self.width = self.length // 5 + 1
+        bases = codes.T.astype(np.intp)
+        self.hasA = bases == 0
+        canPair = bases[:, None, :] + bases[None, :, :] == 3
+        (I, J) = np.indices((self.length, self.length))
+        self.closes = canPair & (J - I >= 4)[..., None]
+        # Pairs stacked on their outer (i - 1, j + 1) and inner
+        # (i + 1, j - 1) sides.
+        self.outer = np.zeros_like(canPair)
+        self.outer[1:, :-1] = canPair[:-1, 1:]
+        self.inner = np.zeros_like(canPair)
+        self.inner[:-1, 1:] = canPair[1:, :-1]
+        self.grids = engine.pairGrids(codes, self.closes)
+        self.leastDangle = min(0.0, *(self.grids[name].min() for name in
+                                      ('full', 'right', 'closing', 'open',
+                                       'five')))
+        self.bulges = self.energies.bulgeLoops(self.length)
+        self.internals = self.energies.internalLoops(self.length)
+
+        shape = (self.length, self.length, self.count)
+        self.V = np.full(shape, np.inf)
+        self.W = np.full(shape, np.inf)
+        # Entry of V of (i, j) is i * length + j, that of the multibranch
+        # loop of W of (i, j) is length ** 2 more. W of a cell without
+        # structure points to the empty entry of V of the cell.
+        self.bifurcations = self.length ** 2
+        self.entry = np.broadcast_to(
+            (I * self.length + J)[..., None], shape).astype(np.int32)
+        table = (2 * self.bifurcations, self.count)
+        # Pairs of the structures and branch lists, as the (i, j) of each
+        # pair with the count of pairs, and the kinds of the structures.
+        (self.structs, self.lists) = (
+            tuple(np.zeros(table + (self.width,), dtype=np.int16)
+                  for _ in range(2)) + (np.zeros(table, dtype=np.int16),)
+            for _ in range(2))
+        self.kinds = np.zeros(table, dtype=np.int8)
+        # Terms of the branch lists: the energies of the W of the branches,
+        # the dangling ends of all but the last and the bases unpaired
+        # after them, the first and last pairs, whether bases are unpaired
+        # before the last, the dangling ends of the first with and without
+        # bases unpaired before it and the stacks of the last.
+        self.terms = {name: np.zeros(table) for name in
+                      ('energy', 'dangles', 'first', 'firstOpen', 'full',
+                       'right')}
+        self.terms.update({name: np.zeros(table, dtype=np.int16) for name in
+                           ('unpaired', 'p1', 'q1', 'pm', 'qm')})
+        self.terms['lastOpen'] = np.ones(table, dtype=bool)
+
+    def fold(self):
+        """MFEs of the batch, as seqfold.dg gives them: the sum of the
+        energies of the loops of the traceback of W of the whole sequence,
+        each rounded to 0.1 kcal/mol, or -inf for sequences without any
+        pair."""
+        (length, count) = (self.length, self.count)
+        for span in range(4, length):
+            cells = length - span
+            (cell, rows) = np.nonzero(self.closes[np.arange(cells),
+                                                  np.arange(span, length)])
+            self.pairs(cell, cell + span, rows, span)
+            cell = np.repeat(np.arange(cells), count)
+            rows = np.tile(np.arange(count), cells)
+            self.loops(cell, cell + span, rows, span)
+        MFEs = np.where(self.closes.any(axis=(0, 1)), np.inf, -np.inf)
+        for r in np.flatnonzero(np.isfinite(self.W[0, length - 1])):
+            structs = self.traceback(0, length - 1, r)
+            MFEs[r] = round(sum(e for (i, j, e) in structs), 2)
+        return MFEs
+
+    def store(self, entry, r, structs, branches, kind):
+        """Stores the structures and branch lists of entries of sequences
+        r, with the terms of the lists."""
+        for (arrays, values) in ((self.structs, structs),
+                                 (self.lists, branches)):
+            for (array, value) in zip(arrays, values):
+                array[entry, r] = value
+        self.kinds[entry, r] = kind
+        self.summarize(entry, r)
+
+    def pairs(self, i, j, r, span):
+        """Fills V of the pairs (i, j) of sequences r that close."""
+        if len(i) == 0:
+            return
+        isoOut = ~self.outer[i, j, r]
+        isolated = isoOut & ~self.inner[i, j, r]
+        hairpin = self.grids['hairpin'][i, j, r]
+        (interior, i1, j1) = self.interior(i, j, r, span)
+        (loop, k) = self.multibranch(i, j, r, span, True,
+                                     np.minimum(hairpin, interior))
+        # Multibranch loops are refused for pairs that stack on neither
+        # side, away from the ends of the sequence.
+        loop = np.where(isoOut & (i > 0) & (j < self.length - 1), np.inf,
+                        loop)
+        options = np.stack([hairpin, interior, loop])
+        choice = np.where(isolated, -1, np.argmin(options, axis=0))
+        energy = np.where(isolated, isolatedPair,
+                          np.choose(np.maximum(choice, 0), options))
+        self.V[i, j, r] = energy
+        # The structure of a stack, bulge or internal loop is its inner
+        # pair, which is also its branch.
+        stacked = (choice == 1) & np.isfinite(energy)
+        P = np.zeros((len(i), self.width), dtype=np.int16)
+        Q = np.zeros_like(P)
+        (P[:, 0], Q[:, 0]) = (np.where(stacked, i1, 0),
+                              np.where(stacked, j1, 0))
+        pairs = (P, Q, stacked)
+        entry = i * self.length + j
+        self.store(entry, r, pairs, pairs,
+                   np.where((choice == 0) & np.isfinite(energy), hairpinKind,
+                            0))
+        looped = np.flatnonzero((choice == 2) & np.isfinite(energy))
+        if len(looped):
+            (i, j, r) = (i[looped], j[looped], r[looped])
+            self.store(entry[looped], r,
+                       *self.branchLists(i, k[looped], j, r, True), 0)
+
+    def interior(self, i, j, r, span):
+        """Lowest stacks, bulges and internal loops closed by pairs (i, j)
+        of sequences r, with their inner pairs. Of loops of the same
+        energy, the first in seqfold's order, by i1 then by j1, is
+        kept."""
+        if span < 6:
+            return (np.full(len(i), np.inf), i, j)
+        size = span - 5
+        (ll, t) = np.nonzero(np.add.outer(np.arange(size), np.arange(size))
+                             < size)
+        lr = span - 6 - ll - t
+        order = ll * size + t
+        grids = self.grids
+        (I, J, R) = (i[:, None], j[:, None], r[:, None])
+        best = []
+        # Internal loops other than single mismatches.
+        loops = (ll > 0) & (lr > 0) & ~((ll == 1) & (lr == 1))
+        (LL, LR) = (ll[loops], lr[loops])
+        (I1, J1) = (I + 1 + LL, J - 1 - LR)
+        energy = (self.internals[LL + LR] + 0.3 * np.abs(LL - LR))[None] + \
+            grids['mismatchOut'][I, J, R] + grids['mismatchIn'][I1, J1, R]
+        energy = np.where(self.outer[I1, J1, R], np.inf, energy)
+        best.append((energy + self.V[I1, J1, R], order[loops]))
+        # Stacks, bulges and single mismatches.
+        (LL, LR) = (ll[~loops], lr[~loops])
+        (I1, J1) = (I + 1 + LL, J - 1 - LR)
+        anyA = self.hasA[I, R] | self.hasA[J, R] | self.hasA[I1, R] | \
+            self.hasA[J1, R]
+        bulge = self.bulges[LL + LR] + np.where(
+            LL + LR == 1, np.where(LL == 1, grids['bulgeLeft'][I, J, R],
+                                   grids['bulgeRight'][I, J, R]), 0) + \
+            0.5 * anyA
+        mismatch = np.where(self.outer[I1, J1, R], np.inf,
+                            grids['mismatch'][I, J, R])
+        energy = np.where((LL == 0) & (LR == 0), grids['stack'][I, J, R],
+                          np.where((LL == 0) | (LR == 0), bulge, mismatch))
+        best.append((energy + self.V[I1, J1, R], order[~loops]))
+
+        picked = []
+        for (energy, order) in best:
+            if energy.shape[1] == 0:
+                picked.append((np.full(len(i), np.inf),
+                               np.zeros(len(i), dtype=np.intp)))
+                continue
+            index = np.argmin(energy, axis=1)
+            picked.append((np.take_along_axis(energy, index[:, None],
+                                              axis=1)[:, 0], order[index]))
+        # Internal loops are refused next to a stack.
+        internal = np.where(self.inner[i, j, r], np.inf, picked[0][0])
+        (other, otherOrder) = picked[1]
+        first = (other < internal) | ((other == internal) &
+                                      (otherOrder < picked[0][1]))
+        energy = np.where(first, other, internal)
+        order = np.where(first, otherOrder, picked[0][1])
+        i1 = i + 1 + order // size
+        return (energy, i1, i1 + 4 + order % size)
+
+    def multibranch(self, i, j, r, span, helix, limit):
+        """Lowest multibranch loops of cells (i, j) of sequences r: closed
+        by the pair for a helix, or the two structures of W on either side
+        of a split k otherwise. Of loops of the same energy, the first k is
+        kept. Loops that cannot be lower than the limits of the cells, the
+        lowest of their other structures, are left out."""
+        offsets = np.arange(4 + helix, span - 4 - helix)
+        energies = np.full((len(i), len(offsets)), np.inf)
+        if energies.size == 0:
+            return (energies.min(axis=1, initial=np.inf), i)
+        (closing, branch, unpaired, noneUnpaired) = self.energies.multibranch
+        grids = self.grids
+        terms = self.terms
+        M = self.lists[2]
+        k = i[:, None] + offsets
+        R = r[:, None]
+        left = (self.entry[i[:, None] + helix, k, R], R)
+        right = (self.entry[k + 1, j[:, None] - helix, R], R)
+        # Every branch and the closing pair have dangling ends of at least
+        # leastDangle.
+        branches = M[left].astype(np.intp) + M[right]
+        bound = terms['energy'][left] + terms['energy'][right] + closing + \
+            min(noneUnpaired, 2 * branch) + \
+            (branches + helix) * self.leastDangle - 1e-9
+        W = self.W
+        finite = np.isfinite(W[i[:, None] + helix, k, R]) & \
+            np.isfinite(W[k + 1, j[:, None] - helix, R])
+        (cell, split) = np.nonzero(finite & (branches >= 2) &
+                                   (bound < limit[:, None]))
+        start = i
+        if len(cell) == 0:
+            return (energies[:, 0], start)
+        (i, j, r, k) = (i[cell], j[cell], r[cell], k[cell, split])
+        left = (self.entry[i + helix, k, r], r)
+        right = (self.entry[k + 1, j - helix, r], r)
+        mL = M[left].astype(np.intp)
+        mR = M[right].astype(np.intp)
+        (hasL, hasR) = (mL > 0, mR > 0)
+        both = hasL & hasR
+        # Bases between the last branch of the left side and the first of
+        # the right side.
+        gap = terms['p1'][right].astype(np.intp) - terms['qm'][left] - 1
+        lastL = deElse(terms['lastOpen'][left], gap, terms['full'][left],
+                       terms['right'][left])
+        correction = np.where((gap == 0) & (mR >= 2), terms['firstOpen'][right]
+                              - terms['first'][right], 0)
+        (dangleL, dangleR) = (terms['dangles'][left], terms['dangles'][right])
+        energy = np.where(both, dangleL + lastL + dangleR + correction,
+                          np.where(hasL, dangleL, dangleR))
+        (unpL, unpR) = (terms['unpaired'][left].astype(np.intp),
+                        terms['unpaired'][right].astype(np.intp))
+        unp = np.where(both, unpL + gap + unpR, np.where(hasL, unpL, unpR))
+        branches = mL + mR
+        if helix:
+            side = lambda name: np.where(hasR, terms[name][right],
+                                         terms[name][left])
+            qm = side('qm').astype(np.intp)
+            p1 = np.where(hasL, terms['p1'][left],
+                          terms['p1'][right]).astype(np.intp)
+            q1 = np.where(hasL, terms['q1'][left],
+                          terms['q1'][right]).astype(np.intp)
+            ul = np.where(mR >= 2, terms['lastOpen'][right],
+                          np.where(mR == 1, ~hasL | (gap != 0),
+                                   terms['lastOpen'][left]))
+            # The last branch is followed by the closing pair, which is
+            # followed by the first branch.
+            ur = j - qm - 1
+            rightLast = side('right')
+            energy = energy + np.where(
+                ur == 0, 0.0, np.where(ul, side('full'), np.where(
+                    ur == 1, np.minimum(rightLast, grids['closing'][i, j, r]),
+                    rightLast)))
+            urc = p1 - i - 1
+            opened = grids['open'][i, j, r]
+            energy = energy + np.where(
+                urc == 0, 0.0, np.where(
+                    ur != 0, grids['full'][i, j, r], np.where(
+                        urc == 1, np.minimum(opened, grids['five'][p1, q1, r]),
+                        opened)))
+            unp = unp + ur + urc
+            branches = branches + 1
+        energy = energy + np.where(unp == 0, closing + noneUnpaired,
+                                   closing + branch * branches +
+                                   unpaired * unp)
+        energies[cell, split] = energy + terms['energy'][left] + \
+            terms['energy'][right]
+        index = np.argmin(energies, axis=1)
+        return (np.take_along_axis(energies, index[:, None], axis=1)[:, 0],
+                start + offsets[index])
+
+    def branchLists(self, i, k, j, r, helix):
+        """Structures and branch lists of the multibranch loops of cells
+        (i, j) of sequences r split at k. The structure is the branch lists
+        of W of both sides; the branch list joins the branch lists of W of
+        every pair of the structure."""
+        (P, Q, M) = self.lists
+        sides = [(self.entry[i + helix, k, r], r),
+                 (self.entry[k + 1, j - helix, r], r)]
+        structs = concatLists(np.stack([P[side] for side in sides], -2),
+                              np.stack([Q[side] for side in sides], -2),
+                              np.stack([M[side] for side in sides], -1))
+        valid = np.arange(self.width) < structs[2][:, None]
+        R = r[:, None]
+        branch = (self.entry[np.where(valid, structs[0], 0),
+                             np.where(valid, structs[1], 0), R], R)
+        return (structs, concatLists(P[branch], Q[branch],
+                                     np.where(valid, M[branch], 0)))
+
+    def loops(self, i, j, r, span):
+        """Fills W of cells (i, j) of sequences r: the structure of
+        (i + 1, j) or (i, j - 1), V or a multibranch loop."""
+        W = self.W
+        options = [W[i + 1, j, r], W[i, j - 1, r], self.V[i, j, r]]
+        (loop, k) = self.multibranch(i, j, r, span, False,
+                                     np.minimum.reduce(options))
+        options = np.stack(options + [loop])
+        choice = np.argmin(options, axis=0)
+        W[i, j, r] = np.choose(choice, options)
+        own = i * self.length + j
+        self.entry[i, j, r] = np.choose(choice, [
+            self.entry[i + 1, j, r], self.entry[i, j - 1, r], own,
+            own + self.bifurcations])
+        looped = np.flatnonzero(choice == 3)
+        if len(looped):
+            (i, j, r) = (i[looped], j[looped], r[looped])
+            self.store(own[looped] + self.bifurcations, r,
+                       *self.branchLists(i, k[looped], j, r, False),
+                       bifurcationKind)
+
+    def summarize(self, entry, r):
+        """Stores the terms of the branch lists of entries of sequences
+        r."""
+        (P, Q, M) = (array[entry, r] for array in self.lists)
+        M = M.astype(np.intp)[:, None]
+        t = np.arange(self.width)
+        valid = t < M
+        P = np.where(valid, P, 0).astype(np.intp)
+        Q = np.where(valid, Q, 0).astype(np.intp)
+        R = r[:, None]
+        # Every branch but the first follows the one before it, and every
+        # branch but the last is followed by the next one.
+        ul = np.ones_like(P)
+        ul[:, 1:] = P[:, 1:] - Q[:, :-1] - 1
+        ur = np.zeros_like(P)
+        ur[:, :-1] = P[:, 1:] - Q[:, :-1] - 1
+        (full, right) = (self.grids['full'][P, Q, R],
+                         self.grids['right'][P, Q, R])
+        internal = t < M - 1
+        dangles = deElse(ul != 0, ur, full, right)
+        terms = self.terms
+        cells = (entry, r)
+        terms['energy'][cells] = np.where(valid, self.W[P, Q, R], 0).sum(1)
+        terms['dangles'][cells] = np.where(internal, dangles, 0).sum(1)
+        terms['unpaired'][cells] = np.where(internal, ur, 0).sum(1)
+        terms['first'][cells] = dangles[:, 0]
+        terms['firstOpen'][cells] = deElse(False, ur[:, 0], full[:, 0],
+                                           right[:, 0])
+        last = np.maximum(M - 1, 0)
+        at = lambda array: np.take_along_axis(array, last, axis=1)[:, 0]
+        (terms['p1'][cells], terms['q1'][cells]) = (P[:, 0], Q[:, 0])
+        (terms['pm'][cells], terms['qm'][cells]) = (at(P), at(Q))
+        terms['lastOpen'][cells] = at(ul) != 0
+        (terms['full'][cells], terms['right'][cells]) = (at(full), at(right))
+
+    def pairsOf(self, entry, r):
+        """Pairs of the structure of an entry of sequence r."""
+        (P, Q, M) = self.structs
+        count = M[entry, r]
+        return list(zip(P[entry, r, :count].tolist(),
+                        Q[entry, r, :count].tolist()))
+
+    def traceback(self, i, j, r):
+        """Loops of the structure of W of (i, j) of sequence r, as seqfold's
+        traceback gives them: [i, j, e] of every loop with its energy e
+        rounded to 0.1 kcal/mol. The traceback starts from V of the lowest
+        cell with the same structure as W, except for multibranch loops of
+        W, and from V of (i, j) itself for hairpins."""
+        (W, length) = (self.W, self.length)
+        (energy, entry) = (W[i, j, r], self.entry[i, j, r])
+        pairs = self.pairsOf(entry, r)
+        if self.kinds[entry, r] != hairpinKind:
+            same = lambda a, b: W[a, b, r] == energy and \
+                self.pairsOf(self.entry[a, b, r], r) == pairs
+            while i + 1 < j and same(i + 1, j):
+                i += 1
+            while i < j - 1 and same(i, j - 1):
+                j -= 1
+        if self.kinds[entry, r] != bifurcationKind:
+            entry = i * length + j
+            (energy, pairs) = (self.V[i, j, r], self.pairsOf(entry, r))
+        structs = []
+        while True:
+            structs.append([i, j, energy])
+            if len(pairs) != 1:
+                break
+            (i, j) = pairs[0]
+            (energy, pairs) = (self.V[i, j, r],
+                               self.pairsOf(i * length + j, r))
+        # Every loop has the energy of its structure less that of the next.
+        for (loop, inside) in zip(structs, structs[1:] + [[0, 0, 0.0]]):
+            loop[2] = round(loop[2] - inside[2], 1)
+        if len(pairs) > 1:
+            # The loop of a multibranch structure is its energy less those
+            # of W of its branches.
+            (total, branches) = (0.0, [])
+            for (a, b) in pairs:
+                branch = self.traceback(a, b, r)
+                total += W[branch[0][0], branch[0][1], r]
+                branches += branch
+            structs[-1][2] = round(structs[-1][2] - total, 1)
+            structs += branches
+        return structs
@@ -0,0 +1,384 @@
+#!/usr/bin/env python
+# --------------------------------------------------------------------------
+# genomeStore.py
+#
+# Compact on-disk genome store in the UCSC .2bit format. Bases are packed two
+# bits each, runs of N and soft-masked (lower case) bases are kept in separate
+# interval tables and a name/offset index at the start of the file allows any
+# region to be read without scanning the genome. Files are memory-mapped, so
+# worker processes reading the same genome share its pages.
+# --------------------------------------------------------------------------
+
+# Import module for handling input arguments.
+import argparse
+
+# Import modules for reading and writing the binary file.
+import mmap
+import os
+import shutil
+import struct
+import tempfile
+
+# Import numpy module.
+import numpy as np
+
+# Magic number at the start of every .2bit file.
+twoBitSignature = 0x1A412743
+
+# .2bit codes T, C, A and G as 0-3, four bases per byte with the first base in
+# the two most significant bits. N and other bases are stored as T and
+# restored from the N interval table.
+packCodes = np.zeros(256, dtype=np.uint8)
+for code, base in enumerate('TCAG'):
+    packCodes[ord(base)] = code
+    packCodes[ord(base.lower())] = code
+byteBases = np.frombuffer(b'TCAG', dtype=np.uint8)[
+    (np.arange(256)[:, None] >> np.array([6, 4, 2, 0])) & 3]
+
+# Bases that are stored as themselves rather than as part of an N run.
+knownBases = np.zeros(256, dtype=bool)
+knownBases[np.frombuffer(b'ACGTacgt', dtype=np.uint8)] = True
+
+# Open stores, so each process maps a genome only once.
+openStores = {}
+
+
+def isTwoBit(fileName):
+    """Check whether a file starts with the .2bit signature, in either byte
+    order."""
+    with open(fileName, 'rb') as f:
+        head = f.read(4)
+    return len(head) == 4 and twoBitSignature in (struct.unpack('<I', head)[0],
+                                                  struct.unpack('>I', head)[0])
+
+
+def openTwoBit(fileName):
+    """Returns the TwoBitFile for fileName, opening it on first use."""
+    key = os.path.abspath(fileName)
+    if key not in openStores:
+        openStores[key] = TwoBitFile(fileName)
+    return openStores[key]
+
+
+def parseRegion(region):
+    """Splits a 'chrom:start-end' region (1-based, inclusive) into a name and
+    0-based, half-open coordinates. A bare name selects the whole sequence, in
+    which case start and end are None."""
+    if ':' not in region:
+        return region, None, None
+    name, coords = region.rsplit(':', 1)
+    try:
+        start, end = [int(x.replace(',', '')) for x in coords.split('-')]
+    except ValueError:
+        raise ValueError('Region %s is not of the form chrom:start-end'
+                         % region)
+    return name, start - 1, end
+
+
+class RunTable:
+    """Collects the runs of True in a mask that is fed in consecutive chunks,
+    merging runs that continue across chunk boundaries."""
+
+    def __init__(self):
+        self.starts = []
+        self.ends = []
+        self.lastEnd = -1
+
+    def extend(self, mask, offset):
+        edges = np.flatnonzero(np.diff(np.concatenate(([0], mask, [0]))
+                                       .astype(np.int8)))
+        starts = edges[0::2] + offset
+        ends = edges[1::2] + offset
+        if len(starts) and starts[0] == self.lastEnd:
+            self.ends[-1] = self.ends[-1].copy()
+            self.ends[-1][-1] = self.lastEnd = ends[0]
+            starts, ends = starts[1:], ends[1:]
+        if len(starts):
+            self.starts.append(starts)
+            self.ends.append(ends)
+            self.lastEnd = ends[-1]
+
+    def arrays(self):
+        if not self.starts:
+            return np.zeros(0, np.int64), np.zeros(0, np.int64)
+        return np.concatenate(self.starts), np.concatenate(self.ends)
+
+
+class RecordPacker:
+    """Packs the bases of one record into .2bit form as they are read."""
+
+    def __init__(self, name):
+        self.name = name
+        self.size = 0
+        self.packed = bytearray()
+        self.carry = np.zeros(0, dtype=np.uint8)
+        self.nRuns = RunTable()
+        self.maskRuns = RunTable()
+
+    def feed(self, chunk):
+        bases = np.frombuffer(chunk, dtype=np.uint8)
+        self.nRuns.extend(~knownBases[bases], self.size)
+        self.maskRuns.extend(bases >= ord('a'), self.size)
+        self.size += len(bases)
+        codes = np.concatenate((self.carry, packCodes[bases]))
+        whole = len(codes) // 4 * 4
+        self.carry = codes[whole:]
+        self.packed += self.packBytes(codes[:whole])
+
+    def packBytes(self, codes):
+        codes = codes.reshape(-1, 4)
+        return ((codes[:, 0] << 6) | (codes[:, 1] << 4) | (codes[:, 2] << 2)
+                | codes[:, 3]).astype(np.uint8).tobytes()
+
+    def write(self, f):
+        """Writes the record to f and returns the number of bytes written."""
+        if len(self.carry):
+            codes = np.zeros(4, dtype=np.uint8)
+            codes[:len(self.carry)] = self.carry
+            self.packed += self.packBytes(codes)
+            self.carry = codes[:0]
+        nStarts, nEnds = self.nRuns.arrays()
+        maskStarts, maskEnds = self.maskRuns.arrays()
+        if self.size >= 1 << 32:
+            raise ValueError('Sequence %s is too long for the .2bit format'
+                             % self.name)
+        data = b''.join([struct.pack('<II', self.size, len(nStarts)),
+                         nStarts.astype('<u4').tobytes(),
+                         (nEnds - nStarts).astype('<u4').tobytes(),
+                         struct.pack('<I', len(maskStarts)),
+                         maskStarts.astype('<u4').tobytes(),
+                         (maskEnds - maskStarts).astype('<u4').tobytes(),
+                         struct.pack('<I', 0)])
+        f.write(data)
+        f.write(self.packed)
+        return len(data) + len(self.packed)
+
+
+def fastaToTwoBit(inputFile, outputFile, chunkSize=1 << 20):
+    """Converts a FASTA file into a .2bit genome store. Sequence names are the
+    first word of each header line. Records are packed one at a time into a
+    temporary file next to the output, so memory use is bounded by the packed
+    size of the longest record."""
+
+    names = []
+    sizes = []
+    outDir = os.path.dirname(os.path.abspath(outputFile))
+    with tempfile.TemporaryFile(dir=outDir) as body:
+        packer = None
+        pending = []
+        pendingLen = 0
+        with open(inputFile, 'rb') as f:
+            for line in f:
+                if line.startswith(b'>'):
+                    if packer is not None:
+                        packer.feed(b''.join(pending))
+                        sizes.append(packer.write(body))
+                    words = line[1:].decode('latin-1').split()
+                    if not words:
+                        raise ValueError('FASTA header without a name in %s'
+                                         % inputFile)
+                    names.append(words[0])
+                    if len(words[0].encode('latin-1')) > 255:
+                        raise ValueError('Sequence name %s is too long for '
+                                         'the .2bit format' % words[0])
+                    packer = RecordPacker(words[0])
+                    pending = []
+                    pendingLen = 0
+                elif packer is not None:
+                    bases = b''.join(line.split())
+                    pending.append(bases)
+                    pendingLen += len(bases)
+                    if pendingLen >= chunkSize:
+                        packer.feed(b''.join(pending))
+                        pending = []
+                        pendingLen = 0
+        if packer is not None:
+            packer.feed(b''.join(pending))
+            sizes.append(packer.write(body))
+        if len(set(names)) != len(names):
+            raise ValueError('Sequence names in %s are not unique' % inputFile)
+
+        # Use 64 bit record offsets only when the file needs them.
+        indexSize = sum(1 + len(name.encode('latin-1')) for name in names)
+        version = 0
+        if 16 + indexSize + 4 * len(names) + sum(sizes) >= 1 << 32:
+            version = 1
+        offsetFormat = '<Q' if version else '<I'
+        offset = 16 + indexSize + struct.calcsize(offsetFormat) * len(names)
+
+        with open(outputFile, 'wb') as out:
+            out.write(struct.pack('<IIII', twoBitSignature, version,
+                                  len(names), 0))
+            for name, size in zip(names, sizes):
+                encoded = name.encode('latin-1')
+                out.write(struct.pack('<B', len(encoded)) + encoded)
+                out.write(struct.pack(offsetFormat, offset))
+                offset += size
+            body.seek(0)
+            shutil.copyfileobj(body, out)
+    return names
+
+
+class TwoBitFile:
+    """Random access to a memory-mapped .2bit genome store. Sequence headers
+    are parsed the first time a sequence is used."""
+
+    def __init__(self, fileName):
+        self.fileName = fileName
+        with open(fileName, 'rb') as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        # Work out the byte order from the signature.
+        if struct.unpack('<I', self.data[:4])[0] == twoBitSignature:
+            self.endian = '<'
+        elif struct.unpack('>I', self.data[:4])[0] == twoBitSignature:
+            self.endian = '>'
+        else:
+            raise ValueError('%s is not a .2bit file' % fileName)
+        (version, seqCount) = struct.unpack(self.endian + 'II',
+                                            self.data[4:12])
+        if version not in (0, 1):
+            raise ValueError('Unsupported .2bit version %d in %s'
+                             % (version, fileName))
+        offsetFormat = self.endian + ('Q' if version else 'I')
+        offsetSize = struct.calcsize(offsetFormat)
+
+        # Read the name/offset index.
+        self.names = []
+        self.offsets = {}
+        pos = 16
+        for k in range(seqCount):
+            nameSize = self.data[pos]
+            name = self.data[pos + 1:pos + 1 + nameSize].decode('latin-1')
+            pos += 1 + nameSize
+            self.offsets[name] = struct.unpack(
+                offsetFormat, self.data[pos:pos + offsetSize])[0]
+            self.names.append(name)
+            pos += offsetSize
+        self.records = {}
+
+    def record(self, name):
+        """Returns the parsed header of a sequence: its length, the start and
+        end arrays of its N runs and soft-masked runs, and the offset of its
+        packed bases."""
+        if name not in self.records:
+            if name not in self.offsets:
+                raise KeyError('Sequence %s is not in %s'
+                               % (name, self.fileName))
+            u4 = np.dtype(self.endian + 'u4')
+            pos = self.offsets[name]
+            (size, nCount) = struct.unpack(self.endian + 'II',
+                                           self.data[pos:pos + 8])
+            pos += 8
+            nStarts = np.frombuffer(self.data, u4, nCount, pos).astype(np.int64)
+            nEnds = nStarts + np.frombuffer(self.data, u4, nCount,
+                                            pos + 4 * nCount)
+            pos += 8 * nCount
+            maskCount = struct.unpack(self.endian + 'I',
+                                      self.data[pos:pos + 4])[0]
+            pos += 4
+            maskStarts = np.frombuffer(self.data, u4, maskCount,
+                                       pos).astype(np.int64)
+            maskEnds = maskStarts + np.frombuffer(self.data, u4, maskCount,
+                                                  pos + 4 * maskCount)
+            pos += 8 * maskCount + 4
+            self.records[name] = {'length': size, 'nStarts': nStarts,
+                                  'nEnds': nEnds, 'maskStarts': maskStarts,
+                                  'maskEnds': maskEnds, 'dnaOffset': pos}
+        return self.records[name]
+
+    def length(self, name):
+        return self.record(name)['length']
+
+    def nRuns(self, name):
+        """Returns the start and end arrays of the N runs of a sequence."""
+        rec = self.record(name)
+        return rec['nStarts'], rec['nEnds']
+
+    def maskRuns(self, name):
+        """Returns the start and end arrays of the soft-masked runs of a
+        sequence."""
+        rec = self.record(name)
+        return rec['maskStarts'], rec['maskEnds']
+
+    def fetch(self, name, start=0, end=None, softMask=False):
+        """Decodes bases [start, end) of a sequence. Only the bytes holding
+        the region are touched. Soft-masked bases are returned in lower case
+        if softMask is set, and in upper case otherwise."""
+        rec = self.record(name)
+        if end is None:
+            end = rec['length']
+        if not 0 <= start <= end <= rec['length']:
+            raise ValueError('Region %d-%d is outside of %s (%d bases)'
+                             % (start + 1, end, name, rec['length']))
+        first = start // 4
+        packed = np.frombuffer(self.data, np.uint8, (end + 3) // 4 - first,
+                               rec['dnaOffset'] + first)
+        bases = byteBases[packed].ravel()[start - 4 * first:end - 4 * first]
+        bases = bases.copy()
+
+        # Restore N runs and, if requested, lower case runs that overlap.
+        runTables = [(rec['nStarts'], rec['nEnds'], None)]
+        if softMask:
+            runTables.append((rec['maskStarts'], rec['maskEnds'], 0x20))
+        for (starts, ends, caseBit) in runTables:
+            first = np.searchsorted(ends, start, 'right')
+            last = np.searchsorted(starts, end, 'left')
+            for k in range(first, last):
+                a = max(starts[k], start) - start
+                b = min(ends[k], end) - start
+                if caseBit is None:
+                    bases[a:b] = ord('N')
+                else:
+                    bases[a:b] |= caseBit
+        return bases.tobytes().decode('ascii')
+
+    def fetchRegion(self, region, softMask=False):
+        """Decodes a 'chrom:start-end' region (1-based, inclusive)."""
+        (name, start, end) = parseRegion(region)
+        if start is None:
+            return self.fetch(name, softMask=softMask)
+        return self.fetch(name, start, end, softMask)
+
+    def close(self):
+        self.data.close()
+
+
+def main():
+    # Allow user to input parameters on command line.
+    userInput = argparse.ArgumentParser(description=\
+        '%s converts a FASTA file into a compact .2bit genome store that '
+        'blockParse can mine directly, or prints regions of an existing '
+        'store as FASTA.' % 'genomeStore')
+    requiredNamed = userInput.add_argument_group('required arguments')
+    requiredNamed.add_argument('-f', '--file', action='store', required=True,
+                               help='The FASTA file to convert, or the .2bit '
+                                    'file to read regions from')
+    userInput.add_argument('-o', '--output', action='store', default=None,
+                           type=str,
+                           help='Name of the .2bit file to write, defaults '
+                                'to the input name with a .2bit extension')
+    userInput.add_argument('-r', '--region', action='append', default=None,
+                           help='Print the region chrom:start-end of a .2bit '
+                                'file as FASTA, can be given several times')
+    userInput.add_argument('-m', '--softMask', action='store_true',
+                           default=False,
+                           help='Print soft-masked bases in lower case')
+    args = userInput.parse_args()
+
+    if args.region:
+        store = TwoBitFile(args.file)
+        for region in args.region:
+            seq = store.fetchRegion(region, args.softMask)
+            print('>%s' % region)
+            for k in range(0, len(seq), 60):
+                print(seq[k:k + 60])
+        return
+
+    outputFile = args.output or os.path.splitext(args.file)[0] + '.2bit'
+    names = fastaToTwoBit(args.file, outputFile)
+    print('Wrote %d sequences to %s' % (len(names), outputFile))
+
+
+if __name__ == '__main__':
+    main()
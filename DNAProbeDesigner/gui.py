@@ -2,6 +2,8 @@ from PyQt6.QtWidgets import QApplication, QMainWindow, QTabWidget, QPushButton,
 from PyQt6.QtGui import QDoubleValidator
 from DNAProbeDesigner.duplex_prob import filter_duplex_prob, plot_duplex_prob
 from DNAProbeDesigner.secondary_structure import filter_secondary_structure
+from DNAProbeDesigner.probeTable import readProbes
+from DNAProbeDesigner.mfeCache import defaultCachePath
 import sys
 import subprocess
 import os
@@ -211,8 +213,6 @@ def run_gui():
         def runScript(self):
             if self.fastaFilePath and self.bowtieDirPath and self.bowtieIndices and self.outputDirPath:
                 
-                # path to the fastq file
-                fastqOutputFile = os.path.join(self.outputDirPath, self.fastaFileName).replace('\\', '/')
                 # path to the sam file
                 self.samFile = os.path.join(self.outputDirPath, f'{self.fastaFileName}.sam').replace('\\', '/')
                 # path to the folder of indices
@@ -220,41 +220,19 @@ def run_gui():
                 # path to the bed file
                 self.bedFile = os.path.join(self.outputDirPath, f'{self.fastaFileName}_probes.bed').replace('\\', '/')
 
-                # fastq file generation
+                # blockParse, bowtie2 and outputClean run concurrently as a
+                # pipe chain; the SAM is kept for probe filtering
                 try:
                     command = [
-                        "python", "DNAProbeDesigner/blockParse.py",
+                        "python", "DNAProbeDesigner/probePipeline.py",
                         "-f", self.fastaFilePath,
-                        "-o", fastqOutputFile,
-                        # other arguments could go here
-                    ]
-                    self.updateProgressBar(33)
-                    subprocess.run(command, check=True)
-                except subprocess.CalledProcessError as e:
-                    self.statusLabel.setText(f"Error: {e}")
-
-                try:
-                    command = [
-                    "bowtie2",
-                    "-x", bowtiePathArgument,  # indices specified
-                    "-U", f"{fastqOutputFile}.fastq",  # fastq file
-                    "--no-hd", "-t", "-k", "2", "--local",
-                    "-D", "20", "-R", "3", "-N", "1", "-L", "20",
-                    "-i", "C,4", "--score-min", "G,1,4",
-                    "-S", self.samFile  # output SAM file
-                    ]
-                    self.updateProgressBar(66)
-                    subprocess.run(command, check=True, shell=True)
-                except subprocess.CalledProcessError as e:
-                    self.statusLabel.setText(f"Error in bowtie2: {e}")
-
-                try:
-                    command = [
-                        "python", "DNAProbeDesigner/outputClean.py",
+                        "-x", bowtiePathArgument,  # indices specified
                         "-T", "42",
-                        "-f", self.samFile
+                        "-S", self.samFile,  # output SAM file
+                        "-o", self.bedFile[:-len('.bed')]
                         # other arguments could go here
                     ]
+                    self.updateProgressBar(33)
                     subprocess.run(command, check=True)
                     self.updateProgressBar(100)
                 except subprocess.CalledProcessError as e:
@@ -295,10 +273,16 @@ def run_gui():
             if self.samFile and self.bedFile and self.filterTemp and self.filterProb:
                 filter_duplex_prob(self.samFile, self.bedFile, self.filterTemp, self.filterProb)
                 self.filteredProbeFile = f'{self.bedFile.split(".")[0]}_pDup_filtered.bed'
+                resultFile = self.filteredProbeFile
                 if self.filterMFE:
-                    filter_secondary_structure(self.filteredProbeFile, self.filterMFE)
+                    filter_secondary_structure(self.filteredProbeFile, self.filterMFE,
+                                               progress=lambda done, total: self.updateProgressBar(int(100 * done / total)),
+                                               cache=defaultCachePath)
                     self.mfeFilteredProbeFile = f'{self.bedFile.split(".")[0]}_pDup_MFE_filtered.bed'
-                self.plotStatusLabel.setText("Filtered Probes Successfully!")
+                    resultFile = self.mfeFilteredProbeFile
+                # count the probes kept from the sidecar of the result
+                probeCount = len(readProbes(resultFile))
+                self.plotStatusLabel.setText(f"Filtered Probes Successfully! {probeCount} probes kept")
             elif not self.samFile or not self.bedFile:
                 self.plotStatusLabel.setText("Please Design Probes First!")
             elif not self.filterTemp:
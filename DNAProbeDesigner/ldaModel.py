@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# --------------------------------------------------------------------------
+# ldaModel.py
+#
+# The temperature-specific linear discriminant analysis (LDA) models of
+# Beliveau et al. (2018) that predict whether a probe has thermodynamically
+# relevant off-target binding, from its length, the score of its second best
+# alignment and its %G+C. The models are applied in closed form with NumPy,
+# giving the same probabilities as scikit-learn's
+# LinearDiscriminantAnalysis.predict_proba loaded with these coefficients.
+# --------------------------------------------------------------------------
+
+# Import numpy module.
+import numpy as np
+
+# Hybridization temperatures of the models, in C.
+ldaTemps = [32, 37, 42, 47, 52, 57]
+
+# Coefficients of the [length, alignment score, %G+C] features and intercepts
+# of the model for each temperature.
+ldaCoefs = np.array([[-0.14494789, 0.18791679, 0.02588474],
+                     [-0.13364364, 0.22510179, 0.05494031],
+                     [-0.09006122, 0.25660706, 0.1078303],
+                     [-0.01593182, 0.24498485, 0.15753649],
+                     [0.01860365, 0.1750174, 0.17003374],
+                     [0.03236755, 0.11624593, 0.24306498]])
+ldaIntercepts = np.array([-1.17545204, -5.40436344, -12.45549846,
+                          -19.32670233, -20.11992898, -23.98652919])
+
+# Class labels; the probabilities are those of class 1 (off-target binding
+# for outputClean, duplex formation for duplex_prob).
+ldaClasses = np.array([-1, 1])
+
+
+class LdaScorer:
+    """Scores (n, 3) arrays of [length, alignment score, %G+C] features with
+    the LDA models of every temperature at once."""
+
+    def __init__(self, coefs=ldaCoefs, intercepts=ldaIntercepts,
+                 temps=ldaTemps):
+        self.coefs = np.asarray(coefs, dtype=np.float64)
+        self.intercepts = np.asarray(intercepts, dtype=np.float64)
+        self.temps = list(temps)
+
+    def tempIndex(self, temp):
+        """Column of the model for a temperature. Raises ValueError for
+        temperatures without a model."""
+        if temp not in self.temps:
+            raise ValueError('No LDA model for %s C, the models are for %s'
+                             % (temp, ', '.join('%d' % t for t in self.temps)))
+        return self.temps.index(temp)
+
+    def decision(self, features):
+        """Decision values, an (n, number of temperatures) array."""
+        features = np.asarray(features, dtype=np.float64).reshape(-1, 3)
+        return features @ self.coefs.T + self.intercepts
+
+    def probs(self, features):
+        """Probabilities of class 1 under every model, an
+        (n, number of temperatures) array. The logistic function is taken
+        on the side where exp cannot overflow."""
+        d = self.decision(features)
+        e = np.exp(-np.abs(d))
+        return np.where(d >= 0, 1.0 / (1.0 + e), e / (1.0 + e))
+
+    def probsAt(self, features, temp):
+        """Probabilities of class 1 under the model for one temperature."""
+        index = self.tempIndex(temp)
+        features = np.asarray(features, dtype=np.float64).reshape(-1, 3)
+        d = features @ self.coefs[index] + self.intercepts[index]
+        e = np.exp(-np.abs(d))
+        return np.where(d >= 0, 1.0 / (1.0 + e), e / (1.0 + e))
+
+
+# Scorer with the published models.
+ldaScorer = LdaScorer()
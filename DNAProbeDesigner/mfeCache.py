@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+# --------------------------------------------------------------------------
+# mfeCache.py
+#
+# Persistent cache of minimum free energies for secondary_structure. Folding
+# results are stored in an SQLite database keyed by sequence, folding
+# temperature and seqfold version, so reruns over overlapping probe sets only
+# fold the new sequences, and results from another seqfold release are never
+# reused. Every entry records when it was last used; once the cache holds
+# more than its maximum number of entries, the least recently used ones are
+# evicted.
+# --------------------------------------------------------------------------
+
+# Import modules for the database and its default location.
+import os
+import sqlite3
+
+# Import modules to find the seqfold version.
+import importlib.metadata
+import seqfold
+
+# Default database, shared by all runs of a user.
+defaultCachePath = os.path.join(os.path.expanduser('~'), '.cache',
+                                'DNAProbeDesigner', 'mfe_cache.sqlite')
+
+# Default largest number of entries, about 60 MB of 40 nt probes.
+defaultMaxEntries = 1000000
+
+# Largest number of sequences looked up in one query.
+queryBatchSize = 500
+
+
+def seqfoldVersion():
+    """Version of the installed seqfold package, part of every cache key."""
+    try:
+        return importlib.metadata.version('seqfold')
+    except importlib.metadata.PackageNotFoundError:
+        return getattr(seqfold, '__version__', 'unknown')
+
+
+class MfeCache:
+    """Minimum free energies stored by (sequence, temperature, seqfold
+    version) in an SQLite database, with least recently used eviction beyond
+    maxEntries. hits and misses count the sequences looked up in this
+    session and evictions the entries removed."""
+
+    def __init__(self, fileName=defaultCachePath, maxEntries=defaultMaxEntries,
+                 version=None):
+        if fileName != ':memory:' and os.path.dirname(fileName):
+            os.makedirs(os.path.dirname(fileName), exist_ok=True)
+        self.fileName = fileName
+        self.maxEntries = maxEntries
+        self.version = seqfoldVersion() if version is None else version
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.db = sqlite3.connect(fileName, timeout=60)
+        self.db.execute('CREATE TABLE IF NOT EXISTS mfe (seq TEXT NOT NULL, '
+                        'temp REAL NOT NULL, version TEXT NOT NULL, '
+                        'mfe REAL NOT NULL, used INTEGER NOT NULL, '
+                        'PRIMARY KEY (seq, temp, version)) WITHOUT ROWID')
+        self.db.execute('CREATE INDEX IF NOT EXISTS mfeUsed ON mfe (used)')
+        self.db.commit()
+        # Use counter, increasing with every entry looked up or stored.
+        self.clock = self.db.execute('SELECT max(used) FROM mfe'
+                                     ).fetchone()[0] or 0
+
+    def __len__(self):
+        return self.db.execute('SELECT count(*) FROM mfe').fetchone()[0]
+
+    def tick(self, count):
+        """Reserves count consecutive use counter values."""
+        start = self.clock + 1
+        self.clock += count
+        return range(start, start + count)
+
+    def get(self, seqs, temp):
+        """Returns a dict of the MFEs of the given distinct sequences that
+        are in the cache at temp, marking them as used."""
+        temp = float(temp)
+        found = {}
+        for k in range(0, len(seqs), queryBatchSize):
+            batch = seqs[k:k + queryBatchSize]
+            rows = self.db.execute(
+                'SELECT seq, mfe FROM mfe WHERE temp = ? AND version = ? AND '
+                'seq IN (%s)' % ','.join('?' * len(batch)),
+                [temp, self.version] + list(batch))
+            found.update(rows)
+        self.hits += len(found)
+        self.misses += len(seqs) - len(found)
+        hit = [seq for seq in seqs if seq in found]
+        self.db.executemany('UPDATE mfe SET used = ? WHERE seq = ? AND '
+                            'temp = ? AND version = ?',
+                            [(used, seq, temp, self.version)
+                             for used, seq in zip(self.tick(len(hit)), hit)])
+        self.db.commit()
+        return found
+
+    def put(self, MFEs, temp):
+        """Stores a dict of sequences and their MFEs at temp, then evicts
+        the least recently used entries beyond maxEntries."""
+        temp = float(temp)
+        items = list(MFEs.items())
+        self.db.executemany('INSERT OR REPLACE INTO mfe VALUES (?, ?, ?, ?, ?)',
+                            [(seq, temp, self.version, float(MFE), used)
+                             for used, (seq, MFE) in zip(self.tick(len(items)),
+                                                         items)])
+        excess = len(self) - self.maxEntries
+        if excess > 0:
+            self.db.execute('DELETE FROM mfe WHERE used <= (SELECT used FROM '
+                            'mfe ORDER BY used LIMIT 1 OFFSET ?)',
+                            (excess - 1,))
+            self.evictions += excess
+        self.db.commit()
+
+    def stats(self):
+        """Hit and miss counts of this session, the hit rate, evictions and
+        the number of entries."""
+        looked = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses,
+                'hitRate': self.hits / looked if looked else 0.0,
+                'evictions': self.evictions, 'entries': len(self)}
+
+    def close(self):
+        self.db.close()
@@ -40,296 +40,713 @@ Version = '1.7'
 # Import module for handling input arguments.
 import argparse
 
-# Import regex library.
-import re
-
 # Import Biopython modules.
 from Bio.SeqUtils import MeltingTemp as mt
 from Bio.SeqUtils import GC
 
+# Import namedtuple for the parsed SAM records.
+from collections import namedtuple
+from functools import partial
+
+# Import typed arrays for the Report records.
+from array import array
+
+# Import modules for unpacking BAM records.
+import struct
+import numpy as np
+
+# Import modules for processing byte ranges of the SAM file in parallel and
+# merging their sorted outputs, and for reading SAM from standard input.
+import os
+import sys
+import heapq
+from concurrent.futures import ProcessPoolExecutor
+
 # Import timeit module and record start time. This provides a rough estimate of
 # the wall clock time it takes to run the script.
 import timeit
 
+# Import the Tm engine shared with blockParse, the LDA models and the map of
+# reads removed by dedupFastq.
+try:
+    from DNAProbeDesigner.tmEngine import getTmEngine
+    from DNAProbeDesigner.ldaModel import ldaScorer
+    from DNAProbeDesigner.dedupFastq import DuplicateMap
+    from DNAProbeDesigner.bgzf import BgzfReader
+except ImportError:
+    from tmEngine import getTmEngine
+    from ldaModel import ldaScorer
+    from dedupFastq import DuplicateMap
+    from bgzf import BgzfReader
+
 # Define Tm calculation function.
 def probeTm(seq1, sal, form):
     """Calculates the melting temperature of a given sequence under the
-    specified salt and formamide conditions."""
-    tmval = ('%0.2f' % mt.Tm_NN(seq1, Na=sal))
-    fcorrected = ('%0.2f' % mt.chem_correction(float(tmval), fmd=form))
+    specified salt and formamide conditions. The Tm engine for these
+    conditions is built on the first call and reused afterwards."""
+    engine = getTmEngine(mt.DNA_NN3, sal, form)
+    tmval = ('%0.2f' % engine.tm(seq1))
+    fcorrected = ('%0.2f' % engine.chemCorrect(float(tmval)))
     return fcorrected
 
 
+# Fields of a SAM alignment used by outputClean. The read name written by
+# blockParse gives chrom, start and stop; AS and XS are the alignment scores
+# from the optional fields, or None if missing.
+SamRecord = namedtuple('SamRecord', ['chrom', 'start', 'stop', 'flag',
+                                     'rname', 'seq', 'AS', 'XS'])
+
+
+def parseSamLine(line):
+    """Splits one SAM alignment line once and returns its SamRecord."""
+    fields = line.rstrip('\r\n').split('\t')
+    (chrom, _, span) = fields[0].partition(':')
+    (start, _, stop) = span.partition('-')
+    AS = XS = None
+    for tag in fields[11:]:
+        if tag.startswith('AS:'):
+            AS = tag[5:]
+        elif tag.startswith('XS:'):
+            XS = tag[5:]
+    return SamRecord(chrom, start, stop.strip(' '), int(fields[1]), fields[2],
+                     fields[9], AS, XS)
+
+
+# Decision codes of the Report records, and their names in the TSV file.
+(addUnique, rejectZero, rejectMulti, addZero, rejectAligned, addLDA,
+ filterLDA) = range(7)
+decisionNames = ['unique_added', 'zero_rejected', 'multi_rejected',
+                 'zero_added', 'aligned_rejected', 'lda_added', 'lda_filtered']
+
+
+def reportLine(decision, chrom, start, stop, prob, probVal):
+    """Renders one Report record as the sentence written to the log."""
+    if decision == addUnique:
+        return ('Candidate probe at %s:%d-%d aligned 1 time, added to output'
+                % (chrom, start, stop))
+    if decision == rejectZero:
+        return ('Candidate probe at %s:%d-%d aligned 0 times, was not added '
+                'to output' % (chrom, start, stop))
+    if decision == rejectMulti:
+        return ('Candidate probe at %s:%d-%d aligned >1 time, was not added '
+                'to output' % (chrom, start, stop))
+    if decision == addZero:
+        return ('Candidate probe at %s:%d-%d aligned 0 times, added to output '
+                '(Zero mode active)' % (chrom, start, stop))
+    if decision == rejectAligned:
+        return ('Candidate probe at %s:%d-%d aligned >0 times, was not added '
+                'to output (Zero mode active)' % (chrom, start, stop))
+    if decision == addLDA:
+        return ('Candidate probe at %s:%d-%d added to output with %0.4f < '
+                '%0.4f probability of having off-target sites'
+                % (chrom, start, stop, prob, probVal))
+    return ('Candidate probe at %s:%d-%d filtered with %0.4f => %0.4f '
+            'probability of having off-target sites'
+            % (chrom, start, stop, prob, probVal))
+
+
+class CleanLog:
+    """Report info of a run, one record per candidate decision holding the
+    coordinates, the number of alignments (2 standing for more than one, as
+    bowtie2 is run with -k 2), the LDA probability (NaN if the candidate was
+    not scored) and the decision code in typed arrays. Records are printed
+    as they are added in Debug mode; the log is rendered once, sorted by
+    chrom in the order chroms were first seen and then by start coordinate,
+    when it is written."""
+
+    def __init__(self, probVal, keep=True, echo=False):
+        self.probVal = probVal
+        self.keep = keep
+        self.echo = echo
+        self.chroms = []
+        self.chromIndex = {}
+        self.chromIds = array('I')
+        self.starts = array('q')
+        self.stops = array('q')
+        self.alignments = array('B')
+        self.probs = array('d')
+        self.decisions = array('B')
+
+    def __len__(self):
+        return len(self.decisions)
+
+    def add(self, decision, chrom, start, stop, alignments,
+            prob=float('nan')):
+        if self.echo:
+            print(reportLine(decision, chrom, int(start), int(stop), prob,
+                             self.probVal))
+        if not self.keep:
+            return
+        if chrom not in self.chromIndex:
+            self.chromIndex[chrom] = len(self.chroms)
+            self.chroms.append(chrom)
+        self.chromIds.append(self.chromIndex[chrom])
+        self.starts.append(int(start))
+        self.stops.append(int(stop))
+        self.alignments.append(alignments)
+        self.probs.append(prob)
+        self.decisions.append(decision)
+
+    def order(self):
+        """Indices of the records sorted by chrom and start, keeping the
+        order in which records with equal coordinates were added."""
+        return np.lexsort((np.frombuffer(self.starts, dtype=np.int64),
+                           np.frombuffer(self.chromIds, dtype=np.uint32)))\
+            .tolist()
+
+    def lines(self):
+        """Yields the rendered records sorted by chrom and start."""
+        for k in self.order():
+            yield reportLine(self.decisions[k], self.chroms[self.chromIds[k]],
+                             self.starts[k], self.stops[k], self.probs[k],
+                             self.probVal)
+
+    def writeTsv(self, fileName):
+        """Writes the records sorted by chrom and start as a TSV file."""
+        with open(fileName, 'w') as f:
+            f.write('chrom\tstart\tstop\talignments\tprobability\tdecision\n')
+            for k in self.order():
+                prob = self.probs[k]
+                f.write('%s\t%d\t%d\t%d\t%s\t%s\n'
+                        % (self.chroms[self.chromIds[k]], self.starts[k],
+                           self.stops[k], self.alignments[k],
+                           'NA' if prob != prob else '%0.6g' % prob,
+                           decisionNames[self.decisions[k]]))
+
+
+def samPath(inputFile):
+    """Returns the path of a SAM input, or None if the SAM is read from
+    standard input ('-') or from a stream."""
+    if isinstance(inputFile, (str, os.PathLike)) and str(inputFile) != '-':
+        return inputFile
+    return None
+
+
+def samLines(inputFile):
+    """Iterates over the lines of a SAM input: standard input for '-', any
+    other iterable of text or byte lines, such as a pipe from an aligner,
+    as it is."""
+    if str(inputFile) == '-':
+        return sys.stdin.buffer
+    return inputFile
+
+
+def readSam(inputFile, start=0, end=None):
+    """Yields a SamRecord for each alignment of a SAM file, reading it one
+    line at a time. Header and blank lines are skipped. start and end limit
+    the reading to the lines beginning in that byte range. The SAM can also
+    be read from standard input ('-') or a stream of lines, from start to
+    finish."""
+    if samPath(inputFile) is None:
+        for line in samLines(inputFile):
+            if isinstance(line, bytes):
+                line = line.decode()
+            if line[:1] != '@' and line.strip():
+                yield parseSamLine(line)
+        return
+    with open(inputFile, 'rb') as f:
+        f.seek(start)
+        pos = start
+        for line in f:
+            if end is not None and pos >= end:
+                break
+            pos += len(line)
+            line = line.decode()
+            if line[0] != '@' and line.strip():
+                yield parseSamLine(line)
+
+
+def isBam(inputFile):
+    """Whether the alignments are read from a .bam file."""
+    return samPath(inputFile) is not None and \
+           str(inputFile).lower().endswith('.bam')
+
+
+# Bases of the 4-bit BAM sequence encoding, indexed by the hex digits of the
+# packed bytes.
+bamBases = str.maketrans('0123456789abcdef', '=ACMGRSVTWYHKDBN')
+
+# Fixed-size fields of a BAM alignment record after its length.
+bamFixed = np.dtype([('refID', '<i4'), ('pos', '<i4'), ('nameLength', 'u1'),
+                     ('mapq', 'u1'), ('bin', '<u2'), ('cigarCount', '<u2'),
+                     ('flag', '<u2'), ('seqLength', '<i4'),
+                     ('nextRefID', '<i4'), ('nextPos', '<i4'),
+                     ('tlen', '<i4')])
+
+# Value sizes of the fixed-size BAM optional field types (0 for the others),
+# and the masks and sign bits that decode the integer types from 4 bytes.
+bamTagSizes = np.zeros(256, dtype=np.int64)
+bamTagMasks = np.zeros(256, dtype=np.int64)
+bamTagSigns = np.zeros(256, dtype=np.int64)
+for (valueType, size, signed) in [('A', 1, None), ('f', 4, None),
+                                  ('c', 1, True), ('C', 1, False),
+                                  ('s', 2, True), ('S', 2, False),
+                                  ('i', 4, True), ('I', 4, False)]:
+    bamTagSizes[ord(valueType)] = size
+    if signed is not None:
+        bamTagMasks[ord(valueType)] = (1 << (8 * size)) - 1
+        bamTagSigns[ord(valueType)] = (1 << (8 * size - 1)) if signed else 0
+
+
+# Builds a SamRecord from a tuple of its fields.
+samRecord = partial(tuple.__new__, SamRecord)
+
+
+def bamHeader(data):
+    """Parses the BAM header at the start of data. Returns the reference
+    names and the length of the header, or None if data ends within it."""
+    if len(data) >= 4 and data[:4] != b'BAM\1':
+        raise ValueError('Not a BAM file')
+    if len(data) < 12:
+        return None
+    pos = 8 + struct.unpack_from('<i', data, 4)[0]
+    if len(data) < pos + 4:
+        return None
+    refCount = struct.unpack_from('<i', data, pos)[0]
+    pos += 4
+    refs = []
+    for k in range(refCount):
+        if len(data) < pos + 4:
+            return None
+        nameLength = struct.unpack_from('<i', data, pos)[0]
+        if len(data) < pos + 8 + nameLength:
+            return None
+        refs.append(data[pos + 4:pos + 3 + nameLength].decode())
+        pos += 8 + nameLength
+    return refs, pos
+
+
+def bamRecords(data, refs):
+    """Decodes the complete BAM alignment records at the start of data into
+    SamRecords. Only the fields used by outputClean are extracted, for all
+    records at once with NumPy: the optional fields of every record are
+    walked in step to find the AS and XS scores, and the sequences and read
+    names are decoded in one pass. Returns the records and the number of
+    bytes they take up."""
+    offsets = []
+    pos = 0
+    unpack = struct.Struct('<i').unpack_from
+    while pos + 4 <= len(data):
+        end = pos + 4 + unpack(data, pos)[0]
+        if end > len(data):
+            break
+        offsets.append(pos)
+        pos = end
+    if not offsets:
+        return [], 0
+
+    # Padding keeps reads of up to 4 bytes past the last field in bounds.
+    buf = np.frombuffer(data[:pos] + bytes(8), dtype=np.uint8)
+    offs = np.array(offsets, dtype=np.int64)
+    recordEnds = np.append(offs[1:], pos)
+    fixed = buf[offs[:, None] + np.arange(4, 36)].view(bamFixed)[:, 0]
+    nameStarts = offs + 36
+    nameLengths = fixed['nameLength'].astype(np.int64) - 1
+    seqStarts = nameStarts + nameLengths + 1 + \
+                4 * fixed['cigarCount'].astype(np.int64)
+    seqLengths = fixed['seqLength'].astype(np.int64)
+    packedLengths = (seqLengths + 1) // 2
+
+    # Walk the optional fields of all records in step.
+    scores = {b'AS': [np.zeros(len(offs), dtype=np.int64),
+                      np.zeros(len(offs), dtype=bool)],
+              b'XS': [np.zeros(len(offs), dtype=np.int64),
+                      np.zeros(len(offs), dtype=bool)]}
+    nulls = np.flatnonzero(buf == 0)
+    tagPos = seqStarts + packedLengths + seqLengths
+    active = np.flatnonzero(tagPos < recordEnds)
+    while len(active):
+        q = tagPos[active]
+        valueTypes = buf[q + 2]
+        b = buf[q[:, None] + np.arange(3, 7)].astype(np.int64)
+        raw = b[:, 0] | (b[:, 1] << 8) | (b[:, 2] << 16) | (b[:, 3] << 24)
+        signs = bamTagSigns[valueTypes]
+        values = ((raw & bamTagMasks[valueTypes]) ^ signs) - signs
+        isInt = bamTagMasks[valueTypes] > 0
+        for tag, (tagValues, found) in scores.items():
+            hit = isInt & (buf[q] == tag[0]) & (buf[q + 1] == tag[1])
+            tagValues[active[hit]] = values[hit]
+            found[active[hit]] = True
+        steps = bamTagSizes[valueTypes]
+        strings = (valueTypes == ord('Z')) | (valueTypes == ord('H'))
+        steps[strings] = nulls[np.searchsorted(nulls, q[strings] + 3)] - \
+                         q[strings] - 2
+        arrays = valueTypes == ord('B')
+        if arrays.any():
+            counts = raw[arrays] >> 8 & 0xffffffff
+            steps[arrays] = 5 + counts * bamTagSizes[buf[q[arrays] + 3]]
+        if (steps <= 0).any():
+            raise ValueError('Unknown BAM optional field type %r'
+                             % chr(valueTypes[steps <= 0][0]))
+        tagPos[active] = q + 3 + steps
+        active = active[tagPos[active] < recordEnds[active]]
+
+    # Gather the packed sequences and the NUL-terminated read names of all
+    # records.
+    def gather(starts, lengths):
+        cum = np.cumsum(lengths)
+        index = np.repeat(starts + lengths - cum, lengths) + np.arange(cum[-1])
+        return buf[index].tobytes()
+    seqs = gather(seqStarts, packedLengths).hex().translate(bamBases)
+    seqCum = 2 * np.concatenate([[0], np.cumsum(packedLengths)[:-1]])
+    seqs = list(map(seqs.__getitem__, map(slice, seqCum.tolist(),
+                                          (seqCum + seqLengths).tolist())))
+    names = gather(nameStarts, nameLengths + 1)
+
+    # Split the read names written by blockParse into chrom, start and stop
+    # in one pass if every name has one ':' followed by one '-', or one at a
+    # time as parseSamLine does otherwise.
+    nameBytes = np.frombuffer(names, dtype=np.uint8)
+    ends = np.flatnonzero(nameBytes == 0)
+    colons = np.flatnonzero(nameBytes == ord(':'))
+    dashes = np.flatnonzero(nameBytes == ord('-'))
+    names = names.decode()
+    if len(colons) == len(dashes) == len(offs) and ' ' not in names and \
+       (np.searchsorted(ends, colons) == np.arange(len(offs))).all() and \
+       (np.searchsorted(ends, dashes) == np.arange(len(offs))).all() and \
+       (colons < dashes).all():
+        fields = names.replace(':', '\0').replace('-', '\0').split('\0')
+        coords = (fields[0:-1:3], fields[1::3], fields[2::3])
+    else:
+        coords = ([], [], [])
+        for name in names.split('\0')[:-1]:
+            (chrom, _, span) = name.partition(':')
+            (start, _, stop) = span.partition('-')
+            for (column, field) in zip(coords, (chrom, start, stop.strip(' '))):
+                column.append(field)
+
+    # Scores are given as strings like those of readSam.
+    def scoreStrings(values, found):
+        strings = np.array(list(map(str, values.tolist())), dtype=object)
+        strings[~found] = None
+        return strings.tolist()
+
+    refNames = np.array(refs + ['*'], dtype=object)
+    records = list(map(samRecord, zip(*coords, fixed['flag'].tolist(),
+                                      refNames[fixed['refID']].tolist(), seqs,
+                                      scoreStrings(*scores[b'AS']),
+                                      scoreStrings(*scores[b'XS']))))
+    return records, pos
+
+
+def readBam(inputFile, workers=1):
+    """Yields a SamRecord for each alignment of a BAM file, like readSam.
+    The BGZF blocks are decompressed ahead of the parser by the given number
+    of threads and the records of each decompressed batch of blocks are
+    decoded together."""
+    data = b''
+    refs = None
+    for chunk in BgzfReader(inputFile, workers).chunks():
+        data = data + chunk if data else chunk
+        if refs is None:
+            try:
+                header = bamHeader(data)
+            except ValueError:
+                raise ValueError('%s is not a BAM file' % inputFile)
+            if header is None:
+                continue
+            (refs, length) = header
+            data = data[length:]
+        (records, length) = bamRecords(data, refs)
+        yield from records
+        data = data[length:]
+    if refs is None or data:
+        raise ValueError('Truncated BAM file %s' % inputFile)
+
+
+def samShards(inputFile, count):
+    """Splits a SAM file into at most count byte ranges of similar size for
+    --workers. Ranges start at the beginning of a line, and all alignments of
+    a read (-k 2) stay in the same range. Returns (start, end) offsets."""
+    size = os.path.getsize(inputFile)
+    cuts = [0]
+    with open(inputFile, 'rb') as f:
+        for k in range(1, count):
+            pos = size * k // count
+            if pos <= cuts[-1]:
+                continue
+            # Move to the start of the next line, then past the alignments of
+            # the read it belongs to.
+            f.seek(pos - 1)
+            f.readline()
+            name = None
+            while True:
+                cut = f.tell()
+                line = f.readline()
+                if not line:
+                    break
+                lineName = line.split(b'\t', 1)[0]
+                if name is None:
+                    name = lineName
+                elif lineName != name:
+                    break
+            if cuts[-1] < cut < size:
+                cuts.append(cut)
+    cuts.append(size)
+    return list(zip(cuts[:-1], cuts[1:]))
+
+
+def cleanShard(inputFile, start, end, uniqueVal, zeroVal, tempVal, sal, form):
+    """Applies the filter of cleanOutput to the alignments in one byte range
+    of a SAM file, for --workers. Returns the chroms in the order they are
+    first seen, the (chrom, start) coordinates of the candidates, the probes
+    kept outright as (chrom, start, BED line) and, in LDA mode, the
+    candidates scored by the model as
+    (chrom, start, start string, BED line, probability)."""
+    chroms = {}
+    candsSet = set()
+    kept = []
+    tested = []
+    testList = []
+    testSet = set()
+    for rec in readSam(inputFile, start, end):
+        chroms.setdefault(rec.chrom, len(chroms))
+        candsSet.add((rec.chrom, rec.start))
+        aligned = rec.rname[:1] != '*'
+        if uniqueVal is True:
+            keep = aligned and rec.XS is None
+        elif zeroVal is True:
+            keep = not aligned
+        else:
+            keep = aligned and rec.XS is None
+            if not keep and aligned and (rec.chrom, rec.start) not in testSet:
+                testSet.add((rec.chrom, rec.start))
+                testList.append([float(len(rec.seq)), float(rec.XS),
+                                 GC(rec.seq)])
+                tested.append((rec.chrom, int(rec.start), rec.start,
+                               '%s\t%s\t%s\t%s\t%s'
+                               % (rec.chrom, rec.start, rec.stop, rec.seq,
+                                  probeTm(rec.seq, sal, form))))
+        if keep:
+            kept.append((rec.chrom, int(rec.start), '%s\t%s\t%s\t%s\t%s'
+                         % (rec.chrom, rec.start, rec.stop, rec.seq,
+                            probeTm(rec.seq, sal, form))))
+    if not (uniqueVal or zeroVal):
+        probs = ldaScorer.probsAt(testList, tempVal).tolist()
+        tested = [entry + (prob,) for entry, prob in zip(tested, probs)]
+    return list(chroms), candsSet, kept, tested
+
+
+def mergeShards(results, uniqueVal, zeroVal, probVal):
+    """Combines the cleanShard results of consecutive byte ranges into the
+    output list and the set of candidates of a serial run. A candidate is
+    only scored by the model the first time its coordinates are seen, and,
+    as in a serial run, nothing passes the model unless more than one
+    candidate was scored. In LDA mode the shard outputs are sorted by chrom,
+    in the order chroms are first seen in the file, and start, then k-way
+    merged, probes kept outright first, so that ties come out in the order
+    of the serial run's stable sort."""
+    candsSet = set()
+    chromRank = {}
+    for (chroms, cands, kept, tested) in results:
+        candsSet.update(cands)
+        for chrom in chroms:
+            chromRank.setdefault(chrom, len(chromRank))
+    if uniqueVal or zeroVal is True:
+        return [line for (chroms, cands, kept, tested) in results
+                for (chrom, start, line) in kept], candsSet
+
+    claimed = set()
+    passed = []
+    testNum = 0
+    for (chroms, cands, kept, tested) in results:
+        fresh = [entry for entry in tested
+                 if (entry[0], entry[2]) not in claimed]
+        claimed.update((entry[0], entry[2]) for entry in tested)
+        testNum += len(fresh)
+        passed.append(sorted(((chromRank[chrom], start, 1, line)
+                              for (chrom, start, startStr, line, prob)
+                              in fresh if float(prob) < probVal),
+                             key=lambda entry: entry[:2]))
+    if testNum <= 1:
+        passed = []
+    keptLists = [sorted(((chromRank[chrom], start, 0, line)
+                         for (chrom, start, line) in kept),
+                        key=lambda entry: entry[:2])
+                 for (chroms, cands, kept, tested) in results]
+    merged = heapq.merge(*(keptLists + passed),
+                         key=lambda entry: entry[:3])
+    return [entry[3] for entry in merged], candsSet
+
+
 def cleanOutput(inputFile, uniqueVal, zeroVal, probVal, tempVal, sal, form,
-                reportVal, debugVal, metaVal, outNameVal, startTime):
-    # Determine the stem of the input filename.
-    fileName = str(inputFile).split('.')[0]
+                reportVal, debugVal, metaVal, outNameVal, startTime,
+                workersVal=1, dupsVal=None):
+    # Determine the stem of the input filename. SAM read from standard input
+    # or a stream gives output named after 'stdin'.
+    if samPath(inputFile) is None:
+      fileName = 'stdin'
+    else:
+      fileName = str(inputFile).split('.')[0]
 
-    # Open input file for reading.
-    with open(inputFile, 'r') as f:
-      file_read = [line.strip() for line in f]
+    # Determine the name of the output file.
+    if outNameVal is None:
+      outName = '%s_probes' % fileName
+    else:
+      outName = outNameVal
 
-    # Determine how many unique candidates are in the .sam file
-    samIDs = [x.split('\t')[0].split(':')[1].split('-')[0] \
-              if x[0] is not '@' else ' ' for x in file_read]
+    # Keep track of how many unique candidates are in the .sam file. A
+    # candidate is identified by its chrom and start, as one file holds the
+    # candidates of every record mined by blockParse.
     candsSet = set()
-    for x in samIDs:
-      if x is not ' ':
-          candsSet.add(x)
 
     # Make a list to hold the output.
     outList = []
 
-    # Make lists to hold Report info if desired.
+    # Keep typed Report records if desired, and the coordinates of rejected
+    # candidates in a set so that each is only reported once.
     if reportVal or debugVal is True:
-      rejectList = []
-      reportList = []
-
-    if uniqueVal or zeroVal is True:
+      report = CleanLog(probVal, keep=reportVal is True,
+                        echo=debugVal is True)
+      rejectSet = set()
+
+    # Stream the alignments, fanning out those of reads deduplicated by
+    # dedupFastq to every candidate with the same sequence.
+    if isBam(inputFile):
+      records = readBam(inputFile, workersVal)
+    else:
+      records = readSam(inputFile)
+    if dupsVal is not None:
+      if not isinstance(dupsVal, DuplicateMap):
+          dupsVal = DuplicateMap.read(dupsVal)
+      records = dupsVal.expand(records)
+
+    # Process byte ranges of the .sam file in worker processes if desired.
+    # Report and Debug modes, SAM that is not read from a file and
+    # deduplicated reads always take one pass; .bam files are read in one
+    # pass with the blocks decompressed by the workers.
+    if workersVal > 1 and not (reportVal or debugVal) and \
+       samPath(inputFile) is not None and dupsVal is None and \
+       not isBam(inputFile):
+      if not (uniqueVal or zeroVal):
+          ldaScorer.tempIndex(tempVal)
+      shards = samShards(inputFile, 4 * workersVal)
+      with ProcessPoolExecutor(max_workers=workersVal) as executor:
+          results = list(executor.map(cleanShard,
+                                      *zip(*[(inputFile, start, end, uniqueVal,
+                                              zeroVal, tempVal, sal, form)
+                                             for (start, end) in shards])))
+      (outList, candsSet) = mergeShards(results, uniqueVal, zeroVal, probVal)
+
+    elif uniqueVal or zeroVal is True:
       # Process .sam file, keeping probes with only 0 or 1 unique alignment.
-      for i in range(0, len(file_read), 1):
-          if file_read[i][0] is not '@':
-              chromField = file_read[i].split('\t')[2]
-              chrom = file_read[i].split('\t')[0].split(':')[0]
-              start = file_read[i].split('\t')[0].split(':')[1].split('-')[0]
-              stop = file_read[i].split('\t')[0].split('-')[1].strip(' ')
-              seq = file_read[i].split('\t')[9]
-              Tm = probeTm(seq, sal, form)
-
-              # For unique mode.
-              if uniqueVal is True:
-                  if re.match('\*', chromField) is None \
-                     and re.search('XS', file_read[i]) is None:
-                      outList.append('%s\t%s\t%s\t%s\t%s' \
-                                     % (chrom, start, stop, seq, Tm))
-                      # Report info on selected probe if desired.
-                      if reportVal is True:
-                          reportList.append('Candidate probe at %s:%s-%s '
-                                            'aligned 1 time, added to output' \
-                                            % (chrom, start, stop))
-                      if debugVal is True:
-                          print('Candidate probe at %s:%s-%s aligned 1 time, '
-                                'added to output' % (chrom, start, stop))
-
-                  else:
-                      # Report info on rejected candidates if desired.
-                      if reportVal or debugVal is True:
-                          if start not in rejectList:
-                              rejectList.append(start)
-                              if re.match('\*', chromField) is not None:
-                                  if reportVal is True:
-                                      reportList.append('Candidate probe at '
-                                                        '%s:%s-%s aligned 0 '
-                                                        'times, was not added '
-                                                        'to output' \
-                                                        % (chrom, start, stop))
-                                  if debugVal is True:
-                                      print('Candidate probe at %s:%s-%s '
-                                            'aligned 0 times, was not added to '
-                                            'output' % (chrom, start, stop))
-                              elif re.search('XS', file_read[i]) is not None:
-                                  if reportVal is True:
-                                      reportList.append('Candidate probe at '
-                                                        '%s:%s-%s aligned >1 '
-                                                        'time, was not added '
-                                                        'to output' \
-                                                        % (chrom, start, stop))
-                                  if debugVal is True:
-                                      print('Candidate probe at %s:%s-%s '
-                                            'aligned >1 time, was not added to '
-                                            'output' % (chrom, start, stop))
-
-              # For zero mode.
-              elif zeroVal is True:
-                  if re.match('\*', chromField) is not None:
-                      outList.append('%s\t%s\t%s\t%s\t%s' \
-                                     % (chrom, start, stop, seq, Tm))
-                      # Report info on selected probe if desired.
-                      if reportVal is True:
-                          reportList.append('Candidate probe at %s:%s-%s '
-                                            'aligned 0 times, added to output '
-                                            '(Zero mode active)' \
-                                            % (chrom, start, stop))
-                      if debugVal is True:
-                          print('Candidate probe at %s:%s-%s aligned 0 times, '
-                                'added to output (Zero mode active)' \
-                                % (chrom, start, stop))
-                  else:
-                      # Report info on rejected candidates if desired.
-                      if reportVal or debugVal is True:
-                          if start not in rejectList:
-                              rejectList.append(start)
-                              if reportVal is True:
-                                  reportList.append('Candidate probe at '
-                                                    '%s:%s-%s aligned >0 '
-                                                    'times, was not added to '
-                                                    'output (Zero mode '
-                                                    'active)' \
-                                                    % (chrom, start, stop))
-                              if debugVal is True:
-                                  print('Candidate probe at %s:%s-%s aligned '
-                                        '>0 times, was not added to output '
-                                        '(Zero mode active)' \
-                                        % (chrom, start, stop))
+      for rec in records:
+          (chrom, start, stop) = (rec.chrom, rec.start, rec.stop)
+          candsSet.add((chrom, start))
+          aligned = rec.rname[:1] != '*'
+
+          # For unique mode.
+          if uniqueVal is True:
+              if aligned and rec.XS is None:
+                  outList.append('%s\t%s\t%s\t%s\t%s' \
+                                 % (chrom, start, stop, rec.seq,
+                                    probeTm(rec.seq, sal, form)))
+                  # Report info on selected probe if desired.
+                  if reportVal or debugVal is True:
+                      report.add(addUnique, chrom, start, stop, 1)
+
+              # Report info on rejected candidates if desired.
+              elif reportVal or debugVal is True:
+                  if (chrom, start) not in rejectSet:
+                      rejectSet.add((chrom, start))
+                      if not aligned:
+                          report.add(rejectZero, chrom, start, stop, 0)
+                      else:
+                          report.add(rejectMulti, chrom, start, stop, 2)
+
+          # For zero mode.
+          elif zeroVal is True:
+              if not aligned:
+                  outList.append('%s\t%s\t%s\t%s\t%s' \
+                                 % (chrom, start, stop, rec.seq,
+                                    probeTm(rec.seq, sal, form)))
+                  # Report info on selected probe if desired.
+                  if reportVal or debugVal is True:
+                      report.add(addZero, chrom, start, stop, 0)
+
+              # Report info on rejected candidates if desired.
+              elif reportVal or debugVal is True:
+                  if (chrom, start) not in rejectSet:
+                      rejectSet.add((chrom, start))
+                      report.add(rejectAligned, chrom, start, stop,
+                                 1 if rec.XS is None else 2)
 
     # Else use LDA model.
     else:
-      # Import scikit-learn LDA module.
-      # Note the module name changed between sklearn versions 0.16 and 0.17
-      from sklearn.discriminant_analysis import LinearDiscriminantAnalysis
-
       # Import numpy module.
       import numpy as np
 
-      # LDA model information.
-      tempList = [32, 37, 42, 47, 52, 57]
-      coefList = [[[-0.14494789, 0.18791679, 0.02588474]],
-                  [[-0.13364364, 0.22510179, 0.05494031]],
-                  [[-0.09006122, 0.25660706, 0.1078303]],
-                  [[-0.01593182, 0.24498485, 0.15753649]],
-                  [[0.01860365, 0.1750174, 0.17003374]],
-                  [[0.03236755, 0.11624593, 0.24306498]]]
-      interList = [-1.17545204, -5.40436344, -12.45549846,
-                   -19.32670233, -20.11992898, -23.98652919]
-      classList = [-1, 1]
-
-      # Convert lists to ndarrays.
-      coefArray = np.asarray(coefList)
-      interArray = np.asarray(interList)
-      classArray = np.asarray(classList)
-
-      # Determine which index to reference for model values.
-      np_index = tempList.index(tempVal)
-
-      # Build model from encoded values.
-      clf = LinearDiscriminantAnalysis()
-      clf.coef_ = coefArray[np_index]
-      clf.intercept_ = interArray[np_index]
-      clf.classes_ = classArray
-
-      # Determine which classifier parameters to use.
-      clfT = tempList.index(tempVal)
+      # Check that there is a model for the temperature.
+      ldaScorer.tempIndex(tempVal)
 
       # Make lists to hold data about candidates.
       testList = []
       testSet = set()
       candsInfo = []
+      testCoords = []
+
+      # Rank chroms in the order they are first seen, to sort the output by
+      # chrom and start.
+      chromRank = {}
 
       # Process .sam file and extract information about each candidate probe.
-      for i in range(0, len(file_read), 1):
-          if file_read[i][0] is not '@':
-              chromField = file_read[i].split('\t')[2]
-              chrom = file_read[i].split('\t')[0].split(':')[0]
-              start = file_read[i].split('\t')[0].split(':')[1].split('-')[0]
-              stop = file_read[i].split('\t')[0].split('-')[1].strip(' ')
-              seq = file_read[i].split('\t')[9]
-              Tm = probeTm(seq, sal, form)
-
-              # First look for candidate probes with only one unique alignment.
-              if re.match('\*', chromField) is None \
-                 and re.search('XS', file_read[i]) is None:
-                  outList.append('%s\t%s\t%s\t%s\t%s' \
-                                 % (chrom, start, stop, seq, Tm))
-                  # Record info on selected probe if desired.
-                  if reportVal is True:
-                      reportList.append('Candidate probe at %s:%s-%s aligned '
-                                        '1 time, added to output' \
-                                        % (chrom, start, stop))
-                  if debugVal is True:
-                      print('Candidate probe at %s:%s-%s aligned 1 time, '
-                            'added to output' % (chrom, start, stop))
-
-              # Populate lists that will be used to make the classification
-              # model input.
-              else:
-                  if re.match('\*', chromField) is None \
-                     and start not in testSet:
-                      t = [float(len(seq)),
-                           float(file_read[i].split('\t')[12].split(':')[2]),
-                           GC(seq)]
-                      testList.append(t)
-                      testSet.add(start)
-                      candsInfo.append('%s\t%s\t%s\t%s\t%s' \
-                                       % (chrom, start, stop, seq, Tm))
-                  else:
-                      # Report info on rejected candidates if desired.
-                      if reportVal or debugVal is True:
-                          if re.match('\*', chromField) is not None:
-                              if start not in rejectList:
-                                  rejectList.append(start)
-                                  if reportVal is True:
-                                      reportList.append('Candidate probe at '
-                                                        '%s:%s-%s aligned 0 '
-                                                        'times, was not added '
-                                                        'to output' \
-                                                        % (chrom, start, stop))
-                                  if debugVal is True:
-                                      print('Candidate probe at %s:%s-%s '
-                                            'aligned 0 times, was not added to '
-                                            'output' % (chrom, start, stop))
+      for rec in records:
+          (chrom, start, stop) = (rec.chrom, rec.start, rec.stop)
+          candsSet.add((chrom, start))
+          chromRank.setdefault(chrom, len(chromRank))
+          aligned = rec.rname[:1] != '*'
+
+          # First look for candidate probes with only one unique alignment.
+          if aligned and rec.XS is None:
+              outList.append('%s\t%s\t%s\t%s\t%s' \
+                             % (chrom, start, stop, rec.seq,
+                                probeTm(rec.seq, sal, form)))
+              # Record info on selected probe if desired.
+              if reportVal or debugVal is True:
+                  report.add(addUnique, chrom, start, stop, 1)
+
+          # Populate lists that will be used to make the classification
+          # model input. The features are the length, the score of the second
+          # best alignment and the %G+C.
+          else:
+              if aligned and (chrom, start) not in testSet:
+                  t = [float(len(rec.seq)), float(rec.XS), GC(rec.seq)]
+                  testList.append(t)
+                  testSet.add((chrom, start))
+                  candsInfo.append('%s\t%s\t%s\t%s\t%s' \
+                                   % (chrom, start, stop, rec.seq,
+                                      probeTm(rec.seq, sal, form)))
+                  if reportVal or debugVal is True:
+                      testCoords.append((chrom, start, stop))
+
+              # Report info on rejected candidates if desired.
+              elif reportVal or debugVal is True:
+                  if not aligned and (chrom, start) not in rejectSet:
+                      rejectSet.add((chrom, start))
+                      report.add(rejectZero, chrom, start, stop, 0)
 
       # Make ndarray for input into classifier.
       testArray = np.asarray(testList)
 
-      # Create classifier
-      clf = LinearDiscriminantAnalysis()
-
-      # Load temperature-specific model information.
-      clf.coef_ = coefArray[clfT]
-      clf.intercept_ = interArray[clfT]
-      clf.classes_ = classArray
-
       # Use model to predict the probability that candidate
       # probes will have thermodynamically relevant
       # off-target binding sites unless all have just 1
       # alignment in the .sam file.
       if len(testArray) > 1:
-          probs = clf.predict_proba(testArray)[:, 1]
+          probs = ldaScorer.probsAt(testArray, tempVal)
 
           # Filter through tested candidates using
           # based on user-specified probability threshold.
           for i in range(0, len(probs), 1):
               if float(probs[i]) < probVal:
                   outList.append(candsInfo[i])
-                  if reportVal is True:
-                      reportList.append('Candidate probe at %s:%s-%s added to '
-                                        'output with %0.4f < %0.4f probability of '
-                                        'having off-target sites' \
-                                        % (candsInfo[i].split('\t')[0],
-                                           candsInfo[i].split('\t')[1],
-                                           candsInfo[i].split('\t')[2],
-                                           probs[i], probVal))
-                  if debugVal is True:
-                      print('Candidate probe at %s:%s-%s added to output with '
-                            '%0.4f < %0.4f probability of having off-target sites'
-                            % (candsInfo[i].split('\t')[0],
-                               candsInfo[i].split('\t')[1],
-                               candsInfo[i].split('\t')[2],
-                               probs[i], probVal))
-              else:
-                  if reportVal is True:
-                      reportList.append('Candidate probe at %s:%s-%s filtered with '
-                                        '%0.4f => %0.4f probability of having '
-                                        'off-target sites' \
-                                        % (candsInfo[i].split('\t')[0],
-                                           candsInfo[i].split('\t')[1],
-                                           candsInfo[i].split('\t')[2],
-                                           probs[i], probVal))
-                  if debugVal is True:
-                      print('Candidate probe at %s:%s-%s filtered with '
-                            '%0.4f => %0.4f probability of having off-target sites'
-                            % (candsInfo[i].split('\t')[0],
-                               candsInfo[i].split('\t')[1],
-                               candsInfo[i].split('\t')[2],
-                               probs[i], probVal))
-      # Sort output list.
-      outList.sort(key=lambda x: [int(x.split('\t')[1])])
-
-    # Determine the name of the output file.
-    if outNameVal is None:
-      outName = '%s_probes' % fileName
-    else:
-      outName = outNameVal
+                  if reportVal or debugVal is True:
+                      report.add(addLDA, *testCoords[i], 2, probs[i])
+              elif reportVal or debugVal is True:
+                  report.add(filterLDA, *testCoords[i], 2, probs[i])
+      # Sort output list by chrom and start.
+      outList.sort(key=lambda x: (chromRank[x.split('\t', 1)[0]],
+                                  int(x.split('\t')[1])))
 
     # Create the output file.
     output = open('%s.bed' % outName, 'w')
@@ -359,39 +776,42 @@ def cleanOutput(inputFile, uniqueVal, zeroVal, probVal, tempVal, sal, form,
     if metaVal is True:
       metaText = open('%s_outputClean_meta.txt' % outName, 'w')
       metaText.write('%s\t%f\t%s\t%d\t%d' \
-                     % (inputFile,
+                     % (samPath(inputFile) or '-',
                         timeit.default_timer() - startTime,
                         Version, cleanNum, candsNum))
       metaText.close()
 
-    # If desired, create report file.
+    # If desired, create report files: every record as a TSV file and the
+    # log, with the records rendered as they are written.
     if reportVal is True:
-      reportOut = open('%s_outputClean_log.txt' % outName, 'w')
-      reportList.sort(key=lambda x: [int(x.split(':')[1].split('-')[0])])
-      reportList.insert(0, 'Results produced by %s %s' % (scriptName, Version))
-      reportList.insert(1, '-' * 100)
+      report.writeTsv('%s_outputClean_report.tsv' % outName)
+      headerList = ['Results produced by %s %s' % (scriptName, Version),
+                    '-' * 100]
       if uniqueVal is True:
-          reportList.insert(2, 'outputClean returned %d of %d / %0.4f%% '
-                               'candidate probes as having exactly 1 ' 
-                               'alignment' \
-                               % (cleanNum, candsNum,
-                                  float(cleanNum) / float(candsNum) * 100))
+          headerList.append('outputClean returned %d of %d / %0.4f%% '
+                            'candidate probes as having exactly 1 '
+                            'alignment' \
+                            % (cleanNum, candsNum,
+                               float(cleanNum) / float(candsNum) * 100))
       elif zeroVal is True:
-          reportList.insert(2, 'outputClean returned %d of %d / %0.4f%% '
-                               'candidate probes as having 0 alignments (Zero '
-                                'mode active)' \
-                               % (cleanNum, candsNum,
-                                  float(cleanNum) / float(candsNum) * 100))
+          headerList.append('outputClean returned %d of %d / %0.4f%% '
+                            'candidate probes as having 0 alignments (Zero '
+                            'mode active)' \
+                            % (cleanNum, candsNum,
+                               float(cleanNum) / float(candsNum) * 100))
       else:
-          reportList.insert(2, 'outputClean passed %d of %d / %0.4f%% '
-                               'candidate probes through specificity filtering '
-                               'using the %dC LDA model' \
-                               % (cleanNum, candsNum,
-                                  float(cleanNum) / float(candsNum) * 100,
-                                  tempVal))
-      reportList.insert(3, '-' * 100)
-      reportOut.write('\n'.join(reportList))
-      reportOut.close()
+          headerList.append('outputClean passed %d of %d / %0.4f%% '
+                            'candidate probes through specificity filtering '
+                            'using the %dC LDA model' \
+                            % (cleanNum, candsNum,
+                               float(cleanNum) / float(candsNum) * 100,
+                               tempVal))
+      headerList.append('-' * 100)
+      with open('%s_outputClean_log.txt' % outName, 'w') as reportOut:
+          reportOut.write('\n'.join(headerList))
+          for line in report.lines():
+              reportOut.write('\n')
+              reportOut.write(line)
 
 
 def main():
@@ -407,13 +827,15 @@ def main():
         'containing only probes predicted to have one thermodynamically '
         'relevant target at the hybridization temperature provided by -T. '
         'Classification is performed using a temperature-specific linear '
-        'discriminant analysis (LDA) model that requires scikit-learn 0.17+. '
+        'discriminant analysis (LDA) model. '
         'Calculates the Tm of each probe based on -F and -s' \
         % (scriptName, Version))
     requiredNamed = userInput.add_argument_group('required arguments')
     mutEx = userInput.add_mutually_exclusive_group()
     requiredNamed.add_argument('-f', '--file', action='store', required=True,
-                               help='The .sam file to be processed')
+                               help='The .sam or .bam file to be processed, '
+                                    'or \'-\' to read SAM from standard '
+                                    'input, e.g. piped from the aligner')
     mutEx.add_argument('-l', '--lda', action='store_true', default=True,
                        help='Filter the SAM file using LDA model, On by '
                             'default.')
@@ -449,8 +871,10 @@ def main():
                                 'calculation, default is 50')
     userInput.add_argument('-R', '--Report', action='store_true', default=False,
                            help='Write a Report file detailing the results of '
-                                '.sam cleaning. Off by default. Note, '
-                                'selecting this option will slow the script.')
+                                '.sam cleaning, and a _report.tsv file with '
+                                'the coordinates, number of alignments, LDA '
+                                'probability and decision of each candidate. '
+                                'Off by default.')
     userInput.add_argument('-D', '--Debug', action='store_true', default=False,
                            help='The same as -Report, but prints info to '
                                 'terminal instead of writing a log file. Off '
@@ -465,6 +889,22 @@ def main():
     userInput.add_argument('-o', '--output', action='store', default=None,
                            type=str,
                            help='Specify the stem of the output filename')
+    userInput.add_argument('-w', '--workers', action='store', default=1,
+                           type=int,
+                           help='The number of workers. The .sam file is '
+                                'split into byte ranges at read boundaries '
+                                'that are filtered in parallel processes and '
+                                'merged into the same output as a single '
+                                'process, except in Report and Debug modes '
+                                'and when reading standard input. A .bam '
+                                'file is read in one pass with its blocks '
+                                'decompressed by this many threads. '
+                                'Default is 1')
+    userInput.add_argument('--dups', action='store', default=None, type=str,
+                           help='The _dups.tsv file written by dedupFastq '
+                                'for a .sam file of deduplicated reads. The '
+                                'alignments of each read are applied to '
+                                'every candidate with the same sequence')
 
     # Import user-specified command line values.
     args = userInput.parse_args()
@@ -479,9 +919,12 @@ def main():
     debugVal = args.Debug
     metaVal = args.Meta
     outNameVal = args.output
+    workersVal = args.workers
+    dupsVal = args.dups
 
     cleanOutput(inputFile, uniqueVal, zeroVal, probVal, tempVal, sal, form,
-                reportVal, debugVal, metaVal, outNameVal, startTime)
+                reportVal, debugVal, metaVal, outNameVal, startTime,
+                workersVal, dupsVal)
 
     # Print wall-clock runtime to terminal.
     print('Program took %f seconds' % (timeit.default_timer() - startTime))
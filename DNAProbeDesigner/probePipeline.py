@@ -0,0 +1,268 @@
+#!/usr/bin/env python
+# --------------------------------------------------------------------------
+# probePipeline.py
+#
+# Runs blockParse, the aligner and outputClean as one concurrent pipe chain.
+# blockParse streams its FASTQ into the aligner, optionally through dedupFastq
+# so that each distinct sequence is aligned once, and the SAM written by the
+# aligner is filtered by outputClean as it arrives, so the three stages
+# overlap in time and neither the FASTQ nor the SAM has to be written to disk
+# and read back. The SAM can still be kept with -S for the duplex and
+# secondary structure filters.
+# --------------------------------------------------------------------------
+
+# Specific script name.
+scriptName = 'probePipeline'
+
+# Import module for handling input arguments.
+import argparse
+
+# Import modules for running the blockParse and aligner processes.
+import os
+import shlex
+import subprocess
+import sys
+import threading
+
+# Import timeit module to estimate the wall clock time of the run.
+import timeit
+
+# Import outputClean, the LDA models and the deduplication stage.
+try:
+    from DNAProbeDesigner.outputClean import cleanOutput
+    from DNAProbeDesigner.ldaModel import ldaScorer
+    from DNAProbeDesigner.dedupFastq import DuplicateMap, dedupFastq
+except ImportError:
+    from outputClean import cleanOutput
+    from ldaModel import ldaScorer
+    from dedupFastq import DuplicateMap, dedupFastq
+
+# The blockParse script, run in its own process.
+blockParseScript = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                'blockParse.py')
+
+
+def bowtie2Command(indexPath):
+    """Returns the bowtie2 command of the OligoMiner protocol for the given
+    index, reading FASTQ from standard input and writing SAM without header
+    lines to standard output."""
+    return ['bowtie2', '-x', indexPath, '-U', '-', '--no-hd', '-t', '-k', '2',
+            '--local', '-D', '20', '-R', '3', '-N', '1', '-L', '20',
+            '-i', 'C,4', '--score-min', 'G,1,4']
+
+
+def teeLines(lines, fileName):
+    """Yields the lines of a binary stream while copying them to a file."""
+    with open(fileName, 'wb') as copy:
+        for line in lines:
+            copy.write(line)
+            yield line
+
+
+def dedupStage(fastq, alignerInput, dupMap, result):
+    """Runs dedupFastq between the blockParse and aligner pipes in a thread,
+    closing both pipes when done. The read counts, or the exception, are put
+    in the result dict."""
+    try:
+        result['counts'] = dedupFastq(fastq, alignerInput, dupMap)
+    except BrokenPipeError:
+        # The aligner exited early; its exit status is reported instead.
+        pass
+    except BaseException as e:
+        result['error'] = e
+    finally:
+        fastq.close()
+        try:
+            alignerInput.close()
+        except BrokenPipeError:
+            pass
+
+
+def runPipeline(inputFile, alignerCommand, outNameVal=None, samFileVal=None,
+                blockParseArgs=(), uniqueVal=False, zeroVal=False, probVal=0.5,
+                tempVal=42, sal=390, form=50, reportVal=False, debugVal=False,
+                metaVal=False, startTime=None, dedupVal=False):
+    """Mines the FASTA file with blockParse, pipes the FASTQ through the
+    aligner command, which has to read FASTQ from standard input and write
+    SAM to standard output, and filters the SAM with outputClean in this
+    process as it is produced. blockParseArgs are extra blockParse command
+    line arguments; the salt and formamide concentrations are shared by both
+    stages. If samFileVal is given, the SAM is also written to that file.
+    If dedupVal is True, reads with the same sequence are aligned once and
+    their alignments are applied to every candidate; the SAM file then only
+    holds the distinct reads. Raises subprocess.CalledProcessError if
+    blockParse or the aligner fails."""
+
+    if startTime is None:
+        startTime = timeit.default_timer()
+
+    # Check that there is a model for the temperature before starting.
+    if not (uniqueVal or zeroVal):
+        ldaScorer.tempIndex(tempVal)
+
+    # Determine the stem of the output filename.
+    if outNameVal is None:
+        outName = '%s_probes' % str(inputFile).split('.')[0]
+    else:
+        outName = outNameVal
+
+    blockParseCommand = [sys.executable, blockParseScript, '-f', inputFile,
+                         '-o', '-', '-s', str(sal), '-F', str(form)] + \
+                        list(blockParseArgs)
+    blockParse = subprocess.Popen(blockParseCommand, stdout=subprocess.PIPE)
+    try:
+        aligner = subprocess.Popen(alignerCommand,
+                                   stdin=subprocess.PIPE if dedupVal
+                                   else blockParse.stdout,
+                                   stdout=subprocess.PIPE)
+    except OSError:
+        blockParse.kill()
+        blockParse.wait()
+        blockParse.stdout.close()
+        raise
+
+    # Either deduplicate the reads in a thread of this process, or hand the
+    # pipe to the aligner, which holds its own copy of it, so blockParse sees
+    # a broken pipe if the aligner exits early.
+    dupMap = None
+    dedup = {}
+    if dedupVal:
+        dupMap = DuplicateMap()
+        dedupThread = threading.Thread(target=dedupStage,
+                                       args=(blockParse.stdout, aligner.stdin,
+                                             dupMap, dedup))
+        dedupThread.start()
+    else:
+        blockParse.stdout.close()
+
+    # Stop both stages if outputClean fails.
+    error = None
+    killed = []
+    try:
+        sam = aligner.stdout
+        if samFileVal is not None:
+            sam = teeLines(sam, samFileVal)
+        cleanOutput(sam, uniqueVal, zeroVal, probVal, tempVal, sal, form,
+                    reportVal, debugVal, metaVal, outName, startTime,
+                    dupsVal=dupMap)
+    except BaseException as e:
+        error = e
+        killed = [proc for proc in (aligner, blockParse)
+                  if proc.poll() is None]
+        for proc in killed:
+            proc.kill()
+    finally:
+        aligner.stdout.close()
+        aligner.wait()
+        blockParse.wait()
+        if dedupVal:
+            dedupThread.join()
+
+    # A failed stage is usually the cause of a failure of outputClean, e.g.
+    # on empty input, so it is reported first, the aligner before blockParse
+    # as blockParse fails with a broken pipe if the aligner exits early.
+    for proc, command in [(aligner, alignerCommand),
+                          (blockParse, blockParseCommand)]:
+        if proc.returncode != 0 and proc not in killed:
+            raise subprocess.CalledProcessError(proc.returncode,
+                                                command) from error
+    if error is not None:
+        raise error
+    if 'error' in dedup:
+        raise dedup['error']
+    if 'counts' in dedup:
+        (readNum, distinctNum) = dedup['counts']
+        print('dedupFastq kept %d of %d / %0.4f%% reads as distinct sequences'
+              % (distinctNum, readNum,
+                 float(distinctNum) / float(max(readNum, 1)) * 100))
+
+
+def main():
+    """Given a FASTA file, outputs a Browser Extendable Data (BED) file of
+    probes mined by blockParse and filtered by outputClean after alignment,
+    with the three stages running concurrently."""
+
+    startTime = timeit.default_timer()
+
+    # Allow user to input parameters on command line.
+    userInput = argparse.ArgumentParser(description=\
+        '%s. Requires a FASTA file as input. Runs blockParse, bowtie2 (or '
+        'the aligner given with -a) and outputClean as a pipe chain and '
+        'returns the .bed file of outputClean. The aligner has to read FASTQ '
+        'from standard input and write SAM to standard output.' % scriptName)
+    requiredNamed = userInput.add_argument_group('required arguments')
+    mutEx = userInput.add_mutually_exclusive_group()
+    requiredNamed.add_argument('-f', '--file', action='store', required=True,
+                               help='The FASTA file to find probes in')
+    userInput.add_argument('-x', '--index', action='store', default=None,
+                           type=str,
+                           help='The bowtie2 index to align the candidate '
+                                'probes to')
+    userInput.add_argument('-a', '--aligner', action='store', default=None,
+                           type=str,
+                           help='The aligner command line, used instead of '
+                                'bowtie2 with -x')
+    userInput.add_argument('-b', '--blockParseArgs', action='store',
+                           default='', type=str,
+                           help='Extra blockParse arguments, e.g. '
+                                '\'-l 30 -L 37 -w 4\'')
+    userInput.add_argument('-d', '--dedup', action='store_true',
+                           default=False,
+                           help='Align each distinct candidate sequence once '
+                                'and apply the result to every candidate '
+                                'with that sequence. Off by default')
+    userInput.add_argument('-S', '--sam', action='store', default=None,
+                           type=str,
+                           help='Also write the SAM output of the aligner to '
+                                'this file')
+    mutEx.add_argument('-u', '--unique', action='store_true', default=False,
+                       help='Only return probes aligning exactly one time. '
+                             'Does not use the LDA model. Off by default.')
+    mutEx.add_argument('-0', '--zero', action='store_true', default=False,
+                       help='Only return probes aligning zero times. Does not '
+                            'use the LDA model. Off by default.')
+    userInput.add_argument('-p', '--prob', action='store', default=0.5,
+                           type=float,
+                           help='The probability threshold of the LDA model. '
+                                'Default=0.5')
+    userInput.add_argument('-T', '--Temp', action='store', type=float,
+                           default=42,
+                           help='The temperature of the LDA model. Options '
+                                'are 32, 37, 42, 47, 52, 57. Default=42')
+    userInput.add_argument('-s', '--salt', action='store', default=390,
+                           type=int,
+                           help='The mM Na+ concentration to be used for Tm '
+                                'calculation, default is 390')
+    userInput.add_argument('-F', '--formamide', action='store', default=50,
+                           type=float,
+                           help='The percent formamide to be used for Tm '
+                                'calculation, default is 50')
+    userInput.add_argument('-R', '--Report', action='store_true', default=False,
+                           help='Write the outputClean Report file. Off by '
+                                'default')
+    userInput.add_argument('-M', '--Meta', action='store_true', default=False,
+                           help='Write the outputClean meta information '
+                                'file. Off by default')
+    userInput.add_argument('-o', '--output', action='store', default=None,
+                           type=str,
+                           help='Specify the stem of the output filename')
+
+    # Import user-specified command line values.
+    args = userInput.parse_args()
+    if args.aligner is not None:
+        alignerCommand = shlex.split(args.aligner)
+    elif args.index is not None:
+        alignerCommand = bowtie2Command(args.index)
+    else:
+        userInput.error('one of -x/--index or -a/--aligner is required')
+
+    runPipeline(args.file, alignerCommand, args.output, args.sam,
+                shlex.split(args.blockParseArgs), args.unique, args.zero,
+                args.prob, args.Temp, args.salt, args.formamide, args.Report,
+                False, args.Meta, startTime, args.dedup)
+
+    # Print wall-clock runtime to terminal.
+    print('Program took %f seconds' % (timeit.default_timer() - startTime))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# --------------------------------------------------------------------------
+# probeTable.py
+#
+# Typed columnar store of a filtered probe set. Each filtering stage keeps
+# its probes as a NumPy structured array with the number, sequence,
+# coordinates and Tm of every probe, its duplex probabilities at the
+# temperatures of the LDA models and the MFE of its most stable secondary
+# structure (NaN until secondary_structure has run). The array is saved as a .npy sidecar next to
+# the text file of the stage, so later stages, plotting and the GUI load it
+# memory-mapped instead of parsing numbers back out of the text, which is
+# written only as an export format.
+# --------------------------------------------------------------------------
+
+# Import os for the sidecar paths and modification times.
+import os
+
+# Import numpy module.
+import numpy as np
+
+# Temperatures of the duplex probability columns.
+try:
+    from DNAProbeDesigner.ldaModel import ldaTemps
+except ImportError:
+    from ldaModel import ldaTemps
+
+
+def probeDtype(seqWidth, chromWidth):
+    """Record type of a probe, with sequences and chromosome names stored as
+    fixed-width ASCII of the given widths."""
+    return np.dtype([('number', '<i8'), ('seq', 'S%d' % max(seqWidth, 1)),
+                     ('chrom', 'S%d' % max(chromWidth, 1)),
+                     ('start', '<i8'), ('stop', '<i8'), ('Tm', '<f8'),
+                     ('probs', '<f8', (len(ldaTemps),)), ('MFE', '<f8')])
+
+
+def newTable(seqs, probs, chroms=None, starts=None, stops=None, Tms=None):
+    """Builds the table of a probe set from its sequences and (n, 6) duplex
+    probabilities. Probes are numbered from 1; chromosomes default to empty,
+    coordinates to -1 and Tm to NaN when unknown; MFE is NaN."""
+    chroms = [''] * len(seqs) if chroms is None else chroms
+    table = np.zeros(len(seqs), dtype=probeDtype(
+        max((len(seq) for seq in seqs), default=1),
+        max((len(chrom) for chrom in chroms), default=1)))
+    table['number'] = np.arange(1, len(seqs) + 1)
+    table['seq'] = [seq.encode() for seq in seqs]
+    table['chrom'] = [chrom.encode() for chrom in chroms]
+    table['start'] = -1 if starts is None else starts
+    table['stop'] = -1 if stops is None else stops
+    table['Tm'] = np.nan if Tms is None else Tms
+    table['probs'] = np.asarray(probs, dtype=np.float64).reshape(-1,
+                                                                len(ldaTemps))
+    table['MFE'] = np.nan
+    return table
+
+
+def tablePath(fileName):
+    """Path of the .npy sidecar of a probe file."""
+    return '%s.npy' % os.path.splitext(fileName)[0]
+
+
+def writeProbes(fileName, header, table):
+    """Writes the text export of a probe set, one line per probe with its
+    number, sequence and duplex probabilities and, once computed, MFE,
+    followed by the table as its sidecar."""
+    withMFE = bool(len(table)) and not np.isnan(table['MFE']).all()
+    with open(fileName, 'w') as f:
+        f.write(header)
+        for number, seq, probs, MFE in zip(table['number'].tolist(),
+                                           table['seq'],
+                                           table['probs'].tolist(),
+                                           table['MFE'].tolist()):
+            fields = [str(number), seq.decode(),
+                      str([round(prob, 8) for prob in probs])]
+            if withMFE:
+                fields.append(str(MFE))
+            f.write('%s \n' % ' \t '.join(fields))
+    np.save(tablePath(fileName), table)
+
+
+def parseProbes(fileName):
+    """Builds a table from the text export of a probe set, for files
+    written without a sidecar."""
+    seqs = []
+    numbers = []
+    allProbs = []
+    MFEs = []
+    with open(fileName) as f:
+        next(f)
+        for line in f:
+            parts = line.split('\t')
+            numbers.append(int(parts[0]))
+            seqs.append(parts[1].strip())
+            allProbs.append([float(prob.strip(' [').strip('] \n'))
+                             for prob in parts[2].split(',')])
+            MFEs.append(float(parts[3]) if len(parts) > 3 else np.nan)
+    table = newTable(seqs, allProbs)
+    table['number'] = numbers
+    table['MFE'] = MFEs
+    return table
+
+
+def readProbes(fileName):
+    """Loads the table of a probe file. The sidecar is memory-mapped
+    read-only if it is at least as new as the text file; otherwise the text
+    is parsed."""
+    path = tablePath(fileName)
+    if os.path.exists(path) and \
+       os.path.getmtime(path) >= os.path.getmtime(fileName):
+        return np.load(path, mmap_mode='r')
+    return parseProbes(fileName)
@@ -1,6 +1,257 @@
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
 import seqfold
+try:
+    from DNAProbeDesigner.probeTable import readProbes, writeProbes
+    from DNAProbeDesigner.mfeCache import MfeCache
+    from DNAProbeDesigner.foldEnergies import getFoldEnergies
+    from DNAProbeDesigner.foldEngine import getFoldEngine
+    from DNAProbeDesigner.tmEngine import tmCodes
+except ImportError:
+    from probeTable import readProbes, writeProbes
+    from mfeCache import MfeCache
+    from foldEnergies import getFoldEnergies
+    from foldEngine import getFoldEngine
+    from tmEngine import tmCodes
 
-def filter_secondary_structure(bed_filename, filter_MFE):
+# number of probes below which MFEs are calculated in this process, where starting a pool costs more than it saves #
+PARALLEL_MFE_THRESHOLD = 1000
+# largest number of probes sent to a worker at a time; smaller chunks are used to give every worker several #
+MFE_CHUNK_SIZE = 256
+# largest error of an MFE from seqfold rounding the energy of each of its loops to 0.1 kcal/mol #
+LOOP_ROUNDING = 0.05
+# number of probes of the same length whose MFE bounds are calculated together #
+BOUND_BATCH_SIZE = 512
+# ways of folding probes: one at a time with seqfold, or in batches of the same length with foldEngine #
+FOLD_ENGINES = ('seqfold', 'numpy')
+
+###################################################################################################
+
+def fold_chunk(seqs, temp, engine='seqfold'):
+    '''
+    Calculates the minimum free energy of each sequence of a chunk, in a worker process or in this one.
+        Arguments:
+            - seqs [list] : probe sequences
+            - temp [float] : folding temperature in C
+            - engine [str] : 'seqfold' or 'numpy', which gives the same MFEs (default = 'seqfold')
+        Outputs:
+            - MFEs [list] : minimum free energies in kcal/mol
+    '''
+    if engine == 'numpy':
+        return getFoldEngine(temp).mfes(seqs).tolist()
+    return [seqfold.dg(seq, temp) for seq in seqs]
+
+###################################################################################################
+
+def calc_MFEs(seqs, temp=37.0, workers=None, progress=None, min_parallel=PARALLEL_MFE_THRESHOLD, cache=None,
+              engine='seqfold'):
+    '''
+    Calculates the minimum free energy of many sequences. Each distinct sequence is folded once, and only if it
+    is not in the cache; the folding is done as by fold_MFEs.
+        Arguments:
+            - seqs [list] : probe sequences
+            - temp [float] : folding temperature in C (default = 37)
+            - workers [int] : number of worker processes (default = None, one per CPU)
+            - progress [callable] : called as progress(done, total) with the number of sequences folded so far
+                                    after each chunk (default = None)
+            - min_parallel [int] : smallest number of sequences folded in worker processes
+            - cache [MfeCache or str] : cache of MFEs from earlier runs, or the path of its database,
+                                        updated with the new MFEs (default = None, no cache)
+            - engine [str] : 'seqfold' to fold with seqfold.dg, or 'numpy' to fold batches of probes of the same
+                             length with foldEngine; both give the same MFEs and share the cache
+                             (default = 'seqfold')
+        Outputs:
+            - MFEs [np.ndarray] : minimum free energies in kcal/mol, in the order of seqs
+    '''
+    if engine not in FOLD_ENGINES:
+        raise ValueError(f"Unknown folding engine: {engine}")
+    # index of each sequence among the distinct sequences #
+    distinct = {}
+    index = np.array([distinct.setdefault(seq, len(distinct)) for seq in seqs], dtype=np.int64)
+    distinct = list(distinct)
+
+    opened = isinstance(cache, str)
+    if opened:
+        cache = MfeCache(cache)
+    try:
+        known = cache.get(distinct, temp) if cache is not None else {}
+        unknown = [seq for seq in distinct if seq not in known]
+        folded = fold_MFEs(unknown, temp, workers, progress, min_parallel, engine)
+        if cache is not None:
+            cache.put(dict(zip(unknown, folded.tolist())), temp)
+    finally:
+        if opened:
+            cache.close()
+
+    known.update(zip(unknown, folded.tolist()))
+    distinct_MFEs = np.array([known[seq] for seq in distinct], dtype=np.float64)
+    return distinct_MFEs[index]
+
+###################################################################################################
+
+def fold_MFEs(seqs, temp=37.0, workers=None, progress=None, min_parallel=PARALLEL_MFE_THRESHOLD, engine='seqfold'):
+    '''
+    Folds many sequences, in chunks spread over a pool of worker processes.
+    Runs in this process when there are fewer than min_parallel sequences, only one worker or only one chunk.
+        Arguments:
+            - seqs [list] : probe sequences
+            - temp [float] : folding temperature in C (default = 37)
+            - workers [int] : number of worker processes (default = None, one per CPU)
+            - progress [callable] : called as progress(done, total) with the number of sequences folded so far
+                                    after each chunk (default = None)
+            - min_parallel [int] : smallest number of sequences folded in worker processes
+            - engine [str] : 'seqfold' or 'numpy', see calc_MFEs (default = 'seqfold')
+        Outputs:
+            - MFEs [np.ndarray] : minimum free energies in kcal/mol, in the order of seqs
+    '''
+    if workers is None:
+        workers = os.cpu_count() or 1
+    MFEs = np.empty(len(seqs), dtype=np.float64)
+    chunk_size = max(1, min(MFE_CHUNK_SIZE, -(-len(seqs) // (4 * max(workers, 1)))))
+    # foldEngine folds the probes of a chunk together only when they have the same length, so for it the chunks #
+    # are cut from the probes ordered by length, and each chunk keeps the positions of its probes #
+    if engine == 'numpy':
+        order = np.argsort([len(seq) for seq in seqs], kind='stable')
+    else:
+        order = np.arange(len(seqs))
+    chunks = [(order[k:k + chunk_size], [seqs[m] for m in order[k:k + chunk_size]])
+              for k in range(0, len(seqs), chunk_size)]
+    done = 0
+
+    if workers <= 1 or len(chunks) <= 1 or len(seqs) < min_parallel:
+        for where, chunk in chunks:
+            MFEs[where] = fold_chunk(chunk, temp, engine)
+            done += len(chunk)
+            if progress is not None:
+                progress(done, len(seqs))
+        return MFEs
+
+    # chunks finish in any order, and are put back in place by the positions of their probes #
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(fold_chunk, chunk, temp, engine): where for where, chunk in chunks}
+        for future in as_completed(futures):
+            where = futures[future]
+            MFEs[where] = future.result()
+            done += len(where)
+            if progress is not None:
+                progress(done, len(seqs))
+    return MFEs
+
+###################################################################################################
+
+def mfe_lower_bounds(seqs, temp=37.0):
+    '''
+    Calculates a lower bound of the MFE that seqfold gives each sequence, a few times faster than folding. The
+    bound is the MFE of a relaxed model solved for many sequences at once with NumPy: stems are built from seqfold's
+    exact stacks, single mismatches and hairpins, while every other loop costs the least that seqfold's tables
+    allow for it, and the rounding of each loop energy by seqfold is taken off. Sequences with bases other than
+    A/C/G/T get -inf, as do those without T, which seqfold folds with its RNA parameters.
+        Arguments:
+            - seqs [list] : probe sequences
+            - temp [float] : folding temperature in C (default = 37)
+        Outputs:
+            - bounds [np.ndarray] : lower bounds of the minimum free energies in kcal/mol, in the order of seqs
+    '''
+    energies = getFoldEnergies(temp)
+    bounds = np.full(len(seqs), -np.inf)
+    lengths = np.array([len(seq) for seq in seqs], dtype=np.int64)
+    for length in np.unique(lengths):
+        rows = np.flatnonzero(lengths == length)
+        codes = tmCodes[np.frombuffer(''.join(seqs[row] for row in rows).encode('latin-1'),
+                                      dtype=np.uint8)].reshape(len(rows), length)
+        valid = (codes < 4).all(axis=1) & (codes == 3).any(axis=1)
+        rows = rows[valid]
+        codes = codes[valid]
+        for k in range(0, len(rows), BOUND_BATCH_SIZE):
+            bounds[rows[k:k + BOUND_BATCH_SIZE]] = lower_bound_batch(codes[k:k + BOUND_BATCH_SIZE], energies)
+    return bounds
+
+###################################################################################################
+
+def lower_bound_batch(codes, energies):
+    '''
+    Solves the relaxed folding model of mfe_lower_bounds for a batch of sequences of the same length.
+    The model has the recursions of seqfold, with V (the sequence closed by a pair), W (any structure) and the
+    branches of multibranch loops, each of which costs at least its dangling end:
+        - V(i, j) is the least of the hairpin closed by (i, j), a stack or a single mismatch on the next pair,
+          a bulge or internal loop around any structure W(i + 1, j - 1), and a multibranch loop around two or
+          more branches; each of these loops is rounded down by LOOP_ROUNDING
+        - W(i, j) is the least of W(i + 1, j), W(i, j - 1), V(i, j) and a multibranch loop of two or more
+          branches
+        Arguments:
+            - codes [np.ndarray] : (n, length) base codes of sequences with only A/C/G/T
+            - energies [FoldEnergies] : energy tables at the folding temperature
+        Outputs:
+            - bounds [np.ndarray] : lower bounds of the minimum free energies in kcal/mol, -inf for sequences
+                                    that cannot form any pair
+    '''
+    (count, length) = codes.shape
+    if length < 5:
+        return np.full(count, -np.inf)
+    # pairs by (i, j), with the sequences last where the recursions read them as contiguous rows #
+    (I, J) = np.indices((length, length))
+    bases = codes.T
+    paired = bases[:, None, :] + bases[None, :, :] == 3
+    closes = paired & (J - I >= 4)[..., None]
+
+    # energies of the loops closed by every pair, calculated only where the pairs are #
+    (i, j, rows) = np.nonzero(closes)
+    def energy(values, fill=np.inf):
+        array = np.full((length, length, count), fill)
+        array[i, j, rows] = values
+        return array
+    stack = energy(np.nan_to_num(energies.stackEnergies(codes, rows, i, i + 1, j, j - 1), nan=np.inf))
+    mismatch = energy(np.nan_to_num(energies.stackEnergies(codes, rows, i, i + 2, j, j - 2)
+                                    + energies.stackEnergies(codes, rows, i + 1, i + 2, j - 1, j - 2), nan=np.inf))
+    hairpin = energy(energies.hairpinEnergies(codes, rows, i, j))
+    # dangling end of a branch, with the least of any other dangling end seqfold may take instead #
+    dangle = np.minimum(energy(np.nan_to_num(energies.stackEnergies(codes, rows, i - 1, i, j + 1, j)), 0.0),
+                        min(0.0, np.nanmin(energies.danglingEnds)))
+    # least bulge or internal loop other than a single mismatch, with a dangling end for closing pairs at the ends #
+    bulges = energies.bulgeLoops(length)
+    internals = energies.internalLoops(length)
+    least_interior = min(internals[size] + 0.3 * (size % 2) for size in range(3, length + 1)) \
+        + 2 * np.nanmin(energies.terminalMismatches)
+    least_loop = min(bulges[1] + np.nanmin(energies.stacks), bulges[2:].min(), least_interior)
+    loop = np.where((I == 0) | (J == length - 1),
+                    min(least_loop, least_loop + np.nanmin(energies.danglingEnds)), least_loop)
+    (closing, _, _, _) = energies.multibranch
+
+    V = np.full((length, length, count), np.inf)
+    W = np.full((length, length, count), np.inf)
+    # branches: one, two or more, and one starting at i and ending by j #
+    one = np.full((length, length, count), np.inf)
+    two = np.full((length, length, count), np.inf)
+    starts = np.full((length, length, count), np.inf)
+    for span in range(4, length):
+        i = np.arange(length - span)
+        j = i + span
+        best = hairpin[i, j]
+        if span >= 6:
+            best = np.minimum(best, np.where(closes[i + 1, j - 1], stack[i, j] + V[i + 1, j - 1], np.inf))
+            best = np.minimum(best, loop[i, j, None] + W[i + 1, j - 1])
+            best = np.minimum(best, closing + dangle[i, j] + two[i + 1, j - 1])
+        if span >= 8:
+            single = ~paired[i + 1, j - 1] & closes[i + 2, j - 2]
+            best = np.minimum(best, np.where(single, mismatch[i, j] + V[i + 2, j - 2], np.inf))
+        V[i, j] = np.where(closes[i, j], best - LOOP_ROUNDING, np.inf)
+        if span >= 9:
+            # the first branch ends at y, the others are after it #
+            y = i[:, None] + 4 + np.arange(span - 8)
+            split = (starts[i[:, None], y] + one[y + 1, j[:, None]]).min(axis=1)
+            two[i, j] = np.minimum(two[i + 1, j], split)
+        W[i, j] = np.minimum(np.minimum(W[i + 1, j], W[i, j - 1]),
+                             np.minimum(V[i, j], closing - LOOP_ROUNDING + two[i, j]))
+        starts[i, j] = np.minimum(starts[i, j - 1], dangle[i, j] + W[i, j])
+        one[i, j] = np.minimum(one[i + 1, j], starts[i, j])
+    # seqfold gives -inf to sequences without any pair #
+    return np.where(closes.any(axis=(0, 1)), W[0, length - 1] - 1e-9, -np.inf)
+
+###################################################################################################
+
+def filter_secondary_structure(bed_filename, filter_MFE, workers=None, progress=None, cache=None, prescreen=False,
+                               engine='seqfold'):
     '''
     Filters probes based on user-specified threshold for minimum free energy of secondary structures.
     Writes filtered probe sequences and minimum free energies to new .bed file.
@@ -9,36 +260,40 @@ def filter_secondary_structure(bed_filename, filter_MFE):
             - filter_MFE [float] : minimum free energy threshold; probes with MFE below this will be filtered out
                                   (probes with low MFEs have stable secondary structures and are less likely
                                    to form duplexes with target sequence)
+            - workers [int] : number of worker processes for large probe sets (default = None, one per CPU)
+            - progress [callable] : called as progress(done, total) while MFEs are calculated (default = None)
+            - cache [MfeCache or str] : cache of MFEs from earlier runs, or the path of its database
+                                        (default = None, no cache)
+            - prescreen [bool] : fold only the probes whose MFE lower bound (mfe_lower_bounds) is at or below
+                                 filter_MFE; the others pass without folding and keep an MFE of NaN
+                                 (default = False)
+            - engine [str] : 'seqfold' to fold each probe with seqfold, or 'numpy' to fold batches of probes of
+                             the same length with foldEngine, which gives the same MFEs (default = 'seqfold')
     '''
     try:
         filter_MFE = float(filter_MFE)
     except ValueError:
         raise TypeError(f"MFE must be a float, unacceptable value: {filter_MFE}")
-    # collate original file lines #
-    with open(bed_filename, 'r') as file:
-        next(file)
-        original_lines = [line.strip() for line in file]
-
-    # collate probe sequences #
-    with open(bed_filename, 'r') as file:
-        next(file)
-        seqs = [line.split('\t')[1].strip() for line in file]
+    # collate filtered probes, from the .npy sidecar of the file if there is one #
+    table = readProbes(bed_filename)
+    seqs = [seq.decode() for seq in table['seq']]
 
-    # calculate minimum free energy #
-    MFEs = [seqfold.dg(seq) for seq in seqs]
+    # calculate minimum free energy, of only the probes that could fail if prescreened #
+    if prescreen:
+        folded = mfe_lower_bounds(seqs) <= filter_MFE
+    else:
+        folded = np.ones(len(seqs), dtype=bool)
+    MFEs = np.full(len(seqs), np.nan)
+    MFEs[folded] = calc_MFEs([seq for (seq, fold) in zip(seqs, folded) if fold], workers=workers,
+                             progress=progress, cache=cache, engine=engine)
 
-    # filter by MFE #
-    filtered_seqs_MFEs = []
-    for seq, MFE in zip(seqs, MFEs):
-        if MFE > filter_MFE:
-            filtered_seqs_MFEs.append((seq, MFE))
+    # filter by MFE, keeping each probe with its own MFE #
+    passed = ~folded | (MFEs > filter_MFE)
+    table = np.array(table[passed])
+    table['MFE'] = MFEs[passed]
 
     # for probes which passed filter, write sequences and MFEs to .bed file #
+    # as probe_number, probe_sequence, duplex_probabilities, MFE, with the table of the probes as .npy sidecar #
     output_filename = bed_filename.split('_pDup_filtered')[0] + '_pDup_MFE_filtered.bed'
-    with open(output_filename, 'w') as file:
-        # header line #
-        file.write(
-            f'{len(filtered_seqs_MFEs)} probes passed filtering with thresholds set to T=XXXC and PDup=XXX and MFE={filter_MFE} \n')
-        # write as probe_number, probe_sequence, duplex_probabilities, MFE #
-        for original_line, filtered_seq_MFE in zip(original_lines, filtered_seqs_MFEs):
-            file.write(f'{original_line} \t {filtered_seq_MFE[1]} \n')
\ No newline at end of file
+    header = f'{len(table)} probes passed filtering with thresholds set to T=XXXC and PDup=XXX and MFE={filter_MFE} \n'
+    writeProbes(output_filename, header, table)
\ No newline at end of file
@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+# --------------------------------------------------------------------------
+# tmEngine.py
+#
+# Nearest neighbor melting temperature engine shared by blockParse and
+# outputClean. An engine is built once per (NN table, [Na+], formamide,
+# dnac1, dnac2) and reproduces Bio.SeqUtils.MeltingTemp.Tm_NN for perfectly
+# matched A/C/G/T sequences, including the order in which the energy terms
+# are summed, so the results are bit-identical.
+# --------------------------------------------------------------------------
+
+# Import the math module.
+import math
+
+# Import Biopython modules.
+from Bio.SeqUtils import MeltingTemp as mt
+
+# Import numpy module.
+import numpy as np
+
+# Integer codes for the bases: A, C, G, T and 4 for anything else.
+tmCodes = np.full(256, 4, dtype=np.uint8)
+for code, base in enumerate('ACGT'):
+    tmCodes[ord(base)] = code
+    tmCodes[ord(base.lower())] = code
+
+# Complementary bases, used to name the stacks in an NN table.
+tmComps = {'A': 'T', 'C': 'G', 'G': 'C', 'T': 'A'}
+
+# Universal gas constant in cal/(K mol), as used by Tm_NN.
+gasConstant = 1.987
+
+# Engines built so far, see getTmEngine.
+tmEngines = {}
+
+
+def getTmEngine(nn_table=mt.DNA_NN3, Na=50, fmd=0, dnac1=25, dnac2=25):
+    """Returns the TmEngine for the given conditions, building it on first
+    use. The defaults are those of Tm_NN."""
+    key = (id(nn_table), Na, fmd, dnac1, dnac2)
+    if key not in tmEngines:
+        tmEngines[key] = TmEngine(nn_table, Na, fmd, dnac1, dnac2)
+    return tmEngines[key]
+
+
+class TmEngine:
+    """Melting temperatures of perfectly matched duplexes under fixed
+    conditions. tm() handles one sequence, tmBatch() a list of sequences and
+    tmWindows() every window of a given length along a block. Sequences with
+    bases other than A/C/G/T are passed on to Tm_NN by tm() and give NaN in
+    the batch and window entry points."""
+
+    def __init__(self, nn_table=mt.DNA_NN3, Na=50, fmd=0, dnac1=25,
+                 dnac2=25):
+        # Keep a reference to the table so that its id stays valid as a key.
+        self.nn_table = nn_table
+        self.Na = Na
+        self.fmd = fmd
+        self.dnac1 = dnac1
+        self.dnac2 = dnac2
+
+        # Strand concentration term of the denominator.
+        self.concTerm = gasConstant * math.log((dnac1 - (dnac2 / 2.0)) * 1e-9)
+
+        # Initiation terms.
+        (self.initH, self.initS) = nn_table['init']
+        (self.allATH, self.allATS) = nn_table['init_allA/T']
+        (self.oneGCH, self.oneGCS) = nn_table['init_oneG/C']
+        (self.term5TH, self.term5TS) = nn_table['init_5T/A']
+        (self.termATH, self.termATS) = nn_table['init_A/T']
+        (self.termGCH, self.termGCS) = nn_table['init_G/C']
+
+        # Stack values indexed by 4 * code of the first base + code of the
+        # second base, looked up the way Tm_NN does.
+        self.stackH = np.zeros(16)
+        self.stackS = np.zeros(16)
+        for a, first in enumerate('ACGT'):
+            for b, second in enumerate('ACGT'):
+                pair = first + second + '/' + tmComps[first] + tmComps[second]
+                if pair not in nn_table:
+                    pair = pair[::-1]
+                (self.stackH[4 * a + b], self.stackS[4 * a + b]) = \
+                    nn_table[pair]
+        self.stackHDict = {}
+        self.stackSDict = {}
+        for a, first in enumerate('ACGT'):
+            for b, second in enumerate('ACGT'):
+                self.stackHDict[first + second] = float(self.stackH[4 * a + b])
+                self.stackSDict[first + second] = float(self.stackS[4 * a + b])
+
+        # Salt corrections, filled in per length as they are needed.
+        self.saltTerms = np.zeros(0)
+
+
+    def saltTerm(self, length):
+        """Salt correction (method 5) of deltaS for a sequence length."""
+        if length >= len(self.saltTerms):
+            self.growSaltTerms(length)
+        return self.saltTerms[length]
+
+
+    def growSaltTerms(self, length):
+        size = max(length + 1, 2 * len(self.saltTerms), 64)
+        self.saltTerms = np.array([mt.salt_correction(Na=self.Na, method=5,
+                                                      seq='A' * n)
+                                   if n else 0.0 for n in range(size)])
+
+
+    def chemCorrect(self, tmval):
+        """Formamide correction, as mt.chem_correction(tmval, fmd=fmd). Works
+        on single values and arrays."""
+        if self.fmd:
+            tmval = tmval - 0.65 * self.fmd
+        return tmval
+
+
+    def tm(self, seq):
+        """Melting temperature of one sequence, equal to
+        mt.Tm_NN(seq, nn_table, Na=Na, dnac1=dnac1, dnac2=dnac2)."""
+        seq = str(seq).upper()
+        if len(seq) < 2 or seq.strip('ACGT'):
+            return mt.Tm_NN(seq, nn_table=self.nn_table, Na=self.Na,
+                            dnac1=self.dnac1, dnac2=self.dnac2)
+
+        # Initiation terms, in the order Tm_NN adds them.
+        dH = 0 + self.initH
+        dS = 0 + self.initS
+        if 'G' in seq or 'C' in seq:
+            dH += self.oneGCH
+            dS += self.oneGCS
+        else:
+            dH += self.allATH
+            dS += self.allATS
+        if seq[0] == 'T':
+            dH += self.term5TH
+            dS += self.term5TS
+        if seq[-1] == 'A':
+            dH += self.term5TH
+            dS += self.term5TS
+        ends = seq[0] + seq[-1]
+        AT = ends.count('A') + ends.count('T')
+        dH += self.termATH * AT
+        dS += self.termATS * AT
+        dH += self.termGCH * (2 - AT)
+        dS += self.termGCS * (2 - AT)
+
+        # Stacks, from the 5' end.
+        for k in range(len(seq) - 1):
+            dH += self.stackHDict[seq[k:k + 2]]
+            dS += self.stackSDict[seq[k:k + 2]]
+
+        dS += self.saltTerm(len(seq))
+        return (1000 * dH) / (dS + self.concTerm) - 273.15
+
+
+    def tmBatch(self, seqs):
+        """Melting temperatures of a list of sequences, as an array equal to
+        tm() for each of them. Sequences with other bases than A/C/G/T give
+        NaN."""
+        seqs = [str(seq).upper() for seq in seqs]
+        n = len(seqs)
+        lengths = np.array([len(seq) for seq in seqs], dtype=np.int64)
+        if n == 0:
+            return np.zeros(0)
+
+        # Pad the sequences into a code matrix. Padding is coded 4.
+        width = int(lengths.max())
+        codes = np.full((n, width), 4, dtype=np.uint8)
+        flat = tmCodes[np.frombuffer(''.join(seqs).encode('latin-1'),
+                                     dtype=np.uint8)]
+        rows = np.repeat(np.arange(n), lengths)
+        cols = np.arange(len(flat)) - np.repeat(np.cumsum(lengths) - lengths,
+                                                lengths)
+        codes[rows, cols] = flat
+        valid = (lengths >= 2) & ((codes == 4).sum(axis=1)
+                                  == width - lengths)
+        return self.sumTerms(codes, lengths, valid)
+
+
+    def tmWindows(self, block, length):
+        """Melting temperature of every window of the given length along a
+        block, as an array indexed by window start. Windows with bases other
+        than A/C/G/T give NaN."""
+        codes = tmCodes[np.frombuffer(str(block).upper().encode('latin-1'),
+                                      dtype=np.uint8)]
+        count = len(codes) - length + 1
+        if count <= 0 or length < 2:
+            return np.zeros(0)
+        windows = np.lib.stride_tricks.sliding_window_view(codes, length)
+        other = np.concatenate(([0], np.cumsum(codes == 4)))
+        valid = other[length:] == other[:count]
+        return self.sumTerms(windows, np.full(count, length), valid)
+
+
+    def sumTerms(self, codes, lengths, valid):
+        """Adds up the energy terms of the rows of a code matrix column by
+        column, so every row is summed in the same order as by tm()."""
+        n = len(lengths)
+        first = codes[np.arange(n), 0]
+        last = codes[np.arange(n), np.maximum(lengths - 1, 0)]
+        hasGC = ((codes == 1) | (codes == 2)).any(axis=1)
+
+        dH = np.full(n, 0 + self.initH, dtype=np.float64)
+        dS = np.full(n, 0 + self.initS, dtype=np.float64)
+        dH += np.where(hasGC, self.oneGCH, self.allATH)
+        dS += np.where(hasGC, self.oneGCS, self.allATS)
+        dH += np.where(first == 3, self.term5TH, 0.0)
+        dS += np.where(first == 3, self.term5TS, 0.0)
+        dH += np.where(last == 0, self.term5TH, 0.0)
+        dS += np.where(last == 0, self.term5TS, 0.0)
+        AT = ((first == 0) | (first == 3)).astype(np.int64) \
+             + ((last == 0) | (last == 3))
+        dH += self.termATH * AT
+        dS += self.termATS * AT
+        dH += self.termGCH * (2 - AT)
+        dS += self.termGCS * (2 - AT)
+
+        # Adding 0.0 past the end of shorter rows leaves their sums exact.
+        for k in range(codes.shape[1] - 1):
+            inside = k < lengths - 1
+            pair = 4 * np.minimum(codes[:, k], 3) + np.minimum(codes[:, k + 1],
+                                                               3)
+            dH += np.where(inside, self.stackH[pair], 0.0)
+            dS += np.where(inside, self.stackS[pair], 0.0)
+
+        if len(lengths) and lengths.max() >= len(self.saltTerms):
+            self.growSaltTerms(int(lengths.max()))
+        dS += self.saltTerms[lengths]
+        tmvals = (1000 * dH) / (dS + self.concTerm) - 273.15
+        tmvals[~valid] = np.nan
+        return tmvals
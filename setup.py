@@ -20,7 +20,6 @@ dependencies = [
                 'matplotlib',
                 'numpy',
                 'pyqt6',
-                'scikit-learn',
                 'seqfold'
 ]
 
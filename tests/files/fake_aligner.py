@@ -0,0 +1,36 @@
+# stand-in for bowtie2 in the pipeline tests: reads FASTQ from stdin (or the
+# file given with -U) and writes canned SAM without header lines to stdout.
+# Each read is unaligned, aligned once or aligned twice (-k 2), chosen from a
+# checksum of its sequence, so the SAM only depends on the reads. Exits with
+# status 3 after the first read if --fail is given.
+import sys
+import zlib
+
+def main(argv):
+    path = argv[argv.index('-U') + 1] if '-U' in argv else '-'
+    handle = sys.stdin if path == '-' else open(path)
+    lines = handle.read().split('\n')
+    out = sys.stdout
+    for k in range(0, len(lines) - 3, 4):
+        name = lines[k][1:].split(' ')[0]
+        seq = lines[k + 1]
+        qual = lines[k + 3]
+        crc = zlib.crc32(seq.encode())
+        kind = crc % 4
+        if kind == 0:
+            out.write('%s\t4\t*\t0\t0\t*\t*\t0\t0\t%s\t%s\tYT:Z:UU\n' % (name, seq, qual))
+        elif kind == 1:
+            out.write('%s\t0\tchr1\t%d\t42\t%dM\t*\t0\t0\t%s\t%s\tAS:i:%d\tXN:i:0\tYT:Z:UU\n'
+                      % (name, crc % 9000 + 1, len(seq), seq, qual, -(crc % 7)))
+        else:
+            (score, second) = (-(crc % 7), -((crc >> 8) % 80))
+            for flag, a, b in [(0, score, second), (256, second, score)]:
+                out.write('%s\t%d\tchr1\t%d\t1\t%dM\t*\t0\t0\t%s\t%s\tAS:i:%d\tXS:i:%d\t'
+                          'XN:i:0\tYT:Z:UU\n'
+                          % (name, flag, crc % 9000 + 1, len(seq), seq, qual, a, b))
+        if '--fail' in argv:
+            out.flush()
+            sys.exit(3)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
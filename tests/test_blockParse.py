@@ -0,0 +1,395 @@
+import unittest
+import contextlib
+import gzip
+import io
+import os
+import random
+import shutil
+import struct
+import tempfile
+from Bio.SeqUtils import MeltingTemp as mt
+from DNAProbeDesigner.bgzf import BgzfWriter, bgzfEOF
+import numpy as np
+from DNAProbeDesigner.blockParse import SequenceCrawler, reportClasses, reportLine
+from DNAProbeDesigner.genomeStore import fastaToTwoBit
+
+# build a random sequence with gaps, homopolymers and A/T rich stretches so
+# that every kind of window rejection is exercised
+def random_sequence(seed, length):
+    rnd = random.Random(seed)
+    parts = []
+    while sum(map(len, parts)) < length:
+        r = rnd.random()
+        if r < 0.02:
+            parts.append('N' * rnd.randint(1, 60))
+        elif r < 0.1:
+            parts.append(rnd.choice('ACGT') * rnd.randint(3, 7))
+        elif r < 0.15:
+            parts.append(''.join(rnd.choice('AT') for _ in range(rnd.randint(5, 40))))
+        else:
+            parts.append(''.join(rnd.choice('ACGT') for _ in range(rnd.randint(5, 80))))
+    return 'ACGT' + ''.join(parts)[:length] + 'ACGT'
+
+# write a FASTA file with 60 bases per line
+def write_fasta(filename, records):
+    with open(filename, 'w') as file:
+        for header, seq in records:
+            file.write(f'>{header}\n')
+            for k in range(0, len(seq), 60):
+                file.write(seq[k:k + 60] + '\n')
+
+# run blockParse quietly and return the text of the output file
+def run_crawler(fasta, out_name, engine='crawl', overlap=False, spacing=0, bed=True,
+                min_tm=42, max_tm=47, workers=1, tile_size=0, verify=False,
+                header=None, regions=None, compress=None):
+    sc = SequenceCrawler(fasta, 36, 41, 20, 80, mt.DNA_NN3, min_tm, max_tm,
+                         'AAAAA,TTTTT,CCCCC,GGGGG', 390, 50, spacing, 25, 25, header,
+                         bed, overlap, False, False, False, False, out_name, engine,
+                         workers, tile_size, verify, regions, compress)
+    with contextlib.redirect_stdout(io.StringIO()):
+        sc.run()
+    out_file = out_name + ('.bed' if bed else '.fastq')
+    if compress is not None:
+        with gzip.open(out_file + '.gz', 'rt') as file:
+            return file.read()
+    with open(out_file) as file:
+        return file.read()
+
+# build a crawler with the default settings for checking windows of a block
+def make_crawler(prohibited='AAAAA,TTTTT,CCCCC,GGGGG'):
+    return SequenceCrawler(None, 36, 41, 20, 80, mt.DNA_NN3, 42, 47, prohibited, 390, 50,
+                           0, 25, 25, None, True, False, False, False, False, False, None)
+
+# the vectorized engine has to reproduce the crawler exactly
+class TestVectorEngine(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.fasta = os.path.join(self.tmp_dir, 'test.fa')
+        self.settings = [dict(),
+                         dict(overlap=True, bed=False),
+                         dict(spacing=3, min_tm=40, max_tm=50),
+                         dict(min_tm=30, max_tm=60)]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    # compare BED and FASTQ output of both engines on random sequences
+    def test_vector_matches_crawl(self):
+        for seed in range(8):
+            write_fasta(self.fasta, [('chr1:1000-9000', random_sequence(seed, 4000))])
+            for settings in self.settings:
+                with self.subTest(seed=seed, **settings):
+                    crawled = run_crawler(self.fasta, os.path.join(self.tmp_dir, 'crawl'),
+                                          'crawl', **settings)
+                    scanned = run_crawler(self.fasta, os.path.join(self.tmp_dir, 'vector'),
+                                          'vector', **settings)
+                    self.assertTrue(crawled)
+                    self.assertEqual(crawled, scanned)
+
+    # unsupported inputs fall back to the crawler
+    def test_vector_falls_back(self):
+        write_fasta(self.fasta, [('chr1', random_sequence(1, 2000).replace('G', 'R', 5))])
+        crawled = run_crawler(self.fasta, os.path.join(self.tmp_dir, 'crawl'), 'crawl')
+        scanned = run_crawler(self.fasta, os.path.join(self.tmp_dir, 'vector'), 'vector')
+        self.assertEqual(crawled, scanned)
+
+# every record of a multi-entry FASTA file is mined and merged in input order
+class TestMultiRecord(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.records = [(f'chr{k}', random_sequence(k, 1500 + 500 * k)) for k in range(4)]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    # the merged output matches single-record runs, serially and in parallel
+    def test_records_merged_in_order(self):
+        expected = []
+        for k, record in enumerate(self.records):
+            fasta = os.path.join(self.tmp_dir, f'single{k}.fa')
+            write_fasta(fasta, [record])
+            expected.append(run_crawler(fasta, os.path.join(self.tmp_dir, f'single{k}')))
+        fasta = os.path.join(self.tmp_dir, 'multi.fa')
+        write_fasta(fasta, self.records)
+        for workers in (1, 2):
+            with self.subTest(workers=workers):
+                merged = run_crawler(fasta, os.path.join(self.tmp_dir, 'multi'),
+                                     workers=workers)
+                self.assertEqual(merged, '\n'.join(expected))
+                chroms = [line.split('\t')[0] for line in merged.split('\n')]
+                self.assertEqual(sorted(set(chroms)), [name for name, seq in self.records])
+
+# a .2bit genome store is mined exactly like the FASTA it was made from
+class TestTwoBitInput(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    # whole records and tiles read from the store give the FASTA output
+    def test_two_bit_matches_fasta(self):
+        fasta = os.path.join(self.tmp_dir, 'genome.fa')
+        two_bit = os.path.join(self.tmp_dir, 'genome.2bit')
+        write_fasta(fasta, [(f'chr{k}', random_sequence(k, 3000)) for k in range(3)])
+        fastaToTwoBit(fasta, two_bit)
+        expected = run_crawler(fasta, os.path.join(self.tmp_dir, 'fasta'))
+        for tile_size in (0, 700):
+            with self.subTest(tile_size=tile_size):
+                mined = run_crawler(two_bit, os.path.join(self.tmp_dir, 'store'),
+                                    tile_size=tile_size)
+                self.assertEqual(mined, expected)
+
+# target regions listed in a BED file are mined from the genome in one run
+class TestTargetRegions(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.records = [(f'chr{k}', random_sequence(k, 5000)) for k in range(2)]
+        self.genome = os.path.join(self.tmp_dir, 'genome.fa')
+        write_fasta(self.genome, self.records)
+        self.regions = os.path.join(self.tmp_dir, 'regions.bed')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    # each region gives the probes of the extracted sequence, tagged with its name
+    def test_regions_match_extracted(self):
+        regions = [('chr1', 120, 3100, 'geneA'), ('chr0', 0, 5008, 'geneB'),
+                   ('chr1', 2000, 4500, 'geneC')]
+        with open(self.regions, 'w') as file:
+            file.write('track name=panel\n')
+            for region in regions:
+                file.write('%s\t%d\t%d\t%s\n' % region)
+        expected = []
+        for k, (chrom, start, end, name) in enumerate(regions):
+            fasta = os.path.join(self.tmp_dir, f'region{k}.fa')
+            write_fasta(fasta, [(name, dict(self.records)[chrom][start:end])])
+            mined = run_crawler(fasta, os.path.join(self.tmp_dir, f'region{k}'),
+                                header=f'{chrom}:{start + 1}-{end}')
+            expected.extend(line + '\t' + name for line in mined.split('\n'))
+        for workers in (1, 2):
+            with self.subTest(workers=workers):
+                combined = run_crawler(self.genome, os.path.join(self.tmp_dir, 'panel'),
+                                       workers=workers, regions=self.regions)
+                self.assertEqual(combined, '\n'.join(expected))
+
+    # regions outside of the genome are rejected
+    def test_invalid_region(self):
+        with open(self.regions, 'w') as file:
+            file.write('chr1\t4000\t6000\tgeneA\n')
+        with self.assertRaises(ValueError):
+            run_crawler(self.genome, os.path.join(self.tmp_dir, 'panel'),
+                        regions=self.regions)
+
+# the prohibited sequence hit index answers window checks like a regex search
+class TestProhibitedSequences(unittest.TestCase):
+    # every window and extension length agrees with the per-pattern search
+    def test_index_matches_search(self):
+        block = random_sequence(5, 3000)
+        for prohibited in ['AAAAA,TTTTT,CCCCC,GGGGG', 'aaaa,TTTTTT,GCGC,gc']:
+            sc = make_crawler(prohibited)
+            sc.setBlock(block)
+            self.assertIsNotNone(sc.hitStarts)
+            for i in range(0, len(block), 23):
+                for length in (36, 38, 41):
+                    with self.subTest(prohibited=prohibited, i=i, length=length):
+                        self.assertEqual(sc.prohibitCheckInd(i, length),
+                                         sc.prohibitCheck(block[i:i + length]))
+
+    # regular expressions fall back to searching the window
+    def test_regex_patterns(self):
+        sc = make_crawler('A{5},G.CC')
+        sc.setBlock('ACGTAAAAACGTGTCCACGT')
+        self.assertIsNone(sc.hitStarts)
+        self.assertFalse(sc.prohibitCheckInd(2, 8))
+        self.assertFalse(sc.prohibitCheckInd(11, 5))
+        self.assertTrue(sc.prohibitCheckInd(8, 6))
+
+# the N run index answers window checks like rfind on the sliced window
+class TestNRunIndex(unittest.TestCase):
+    # every window, including ones running off the block, agrees with Ncheckopt
+    def test_index_matches_rfind(self):
+        block = 'NNACGT' + random_sequence(6, 2000) + 'ACGTNNN'
+        sc = make_crawler()
+        sc.setBlock(block)
+        for i in range(len(block)):
+            for length in (1, 36, 41):
+                self.assertEqual(sc.NcheckInd(i, length), sc.Ncheckopt(block[i:i + length]))
+
+    # jumping whole N runs lands where skipping window by window does
+    def test_skip_runs(self):
+        block = 'ACGT' + 'N' * 50 + 'ACGT' * 5 + 'N' * 3 + 'ACGT' * 20 + 'N'
+        sc = make_crawler()
+        sc.setBlock(block)
+        for i in range(len(block)):
+            j = i
+            while sc.Ncheckopt(block[j:j + sc.l]) != -1:
+                j += sc.Ncheckopt(block[j:j + sc.l]) + 1
+            self.assertEqual(sc.skipN(i), j)
+
+# tiles of one record are mined separately and stitched back together exactly
+class TestTiledCrawl(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.fasta = os.path.join(self.tmp_dir, 'test.fa')
+        write_fasta(self.fasta, [('chr1', random_sequence(3, 6000)),
+                                 ('chr2', random_sequence(4, 2500))])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    # tiled output matches the untiled walk for both engines and all modes
+    def test_tiles_match_untiled(self):
+        for settings in [dict(), dict(overlap=True), dict(spacing=5)]:
+            expected = run_crawler(self.fasta, os.path.join(self.tmp_dir, 'whole'),
+                                   **settings)
+            for engine in ('crawl', 'vector'):
+                for tile_size, workers in [(97, 1), (1000, 2)]:
+                    with self.subTest(engine=engine, tile_size=tile_size, **settings):
+                        tiled = run_crawler(self.fasta, os.path.join(self.tmp_dir, 'tiled'),
+                                            engine, workers=workers, tile_size=tile_size,
+                                            **settings)
+                        self.assertEqual(tiled, expected)
+
+    # verify mode reruns the records sequentially and accepts the matching tiled run
+    def test_verify(self):
+        expected = run_crawler(self.fasta, os.path.join(self.tmp_dir, 'whole'))
+        verified = run_crawler(self.fasta, os.path.join(self.tmp_dir, 'tiled'),
+                               tile_size=500, verify=True)
+        self.assertEqual(verified, expected)
+
+class TestCompressedOutput(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.fasta = os.path.join(self.tmp_dir, 'test.fa')
+        write_fasta(self.fasta, [('chr1', random_sequence(5, 5000)),
+                                 ('chr2', random_sequence(6, 3000))])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    # gzip and bgzip output decompress to the plain output, also when tiles are streamed
+    def test_compressed_matches_plain(self):
+        for bed in (True, False):
+            expected = run_crawler(self.fasta, os.path.join(self.tmp_dir, 'plain'), bed=bed)
+            self.assertTrue(expected)
+            for compress in ('gzip', 'bgzip'):
+                for tile_size in (0, 400):
+                    with self.subTest(bed=bed, compress=compress, tile_size=tile_size):
+                        got = run_crawler(self.fasta, os.path.join(self.tmp_dir, compress),
+                                          bed=bed, tile_size=tile_size, compress=compress)
+                        self.assertEqual(got, expected)
+
+    # BGZF output is a series of gzip members of at most 64 kb closed by the EOF block
+    def test_bgzf_blocks(self):
+        data = b''.join(b'line %d\n' % k for k in range(40000))
+        out_file = os.path.join(self.tmp_dir, 'blocks.gz')
+        with BgzfWriter(out_file) as writer:
+            for k in range(0, len(data), 1000):
+                writer.write(data[k:k + 1000])
+        with open(out_file, 'rb') as file:
+            raw = file.read()
+        offset = 0
+        blocks = 0
+        while offset < len(raw):
+            header = struct.unpack('<BBBBIBBHBBHH', raw[offset:offset + 18])
+            self.assertEqual(header[:4] + header[7:11], (31, 139, 8, 4, 6, 66, 67, 2))
+            offset += header[11] + 1
+            blocks += 1
+        self.assertEqual(offset, len(raw))
+        self.assertTrue(raw.endswith(bgzfEOF))
+        self.assertGreater(blocks, 4)
+        self.assertEqual(gzip.decompress(raw), data)
+
+class TestReportMode(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.fasta = os.path.join(self.tmp_dir, 'test.fa')
+        write_fasta(self.fasta, [('chr1', random_sequence(7, 6000)),
+                                 ('chr2', random_sequence(8, 2000))])
+        self.out_name = os.path.join(self.tmp_dir, 'report')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def run_report(self, summary_only=False, engine='crawl', workers=1, tile_size=0,
+                   overlap=False, spacing=0, out_name=None):
+        out_name = out_name or self.out_name
+        sc = SequenceCrawler(self.fasta, 36, 41, 20, 80, mt.DNA_NN3, 42, 47,
+                             'AAAAA,TTTTT,CCCCC,GGGGG', 390, 50, spacing, 25, 25, None, True,
+                             overlap, False, True, False, False, out_name, engine, workers,
+                             tile_size, summaryOnlyVal=summary_only)
+        with contextlib.redirect_stdout(io.StringIO()):
+            sc.run()
+
+    # read back what a report run wrote
+    def read_report(self, out_name, *suffixes):
+        texts = []
+        for suffix in suffixes:
+            with open(out_name + suffix) as file:
+                texts.append(file.read())
+        return texts
+
+    # the TSV counters, the NPZ entries and the rendered log all agree
+    def test_summary_matches_log(self):
+        self.run_report()
+        with open(self.out_name + '_blockParse_log.txt') as file:
+            log = file.read().split('\n')
+        with open(self.out_name + '_blockParse_summary.tsv') as file:
+            rows = [line.split('\t') for line in file.read().splitlines()[1:]]
+        summary = np.load(self.out_name + '_blockParse_summary.npz')
+        counts = dict((name, int(count)) for name, count, percent in rows)
+        self.assertEqual([name for name, count, percent in rows], reportClasses)
+        self.assertEqual(summary['counts'].tolist(), [counts[name] for name in reportClasses])
+        self.assertEqual(np.bincount(summary['codes'], minlength=8).tolist(),
+                         summary['counts'].tolist())
+        self.assertGreater(counts['N_block_fail'], 0)
+        self.assertGreater(counts['prohib_fail'], 0)
+        with open(self.out_name + '.bed') as file:
+            self.assertEqual(counts['probe'], len(file.read().split('\n')))
+        matches = iter(summary['matches'].tolist())
+        rendered = [reportLine(code, position, length, value,
+                               next(matches) if code == 2 else None, (42, 47, 20, 80))
+                    for code, position, length, value in
+                    zip(summary['codes'].tolist(), summary['positions'].tolist(),
+                        summary['lengths'].tolist(), summary['values'].tolist())]
+        self.assertEqual(log[13:], rendered)
+        self.assertEqual(sum(line.startswith('Picking') for line in log), counts['probe'])
+        self.assertEqual(sum('prohibited sequence(s)' in line for line in log),
+                         counts['prohib_fail'])
+        self.assertEqual(sum('being below' in line and 'Tm of' in line for line in log),
+                         counts['Tm_fail_low'])
+
+    # the log is only rendered when asked for
+    def test_summary_only(self):
+        self.run_report(summary_only=True)
+        self.assertTrue(os.path.exists(self.out_name + '_blockParse_summary.tsv'))
+        self.assertTrue(os.path.exists(self.out_name + '_blockParse_summary.npz'))
+        self.assertFalse(os.path.exists(self.out_name + '_blockParse_log.txt'))
+
+    # the vector engine gives the same counters as the crawler without rendering the log
+    def test_vector_summary(self):
+        self.run_report()
+        vector_name = os.path.join(self.tmp_dir, 'vector')
+        self.run_report(summary_only=True, engine='vector', out_name=vector_name)
+        self.assertEqual(self.read_report(vector_name, '_blockParse_summary.tsv', '.bed'),
+                         self.read_report(self.out_name, '_blockParse_summary.tsv', '.bed'))
+        self.assertFalse(os.path.exists(vector_name + '_blockParse_log.txt'))
+
+    # the vector engine and tiled runs write the same log as a single crawl, tile seams included
+    def test_vector_tiled_log(self):
+        suffixes = ('_blockParse_log.txt', '_blockParse_summary.tsv', '.bed')
+        for overlap, spacing in ((False, 0), (False, 3), (True, 0)):
+            self.run_report(overlap=overlap, spacing=spacing)
+            expected = self.read_report(self.out_name, *suffixes)
+            for engine, tile_size in (('vector', 0), ('vector', 500), ('crawl', 700)):
+                with self.subTest(overlap=overlap, spacing=spacing, engine=engine,
+                                  tile_size=tile_size):
+                    out_name = os.path.join(self.tmp_dir, f'{engine}_{tile_size}')
+                    self.run_report(engine=engine, workers=2 if tile_size else 1,
+                                    tile_size=tile_size, overlap=overlap, spacing=spacing,
+                                    out_name=out_name)
+                    self.assertEqual(self.read_report(out_name, *suffixes), expected)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+import unittest
+import os
+import random
+import shutil
+import tempfile
+import numpy as np
+from Bio.SeqUtils import MeltingTemp as mt
+from DNAProbeDesigner.cross_hybridization import (probe_codes, candidate_pairs, duplex_energies, greedy_removal,
+                                                  filter_cross_hybridization)
+from DNAProbeDesigner.foldEnergies import getFoldEnergies, bothStrands, foldStacks
+from DNAProbeDesigner.probeTable import newTable, writeProbes, readProbes
+
+complement = lambda seq: seq[::-1].translate(str.maketrans('GATC', 'CTAG'))
+
+class TestCandidatePairs(unittest.TestCase):
+    # the k-mer index finds exactly the pairs and diagonals with k complementary bases in a row
+    def test_all_pairs(self):
+        rand = random.Random(0)
+        seqs = [''.join(rand.choice('GATC') for _ in range(rand.randint(15, 25))) for _ in range(60)]
+        k = 4
+        expected = set()
+        for a in range(len(seqs)):
+            for b in range(a + 1, len(seqs)):
+                for p in range(len(seqs[a]) - k + 1):
+                    for q in range(len(seqs[b]) - k + 1):
+                        if seqs[a][p:p + k] == complement(seqs[b][q:q + k]):
+                            expected.add((a, b, p + q + k - 1))
+        (a, b, d) = candidate_pairs(probe_codes(seqs)[0], k)
+        self.assertEqual(set(zip(a.tolist(), b.tolist(), d.tolist())), expected)
+        self.assertEqual(len(a), len(expected))
+
+    # k-mers over other bases are not indexed, and pools without pairs give none
+    def test_no_pairs(self):
+        (a, b, d) = candidate_pairs(probe_codes(['ACGTNNACGT', 'ACGTNNACGT'])[0], 5)
+        self.assertEqual(len(a), 0)
+        self.assertEqual(len(candidate_pairs(probe_codes(['GATTACA'])[0], 4)[0]), 0)
+        self.assertEqual(len(candidate_pairs(probe_codes([])[0], 4)[0]), 0)
+
+class TestDuplexEnergies(unittest.TestCase):
+    # a perfect duplex has the nearest-neighbor energy of its stacks, and a mismatch or a shift weakens it
+    def test_nearest_neighbor(self):
+        energies = getFoldEnergies(37)
+        stacks = bothStrands(dict(mt.DNA_NN4, **foldStacks))
+        core = 'TACCTAGGCATTGCAGTCAG'
+        expected = energies.dG(*mt.DNA_NN4['init']) + energies.dG(*mt.DNA_NN4['init_A/T']) + \
+            sum(energies.dG(*stacks[core[i:i + 2] + '/' + complement(core)[::-1][i:i + 2]]) for i in range(19))
+        mismatched = complement(core[:10] + 'T' + core[11:])
+        seqs = ['TTTT' + core + 'TTTT', 'CCC' + complement(core) + 'CC', 'CCC' + mismatched + 'CC']
+        (codes, lengths) = probe_codes(seqs)
+        (a, b, d) = candidate_pairs(codes, 8)
+        dGs = duplex_energies(codes, lengths, a, b, d)
+        pairs = {(i, j): [] for (i, j) in zip(a.tolist(), b.tolist())}
+        for (i, j, dG) in zip(a.tolist(), b.tolist(), dGs.tolist()):
+            pairs[(i, j)].append(dG)
+        self.assertAlmostEqual(min(pairs[(0, 1)]), expected, places=6)
+        self.assertTrue(expected < min(pairs[(0, 2)]) < expected / 2)
+        # at a higher temperature the same duplex is less stable #
+        self.assertGreater(duplex_energies(codes, lengths, a, b, d, 60).min(), dGs.min())
+
+class TestGreedyRemoval(unittest.TestCase):
+    # the probe in most pairs goes first, and no pair is left
+    def test_removal(self):
+        (a, b) = (np.array([0, 0, 0, 4, 5]), np.array([1, 2, 3, 5, 6]))
+        removed = greedy_removal(8, a, b)
+        np.testing.assert_array_equal(np.flatnonzero(removed), [0, 5])
+        self.assertFalse((~removed[a] & ~removed[b]).any())
+        self.assertFalse(greedy_removal(3, np.zeros(0, dtype=int), np.zeros(0, dtype=int)).any())
+
+class TestFilterCrossHybridization(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.stem = os.path.join(self.tmp_dir, 'probes')
+        rand = random.Random(1)
+        seqs = [''.join(rand.choice('GATC') for _ in range(40)) for _ in range(200)]
+        # probe 51 takes the reverse complement of 20 bases of probe 11, and probe 71 of 10 bases #
+        seqs[50] = seqs[50][:10] + complement(seqs[10][5:25]) + seqs[50][30:]
+        seqs[70] = seqs[70][:10] + complement(seqs[10][5:15]) + seqs[70][20:]
+        self.table = newTable(seqs, np.zeros((len(seqs), 6)))
+        self.table['MFE'] = -1.0
+        writeProbes(self.stem + '_pDup_MFE_filtered.bed', 'header \n', self.table)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    # the strong pair is reported and one of its probes dropped, or every probe kept when flagging
+    def test_drop_and_flag(self):
+        filter_cross_hybridization(self.stem + '_pDup_MFE_filtered.bed', -20)
+        with open(self.stem + '_xhyb_pairs.tsv') as file:
+            lines = [line.rstrip('\n').split('\t') for line in file]
+        self.assertEqual(lines[0], ['probe_a', 'probe_b', 'dG', 'removed'])
+        self.assertIn(['11', '51'], [line[:2] for line in lines[1:]])
+        self.assertNotIn(['11', '71'], [line[:2] for line in lines[1:]])
+        self.assertTrue(all(float(line[2]) <= -20 and line[3] for line in lines[1:]))
+        removed = {int(number) for line in lines[1:] for number in line[3].split(',')}
+        table = readProbes(self.stem + '_pDup_MFE_xhyb_filtered.bed')
+        self.assertEqual(set(table['number'].tolist()), set(range(1, 201)) - removed)
+        self.assertEqual(len({11, 51} & removed), 1)
+        np.testing.assert_array_equal(table['MFE'], -1.0)
+
+        filter_cross_hybridization(self.stem + '_pDup_MFE_filtered.bed', -20, drop=False)
+        np.testing.assert_array_equal(readProbes(self.stem + '_pDup_MFE_xhyb_filtered.bed')[['number', 'seq', 'MFE']],
+                                      self.table[['number', 'seq', 'MFE']])
+
+    # pass in a non-float for the duplex energy, should raise a type error
+    def test_invalid_dG(self):
+        with self.assertRaises(TypeError):
+            filter_cross_hybridization(self.stem + '_pDup_MFE_filtered.bed', 'not a float')
+        with self.assertRaises(ValueError):
+            filter_cross_hybridization(self.stem + '_pDup_MFE_filtered.bed', -20, k=40)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+import unittest
+import contextlib
+import io
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from DNAProbeDesigner.dedupFastq import DuplicateMap, dedupFastq, fastqReads
+from DNAProbeDesigner.outputClean import cleanOutput
+from DNAProbeDesigner.probePipeline import runPipeline
+from tests.test_blockParse import random_sequence, write_fasta, run_crawler
+from tests.test_probePipeline import FAKE_ALIGNER
+
+class TestDedupFastq(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.fasta = os.path.join(self.tmp_dir, 'test.fa')
+        # repeated stretches within and across records, and a record that
+        # repeats another one at the same coordinates
+        seq = random_sequence(2, 3000)
+        write_fasta(self.fasta, [('chr1', seq + seq[500:1500] + random_sequence(3, 500)),
+                                 ('chr2', random_sequence(4, 800) + seq[:2000]),
+                                 ('chr3', seq)])
+        self.stem = os.path.join(self.tmp_dir, 'test')
+        run_crawler(self.fasta, self.stem, bed=False, overlap=True)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def read(self, filename):
+        with open(filename) as file:
+            return file.read()
+
+    def align(self, fastq, sam):
+        with open(sam, 'w') as file:
+            subprocess.run([sys.executable, FAKE_ALIGNER, '-U', fastq], check=True,
+                           stdout=file)
+
+    # each sequence is kept once and the map restores every removed read
+    def test_dedup(self):
+        with open(self.stem + '.fastq', 'rb') as file:
+            reads = list(fastqReads(file))
+            file.seek(0)
+            out = io.BytesIO()
+            dup_map = DuplicateMap()
+            (read_num, distinct_num) = dedupFastq(file, out, dup_map)
+        kept = list(fastqReads(out.getvalue().splitlines()))
+        self.assertEqual(read_num, len(reads))
+        self.assertEqual(distinct_num, len(kept))
+        self.assertEqual(len(set(seq for (header, seq, qual) in kept)), len(kept))
+        self.assertGreater(dup_map.count, len(reads) // 4)
+        self.assertEqual(dup_map.count + distinct_num, read_num)
+        # reading the written map back gives the same duplicates
+        dup_map.write(self.stem + '_dups.tsv')
+        self.assertEqual(DuplicateMap.read(self.stem + '_dups.tsv').anchors, dup_map.anchors)
+
+    # cleaning the SAM of the distinct reads with the map gives the output of aligning every read
+    def test_fan_out_matches_full_alignment(self):
+        self.align(self.stem + '.fastq', self.stem + '.sam')
+        with open(self.stem + '.fastq', 'rb') as file, \
+             open(self.stem + '_dedup.fastq', 'wb') as out:
+            dup_map = DuplicateMap()
+            dedupFastq(file, out, dup_map)
+        dup_map.write(self.stem + '_dups.tsv')
+        self.align(self.stem + '_dedup.fastq', self.stem + '_dedup.sam')
+        for unique, zero, report in [(False, False, False), (True, False, False),
+                                     (False, True, False), (False, False, True)]:
+            with self.subTest(unique=unique, zero=zero, report=report):
+                full = os.path.join(self.tmp_dir, 'full')
+                fanned = os.path.join(self.tmp_dir, 'fanned')
+                with contextlib.redirect_stdout(io.StringIO()) as stdout:
+                    cleanOutput(self.stem + '.sam', unique, zero, 0.5, 42, 390, 50, report,
+                                False, False, full, 0)
+                    cleanOutput(self.stem + '_dedup.sam', unique, zero, 0.5, 42, 390, 50,
+                                report, False, False, fanned, 0, 1,
+                                self.stem + '_dups.tsv')
+                (first, second) = stdout.getvalue().splitlines()
+                self.assertEqual(first, second)
+                self.assertTrue(self.read(full + '.bed'))
+                self.assertEqual(self.read(fanned + '.bed'), self.read(full + '.bed'))
+                if report:
+                    self.assertEqual(self.read(fanned + '_outputClean_log.txt'),
+                                     self.read(full + '_outputClean_log.txt'))
+
+    # the pipeline gives the same output with and without deduplication
+    def test_pipeline_dedup(self):
+        outputs = []
+        for dedup in (False, True):
+            out_name = os.path.join(self.tmp_dir, 'piped%d' % dedup)
+            with contextlib.redirect_stdout(io.StringIO()):
+                runPipeline(self.fasta, [sys.executable, FAKE_ALIGNER, '-U', '-'], out_name,
+                            out_name + '.sam', ['-O'], dedupVal=dedup)
+            outputs.append((self.read(out_name + '.bed'), len(self.read(out_name + '.sam'))))
+        self.assertEqual(outputs[1][0], outputs[0][0])
+        self.assertLess(outputs[1][1], outputs[0][1] * 3 // 4)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -4,11 +4,34 @@ import matplotlib.pyplot as plt
 import numpy as np
 import sys
 import os
+import random
+import shutil
+import tempfile
+from Bio.SeqUtils import GC
 
 current_path = os.path.dirname(os.path.abspath(__file__))
 relative_path = os.path.normpath(os.path.join(current_path, '../DNA-Probe-Designer'))
 sys.path.append(relative_path)
-from duplex_prob import calc_duplex_prob, filter_duplex_prob, plot_duplex_prob
+from duplex_prob import calc_duplex_prob, calc_duplex_probs, filter_duplex_prob, plot_duplex_prob, read_probeset
+from duplex_prob import PLOT_AGGREGATE_THRESHOLD, PLOT_DENSITY_BINS
+from matplotlib.collections import LineCollection
+from ldaModel import ldaScorer
+from probeTable import newTable, readProbes, writeProbes
+
+# write a probeset BED file and a SAM file with one or two records per probe and records of other sequences
+def write_probeset(stem, n, seed=0):
+    rand = random.Random(seed)
+    with open(stem + '.sam', 'w') as sam, open(stem + '.bed', 'w') as bed:
+        for k in range(n):
+            seq = ''.join(rand.choice('GATC') for _ in range(rand.randint(30, 42)))
+            bed.write(f'chr1\t{k * 50}\t{k * 50 + len(seq)}\t{seq}\t{rand.uniform(40, 50):.2f}\n')
+            seqs = [seq] * rand.randint(1, 2)
+            if rand.random() < 0.2:
+                seqs.append(''.join(rand.choice('GATC') for _ in range(35)))
+            for seq in seqs:
+                sam.write(f'chr1:{k * 50}-{k * 50 + len(seq)}\t0\tchr1\t{k}\t42\t{len(seq)}M\t*\t0\t0\t'
+                          f'{seq}\t{"~" * len(seq)}\tAS:i:{rand.randint(0, 80)}\tXS:i:0\tXN:i:0\tXM:i:0\t'
+                          'XO:i:0\tXG:i:0\tNM:i:0\tYT:Z:UU\n')
 
 # test the calc_duplex_prob function using test input files
 # mostly checking the sam file here since its used only in this function
@@ -43,6 +66,61 @@ class TestCalcDuplexProb(unittest.TestCase):
             calc_duplex_prob(self.invalid_sam_filename, self.valid_bed_filename, self.valid_temp)
         self.assertEqual(str(error.exception), "Probe sequence must contain only G, A, T, C in SAM file.")
 
+# test the single pass engine against scoring each temperature on its own
+class TestCalcDuplexProbs(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.stem = os.path.join(self.tmp_dir, 'probes')
+        write_probeset(self.stem, 500)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    # every temperature matches the per record features of the SAM records of probes in the probeset
+    def test_all_temps(self):
+        probeset = read_probeset(self.stem + '.bed')
+        rows, probs = calc_duplex_probs(self.stem + '.sam', probeset)
+        seqs = [probeset[row] for row in rows]
+        expected_seqs = []
+        clf_inputs = []
+        with open(self.stem + '.sam') as file:
+            for line in file:
+                parts = line.split('\t')
+                if parts[9] in probeset:
+                    expected_seqs.append(parts[9])
+                    clf_inputs.append([len(parts[9]), int(parts[12].split(':')[2]), GC(parts[9])])
+        self.assertEqual(seqs, expected_seqs)
+        self.assertEqual(probs.shape, (len(seqs), 6))
+        for k, temp in enumerate(ldaScorer.temps):
+            np.testing.assert_allclose(probs[:, k], ldaScorer.probsAt(clf_inputs, temp), rtol=1e-12)
+            np.testing.assert_allclose(calc_duplex_prob(self.stem + '.sam', self.stem + '.bed', temp), probs[:, k])
+
+    # each probe that passes the filter is written with its own probabilities
+    def test_filter_keeps_sequences_with_probs(self):
+        probeset = read_probeset(self.stem + '.bed')
+        rows, probs = calc_duplex_probs(self.stem + '.sam', probeset)
+        seqs = [probeset[row] for row in rows]
+        passed = probs[:, 0] > 0.005
+        self.assertTrue(0 < passed.sum() < len(seqs))
+        filter_duplex_prob(self.stem + '.sam', self.stem + '.bed', 32, 0.005)
+        with open(self.stem + '_pDup_filtered.bed') as file:
+            lines = file.readlines()
+        self.assertEqual(int(lines[0].split(' ')[0]), passed.sum())
+        written = [line.split('\t') for line in lines[1:]]
+        self.assertEqual([seq.strip() for _, seq, _ in written], [seq for seq, keep in zip(seqs, passed) if keep])
+        for (_, _, written_probs), expected in zip(written, probs[passed]):
+            np.testing.assert_allclose(eval(written_probs), expected, atol=1e-8)
+        # the sidecar holds the same probes with their BED coordinates and Tm
+        table = readProbes(self.stem + '_pDup_filtered.bed')
+        self.assertIsInstance(table, np.memmap)
+        np.testing.assert_array_equal(table['probs'], probs[passed])
+        with open(self.stem + '.bed') as file:
+            bed = [line.split('\t') for line in file]
+        for row, probe in zip(rows[passed], table):
+            self.assertEqual(probe['seq'].decode(), probeset[row])
+            self.assertEqual((probe['chrom'].decode(), probe['start'], probe['stop'], probe['Tm']),
+                             (bed[row][0], int(bed[row][1]), int(bed[row][2]), float(bed[row][4])))
+
 class TestFilterDuplexProb(unittest.TestCase):
     # setup the file paths, some of which are valid and others invalid
     def setUp(self):
@@ -154,5 +232,53 @@ class testPlotDuplexProb(unittest.TestCase):
         with self.assertRaises(ValueError):
             plot_duplex_prob(self.filtered_file, 'invalid')
 
+# test plotting of large probe sets from the sidecar
+class TestPlotDuplexProbScaling(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.rng = np.random.default_rng(0)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+        plt.close('all')
+
+    # write a filtered probe file of n probes with random probabilities
+    def write_probes(self, n):
+        filename = os.path.join(self.tmp_dir, f'probes{n}_pDup_filtered.bed')
+        writeProbes(filename, f'{n} probes\n', newTable(['GATTACA'] * n, self.rng.uniform(0, 1, (n, 6))))
+        return filename
+
+    # up to the threshold all curves are one line collection, drawn with the median
+    @patch('matplotlib.pyplot.show')
+    @patch('matplotlib.pyplot.plot')
+    def test_curves(self, mock_plot, mock_show):
+        plot_duplex_prob(self.write_probes(300), 'all')
+        collections = [c for c in plt.gca().collections if isinstance(c, LineCollection)
+                       and len(c.get_segments()) == 300]
+        self.assertEqual(len(collections), 1)
+        self.assertLess(collections[0].get_alpha(), 1)
+        mock_plot.assert_called_once()
+        mock_show.assert_called()
+
+    # above the threshold the probes are drawn as per temperature densities with quantile bands
+    @patch('matplotlib.pyplot.show')
+    @patch('matplotlib.pyplot.fill_between')
+    @patch('matplotlib.pyplot.pcolormesh', wraps=plt.pcolormesh)
+    @patch('matplotlib.pyplot.plot')
+    def test_aggregated(self, mock_plot, mock_pcolormesh, mock_fill_between, mock_show):
+        n = PLOT_AGGREGATE_THRESHOLD + 1
+        filename = self.write_probes(n)
+        plot_duplex_prob(filename, 'all')
+        self.assertFalse(any(isinstance(c, LineCollection) and len(c.get_segments()) == n
+                             for c in plt.gca().collections))
+        counts = mock_pcolormesh.call_args[0][2]
+        self.assertEqual(counts.shape, (PLOT_DENSITY_BINS, 6))
+        np.testing.assert_array_equal(counts.filled(0).sum(axis=0), [n] * 6)
+        self.assertEqual(mock_fill_between.call_count, 2)
+        np.testing.assert_allclose(mock_plot.call_args[0][1], np.median(readProbes(filename)['probs'], axis=0))
+        # the view can also be chosen explicitly
+        plot_duplex_prob(filename, 'all', aggregate=False)
+        self.assertEqual(mock_pcolormesh.call_count, 1)
+
 if __name__ == '__main__':
     unittest.main()
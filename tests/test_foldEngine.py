@@ -0,0 +1,54 @@
+import unittest
+import random
+import numpy as np
+import seqfold
+from DNAProbeDesigner.foldEngine import FoldEngine, getFoldEngine
+
+# random probes, with hairpins, low-complexity repeats and stacked stems
+def fold_corpus(seed, count):
+    rand = random.Random(seed)
+    randomSeq = lambda length, bases='GATC': ''.join(rand.choice(bases) for _ in range(length))
+    complement = lambda seq: seq[::-1].translate(str.maketrans('GATC', 'CTAG'))
+    seqs = [randomSeq(rand.randint(36, 41)) for _ in range(count)]
+    for _ in range(count):
+        length = rand.randint(36, 41)
+        kind = rand.randrange(3)
+        if kind == 0:
+            seq = randomSeq(rand.randint(1, 6)) * 41
+        elif kind == 1:
+            stem = randomSeq(rand.randint(4, 18))
+            seq = randomSeq(rand.randint(0, 8)) + stem + randomSeq(rand.randint(3, 8)) + complement(stem) + randomSeq(41)
+        else:
+            seq = ''
+            while len(seq) < length:
+                stem = randomSeq(rand.randint(3, 6), 'GC')
+                seq += stem + rand.choice(['TTT', 'GAAA', 'TTTT']) + complement(stem) + rand.choice(['', 'A', 'TT'])
+        seqs.append(seq[:length])
+    return seqs
+
+class TestFoldEngine(unittest.TestCase):
+    # the MFEs are exactly those of seqfold, at the default and another temperature
+    def test_matches_seqfold(self):
+        seqs = fold_corpus(0, 150)
+        for temp in (37, 60):
+            with self.subTest(temp=temp):
+                np.testing.assert_array_equal(FoldEngine(temp).mfes(seqs), [seqfold.dg(seq, temp) for seq in seqs])
+
+    # short, pairless, T-free and lower case sequences give what seqfold gives, and other bases fail as in seqfold
+    def test_special_sequences(self):
+        seqs = ['ACGT', 'GGGGG', 'AAAAAAAAAAAAAAAATTTT', 'CCCCCCCCCCCCCCCCCCCCCT', 'GGGCCCAAAGGGCCCGGGCCCAAAGGGCCC',
+                'gcgcgcttttgcgcgcaaaaatt']
+        MFEs = getFoldEngine().mfes(seqs)
+        np.testing.assert_array_equal(MFEs, [seqfold.dg(seq) for seq in seqs])
+        self.assertEqual(MFEs[0], -np.inf)
+        self.assertEqual(len(getFoldEngine().mfes([])), 0)
+        with self.assertRaises(RuntimeError):
+            getFoldEngine().mfes(['ACGTNACGTACGTACGTACGT'])
+
+    # engines are built once per temperature
+    def test_engine_cache(self):
+        self.assertIs(getFoldEngine(37), getFoldEngine(37.0))
+        self.assertIsNot(getFoldEngine(37), getFoldEngine(60))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+import unittest
+import os
+import random
+import re
+import shutil
+import tempfile
+from DNAProbeDesigner.genomeStore import TwoBitFile, fastaToTwoBit, isTwoBit, parseRegion
+
+# build a sequence mixing upper and lower case bases, N runs and ambiguity codes
+def mixed_sequence(rnd, length):
+    parts = []
+    while sum(map(len, parts)) < length:
+        r = rnd.random()
+        if r < 0.05:
+            parts.append('N' * rnd.randint(1, 300))
+        elif r < 0.08:
+            parts.append(rnd.choice('nRYk') * rnd.randint(1, 5))
+        elif r < 0.3:
+            parts.append(''.join(rnd.choice('acgt') for _ in range(rnd.randint(1, 400))))
+        else:
+            parts.append(''.join(rnd.choice('ACGT') for _ in range(rnd.randint(1, 400))))
+    return ''.join(parts)[:length]
+
+class TestGenomeStore(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        rnd = random.Random(0)
+        self.records = [(f'seq{k}', mixed_sequence(rnd, length))
+                        for k, length in enumerate([0, 1, 5, 4003, 50000])]
+        self.fasta = os.path.join(self.tmp_dir, 'genome.fa')
+        with open(self.fasta, 'w') as file:
+            for name, seq in self.records:
+                file.write(f'>{name} some description\n')
+                for k in range(0, len(seq), 61):
+                    file.write(seq[k:k + 61] + '\n')
+        self.two_bit = os.path.join(self.tmp_dir, 'genome.2bit')
+        fastaToTwoBit(self.fasta, self.two_bit, chunkSize=1000)
+        self.store = TwoBitFile(self.two_bit)
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.tmp_dir)
+
+    # every sequence decodes back to the FASTA, with and without soft masking
+    def test_round_trip(self):
+        self.assertTrue(isTwoBit(self.two_bit))
+        self.assertFalse(isTwoBit(self.fasta))
+        self.assertEqual(self.store.names, [name for name, seq in self.records])
+        for name, seq in self.records:
+            masked = re.sub('[^ACGTacgt]', lambda m: 'n' if m.group(0).islower() else 'N', seq)
+            self.assertEqual(self.store.length(name), len(seq))
+            self.assertEqual(self.store.fetch(name, softMask=True), masked)
+            self.assertEqual(self.store.fetch(name), masked.upper())
+
+    # random regions match slices of the sequence
+    def test_regions(self):
+        rnd = random.Random(1)
+        name, seq = self.records[-1]
+        expected = re.sub('[^ACGT]', 'N', seq.upper())
+        for _ in range(500):
+            start = rnd.randint(0, len(seq))
+            end = rnd.randint(start, len(seq))
+            self.assertEqual(self.store.fetch(name, start, end), expected[start:end])
+        self.assertEqual(self.store.fetchRegion(f'{name}:11-20'), expected[10:20])
+        self.assertEqual(parseRegion('chr1:1,001-2,000'), ('chr1', 1000, 2000))
+        with self.assertRaises(ValueError):
+            self.store.fetch(name, 0, len(seq) + 1)
+
+    # the N run table holds every run of unknown bases
+    def test_n_runs(self):
+        name, seq = self.records[-1]
+        starts, ends = self.store.nRuns(name)
+        runs = [(m.start(), m.end()) for m in re.finditer('[^ACGTacgt]+', seq)]
+        self.assertEqual(list(zip(starts.tolist(), ends.tolist())), runs)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+import unittest
+import numpy as np
+from DNAProbeDesigner.ldaModel import LdaScorer, ldaScorer, ldaTemps, ldaCoefs, ldaIntercepts, ldaClasses
+
+try:
+    from sklearn.discriminant_analysis import LinearDiscriminantAnalysis
+except ImportError:
+    LinearDiscriminantAnalysis = None
+
+# random [length, alignment score, %G+C] features spanning realistic and extreme values
+def random_features(seed, count):
+    rng = np.random.default_rng(seed)
+    return np.column_stack([rng.integers(15, 120, count), rng.integers(-200, 1, count),
+                            rng.uniform(0, 100, count)]).astype(float)
+
+class TestLdaScorer(unittest.TestCase):
+    # every temperature matches scikit-learn's predict_proba
+    @unittest.skipIf(LinearDiscriminantAnalysis is None, 'scikit-learn is not installed')
+    def test_matches_sklearn(self):
+        features = random_features(0, 50000)
+        probs = ldaScorer.probs(features)
+        self.assertEqual(probs.shape, (50000, 6))
+        for k, temp in enumerate(ldaTemps):
+            clf = LinearDiscriminantAnalysis()
+            clf.coef_ = ldaCoefs[[k]]
+            clf.intercept_ = ldaIntercepts[[k]]
+            clf.classes_ = ldaClasses
+            expected = clf.predict_proba(features)[:, 1]
+            np.testing.assert_allclose(probs[:, k], expected, rtol=0, atol=1e-12)
+            np.testing.assert_allclose(ldaScorer.probsAt(features, temp), expected,
+                                       rtol=0, atol=1e-12)
+
+    # one temperature at a time gives the columns of the full matrix
+    def test_columns(self):
+        features = random_features(1, 1000)
+        probs = ldaScorer.probs(features)
+        for k, temp in enumerate(ldaTemps):
+            np.testing.assert_allclose(ldaScorer.probsAt(features, float(temp)), probs[:, k],
+                                       rtol=0, atol=1e-15)
+
+    # large decision values saturate without overflow, unknown temperatures are rejected
+    def test_extremes(self):
+        scorer = LdaScorer(coefs=ldaCoefs * 1000)
+        with np.errstate(over='raise'):
+            probs = scorer.probs([[40, 0, 100], [1000, -1000, 0]])
+        self.assertTrue(np.all((probs >= 0) & (probs <= 1)))
+        self.assertEqual(ldaScorer.probs(np.zeros((0, 3))).shape, (0, 6))
+        with self.assertRaises(ValueError):
+            ldaScorer.probsAt([[40, 0, 50]], 45)
+
+if __name__ == '__main__':
+    unittest.main()
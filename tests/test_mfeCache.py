@@ -0,0 +1,55 @@
+import unittest
+import os
+import shutil
+import tempfile
+from DNAProbeDesigner.mfeCache import MfeCache, seqfoldVersion
+
+class TestMfeCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'cache', 'mfe.sqlite')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    # stored MFEs are found again by later sessions and counted as hits
+    def test_persistent(self):
+        cache = MfeCache(self.path)
+        self.assertEqual(cache.get(['GATTACA', 'CCGG'], 37), {})
+        cache.put({'GATTACA': -1.5, 'CCGG': 0.25}, 37)
+        cache.close()
+        cache = MfeCache(self.path)
+        self.assertEqual(cache.get(['GATTACA', 'CCGG', 'TTTT'], 37), {'GATTACA': -1.5, 'CCGG': 0.25})
+        self.assertEqual(cache.stats(), {'hits': 2, 'misses': 1, 'hitRate': 2 / 3, 'evictions': 0,
+                                         'entries': 2})
+        self.assertEqual(cache.version, seqfoldVersion())
+
+    # entries of another temperature or seqfold version are not reused
+    def test_keys(self):
+        cache = MfeCache(self.path)
+        cache.put({'GATTACA': -1.5}, 37)
+        self.assertEqual(cache.get(['GATTACA'], 42), {})
+        self.assertEqual(MfeCache(self.path, version='0.0.0').get(['GATTACA'], 37), {})
+        self.assertEqual(cache.get(['GATTACA'], 37.0), {'GATTACA': -1.5})
+
+    # the least recently used entries are evicted beyond the size cap
+    def test_lru_eviction(self):
+        cache = MfeCache(self.path, maxEntries=3)
+        cache.put({'A': 1.0, 'C': 2.0, 'G': 3.0}, 37)
+        cache.get(['A'], 37)
+        cache.put({'T': 4.0}, 37)
+        self.assertEqual(len(cache), 3)
+        self.assertEqual(cache.evictions, 1)
+        self.assertEqual(cache.get(['A', 'C', 'G', 'T'], 37), {'A': 1.0, 'G': 3.0, 'T': 4.0})
+        cache.put({'AA': 5.0, 'CC': 6.0}, 37)
+        self.assertEqual(cache.get(['A', 'G', 'T', 'AA', 'CC'], 37), {'T': 4.0, 'AA': 5.0, 'CC': 6.0})
+
+    # lookups of many sequences are split into batches
+    def test_many(self):
+        cache = MfeCache(self.path)
+        MFEs = {'A' * k: -k / 10 for k in range(1, 2001)}
+        cache.put(MFEs, 37)
+        self.assertEqual(cache.get(list(MFEs), 37), MFEs)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,268 @@
+import unittest
+import contextlib
+import io
+import os
+import random
+import re
+import shutil
+import struct
+import tempfile
+from DNAProbeDesigner.bgzf import BgzfReader, BgzfWriter
+from DNAProbeDesigner.outputClean import (cleanOutput, parseSamLine, readSam, readBam, probeTm,
+                                          samShards, CleanLog, reportLine, decisionNames, addLDA)
+
+HEADER = ['@HD\tVN:1.0\tSO:unsorted', '@SQ\tSN:chr1\tLN:100000']
+
+# one SAM line per alignment, in the layout written by bowtie2
+def sam_line(name, flag, rname, seq, tags):
+    return '\t'.join([name, str(flag), rname, '0' if rname == '*' else '100', '42',
+                      '*' if rname == '*' else '%dM' % len(seq), '*', '0', '0', seq,
+                      '~' * len(seq)] + tags)
+
+UNIQUE = sam_line('chr1:100-135', 0, 'chr1', 'ACGTAGCTAGCTAGGATCGATCGATGCTAGCTAGCA',
+                  ['AS:i:0', 'XN:i:0', 'YT:Z:UU'])
+ZERO = sam_line('chr1:200-235', 4, '*', 'TTGACTGACTAGCTAGCTAGGCGCGATATAGCTAGC', ['YT:Z:UU'])
+MULTI = sam_line('chr1:300-335', 0, 'chr1', 'GGCATCGATCGACTACGACTAGCATCGACTGACTAG',
+                 ['AS:i:-3', 'XS:i:-20', 'XN:i:0', 'YT:Z:UU'])
+MULTI_2 = sam_line('chr1:300-335', 256, 'chr1', 'GGCATCGATCGACTACGACTAGCATCGACTGACTAG',
+                   ['AS:i:-20', 'XS:i:-3', 'XN:i:0', 'YT:Z:UU'])
+
+class TestSamParsing(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.sam = os.path.join(self.tmp_dir, 'test.sam')
+        with open(self.sam, 'w') as file:
+            file.write('\n'.join(HEADER + [UNIQUE, ZERO, MULTI, MULTI_2, '']))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    # each line is parsed into the read name coordinates, flag, reference, sequence and tags
+    def test_parse_line(self):
+        rec = parseSamLine(MULTI_2 + '\n')
+        self.assertEqual((rec.chrom, rec.start, rec.stop, rec.flag, rec.rname),
+                         ('chr1', '300', '335', 256, 'chr1'))
+        self.assertEqual((rec.AS, rec.XS), ('-20', '-3'))
+        self.assertEqual(rec.seq, 'GGCATCGATCGACTACGACTAGCATCGACTGACTAG')
+        rec = parseSamLine(ZERO)
+        self.assertEqual((rec.rname, rec.AS, rec.XS), ('*', None, None))
+
+    # header and blank lines are skipped while streaming
+    def test_read_sam(self):
+        self.assertEqual([rec.start for rec in readSam(self.sam)], ['100', '200', '300', '300'])
+
+    # unique and zero modes keep the matching alignments
+    def test_unique_and_zero_modes(self):
+        for unique, expected in [(True, UNIQUE), (False, ZERO)]:
+            out_name = os.path.join(self.tmp_dir, 'out')
+            with contextlib.redirect_stdout(io.StringIO()):
+                cleanOutput(self.sam, unique, not unique, 0.5, 42, 390, 50, False, False,
+                            False, out_name, 0)
+            fields = expected.split('\t')
+            (chrom, span) = fields[0].split(':')
+            with open(out_name + '.bed') as file:
+                self.assertEqual(file.read(), '%s\t%s\t%s\t%s\t%s' % (
+                    chrom, *span.split('-'), fields[9], probeTm(fields[9], 390, 50)))
+
+# a SAM file of unaligned, unique and -k 2 multi-aligned reads; some starts repeat
+def random_sam(filename, seed, count):
+    rnd = random.Random(seed)
+    lines = list(HEADER)
+    for k in range(count):
+        seq = ''.join(rnd.choice('ACGT') for _ in range(rnd.randint(30, 42)))
+        start = rnd.randint(1, count // 2) * 40
+        name = 'chr%d:%d-%d' % (rnd.randint(1, 2), start, start + len(seq) - 1)
+        r = rnd.random()
+        if r < 0.2:
+            lines.append(sam_line(name, 4, '*', seq, ['YT:Z:UU']))
+        elif r < 0.5:
+            lines.append(sam_line(name, 0, 'chr1', seq, ['AS:i:-%d' % rnd.randint(0, 9)]))
+        else:
+            (score, second) = (-rnd.randint(0, 9), -rnd.randint(0, 60))
+            lines.append(sam_line(name, 0, 'chr1', seq, ['AS:i:%d' % score, 'XS:i:%d' % second]))
+            lines.append(sam_line(name, 256, 'chr1', seq, ['AS:i:%d' % second, 'XS:i:%d' % score]))
+    with open(filename, 'w') as file:
+        file.write('\n'.join(lines) + '\n')
+
+class TestWorkers(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.sam = os.path.join(self.tmp_dir, 'test.sam')
+        random_sam(self.sam, 0, 600)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def run_clean(self, unique, zero, prob, workers):
+        out_name = os.path.join(self.tmp_dir, 'out%d' % workers)
+        with contextlib.redirect_stdout(io.StringIO()) as stdout:
+            cleanOutput(self.sam, unique, zero, prob, 42, 390, 50, False, False, False,
+                        out_name, 0, workers)
+        with open(out_name + '.bed') as file:
+            return file.read(), stdout.getvalue()
+
+    # shards start at line boundaries and never split the alignments of a read
+    def test_shards(self):
+        shards = samShards(self.sam, 13)
+        self.assertGreater(len(shards), 5)
+        self.assertEqual(shards[0][0], 0)
+        self.assertEqual(shards[-1][1], os.path.getsize(self.sam))
+        owner = {}
+        for k, (start, end) in enumerate(shards):
+            self.assertEqual(start, shards[k - 1][1] if k else 0)
+            for rec in readSam(self.sam, start, end):
+                name = '%s:%s-%s' % (rec.chrom, rec.start, rec.stop)
+                self.assertEqual(owner.setdefault((name, rec.seq), k), k)
+
+    # every mode gives the serial output with any number of workers
+    def test_workers_match_serial(self):
+        for unique, zero, prob in [(True, False, 0.5), (False, True, 0.5),
+                                   (False, False, 0.5), (False, False, 0.05)]:
+            expected = self.run_clean(unique, zero, prob, 1)
+            self.assertTrue(expected[0])
+            for workers in (2, 5):
+                with self.subTest(unique=unique, zero=zero, prob=prob, workers=workers):
+                    self.assertEqual(self.run_clean(unique, zero, prob, workers), expected)
+
+# encode a SAM file as BAM, storing integer tags in the smallest type as samtools does
+def sam_to_bam(sam, bam):
+    with open(sam) as file:
+        lines = [line for line in file.read().splitlines() if line]
+    header = [line for line in lines if line.startswith('@')]
+    refs = [(line.split('\t')[1][3:], int(line.split('\t')[2][3:]))
+            for line in header if line.startswith('@SQ')]
+    ref_ids = {name: k for k, (name, length) in enumerate(refs)}
+    text = ('\n'.join(header) + '\n').encode()
+    out = [b'BAM\1', struct.pack('<i', len(text)), text, struct.pack('<i', len(refs))]
+    for name, length in refs:
+        out.append(struct.pack('<i', len(name) + 1) + name.encode() + b'\0' +
+                   struct.pack('<i', length))
+    for line in lines[len(header):]:
+        fields = line.split('\t')
+        name = fields[0].encode() + b'\0'
+        cigar = b''.join(struct.pack('<I', int(n) << 4 | 'MIDNSHP=X'.index(op))
+                         for n, op in re.findall(r'(\d+)([MIDNSHP=X])', fields[5]))
+        codes = ['=ACMGRSVTWYHKDBN'.index(base) for base in fields[9]] + [0]
+        seq = bytes(codes[k] << 4 | codes[k + 1] for k in range(0, len(fields[9]), 2))
+        qual = bytes(ord(c) - 33 for c in fields[10])
+        tags = b''
+        for tag in fields[11:]:
+            (key, kind, value) = tag.split(':', 2)
+            if kind == 'i':
+                value = int(value)
+                kind = 'c' if -128 <= value < 128 else 's' if -32768 <= value < 32768 else 'i'
+                tags += key.encode() + kind.encode() + struct.pack('<' + 'bhi'['csi'.index(kind)],
+                                                                   value)
+            else:
+                tags += key.encode() + b'Z' + value.encode() + b'\0'
+        cigar_count = len(cigar) // 4
+        record = struct.pack('<iiBBHHHiiii', ref_ids.get(fields[2], -1), int(fields[3]) - 1,
+                             len(name), int(fields[4]), 0, cigar_count, int(fields[1]),
+                             len(fields[9]), -1, -1, 0) + name + cigar + seq + qual + tags
+        out.append(struct.pack('<i', len(record)) + record)
+    with BgzfWriter(bam) as writer:
+        writer.write(b''.join(out))
+
+class TestBamInput(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.sam = os.path.join(self.tmp_dir, 'test.sam')
+        self.bam = os.path.join(self.tmp_dir, 'test.bam')
+        random_sam(self.sam, 2, 1500)
+        with open(self.sam, 'a') as file:
+            file.write(sam_line('chr1:900000-900035', 16, 'chr1',
+                                'ACGTAGCTAGCTAGGATCGATCGATGCTAGCTAGCAT',
+                                ['AS:i:-300', 'XS:i:-70000', 'MD:Z:37', 'YT:Z:UU']) + '\n')
+        sam_to_bam(self.sam, self.bam)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    # blocks decompressed by a pool of threads come back in file order
+    def test_bgzf_reader(self):
+        data = bytes(random.Random(0).getrandbits(8) for _ in range(300000))
+        with BgzfWriter(self.bam) as writer:
+            writer.write(data)
+        for workers, batch_size in [(1, 64), (3, 1), (2, 2)]:
+            reader = BgzfReader(self.bam, workers, batch_size)
+            self.assertEqual(reader.read(), data)
+
+    # BAM records give the same fields as the SAM lines (the test SAM has scores of -0)
+    def test_read_bam(self):
+        def scores(recs):
+            return [rec._replace(AS=rec.AS and int(rec.AS), XS=rec.XS and int(rec.XS))
+                    for rec in recs]
+        expected = list(readSam(self.sam))
+        for workers in (1, 3):
+            self.assertEqual(scores(readBam(self.bam, workers)), scores(expected))
+        self.assertEqual((expected[-1].AS, expected[-1].XS), ('-300', '-70000'))
+
+    # every mode gives the same output from the .bam file as from the .sam file
+    def test_bam_matches_sam(self):
+        for unique, zero, report in [(True, False, False), (False, True, False),
+                                     (False, False, False), (False, False, True)]:
+            outputs = []
+            for filename, workers in [(self.sam, 1), (self.bam, 1), (self.bam, 2)]:
+                out_name = os.path.join(self.tmp_dir, 'out')
+                with contextlib.redirect_stdout(io.StringIO()) as stdout:
+                    cleanOutput(filename, unique, zero, 0.5, 42, 390, 50, report, False, False,
+                                out_name, 0, workers)
+                with open(out_name + '.bed') as file:
+                    outputs.append((file.read(), stdout.getvalue()))
+            with self.subTest(unique=unique, zero=zero, report=report):
+                self.assertTrue(outputs[0][0])
+                self.assertEqual(outputs[1], outputs[0])
+                self.assertEqual(outputs[2], outputs[0])
+
+    # files that are not BAM are rejected
+    def test_not_bam(self):
+        with BgzfWriter(self.bam) as writer:
+            writer.write(b'@HD\tVN:1.0\n')
+        with self.assertRaises(ValueError):
+            list(readBam(self.bam))
+
+class TestReportMode(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.sam = os.path.join(self.tmp_dir, 'test.sam')
+        random_sam(self.sam, 1, 800)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    # the log and the TSV hold the same records, sorted by chrom in the order chroms are first seen
+    # and then by start
+    def test_log_matches_tsv(self):
+        with open(self.sam) as file:
+            chroms = list(dict.fromkeys(line.split(':')[0] for line in file if not line.startswith('@')))
+        for unique, zero in [(True, False), (False, True), (False, False)]:
+            with self.subTest(unique=unique, zero=zero):
+                out_name = os.path.join(self.tmp_dir, 'out')
+                with contextlib.redirect_stdout(io.StringIO()):
+                    cleanOutput(self.sam, unique, zero, 0.5, 42, 390, 50, True, False, False,
+                                out_name, 0)
+                with open(out_name + '_outputClean_log.txt') as file:
+                    log = file.read().split('\n')[4:]
+                with open(out_name + '_outputClean_report.tsv') as file:
+                    rows = [line.split('\t') for line in file.read().splitlines()[1:]]
+                self.assertEqual(len(rows), len(log))
+                self.assertGreater(len(rows), 100)
+                coords = [(chroms.index(row[0]), int(row[1])) for row in rows]
+                self.assertEqual(coords, sorted(coords))
+                for row, line in zip(rows, log):
+                    self.assertIn(row[5], decisionNames)
+                    self.assertTrue(line.startswith('Candidate probe at %s:%s-%s ' % tuple(row[:3])))
+                    self.assertEqual(row[4] == 'NA', 'probability' not in line)
+
+    # Debug mode prints the records as they are added without keeping them
+    def test_debug_echo(self):
+        report = CleanLog(0.5, keep=False, echo=True)
+        with contextlib.redirect_stdout(io.StringIO()) as stdout:
+            report.add(addLDA, 'chr1', '300', '335', 2, 0.25)
+        self.assertEqual(len(report), 0)
+        self.assertEqual(stdout.getvalue(), reportLine(addLDA, 'chr1', 300, 335, 0.25, 0.5) + '\n')
+        self.assertEqual(stdout.getvalue(), 'Candidate probe at chr1:300-335 added to output '
+                         'with 0.2500 < 0.5000 probability of having off-target sites\n')
+
+if __name__ == '__main__':
+    unittest.main()
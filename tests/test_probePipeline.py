@@ -0,0 +1,111 @@
+import unittest
+import contextlib
+import io
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from DNAProbeDesigner.outputClean import cleanOutput, readSam
+from DNAProbeDesigner.probePipeline import runPipeline, blockParseScript
+from tests.test_blockParse import random_sequence, write_fasta
+
+FAKE_ALIGNER = os.path.join(os.path.dirname(__file__), 'files', 'fake_aligner.py')
+OUTPUT_CLEAN = os.path.join(os.path.dirname(blockParseScript), 'outputClean.py')
+
+class TestProbePipeline(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.fasta = os.path.join(self.tmp_dir, 'test.fa')
+        write_fasta(self.fasta, [('chr1:1000-9000', random_sequence(0, 6000)),
+                                 ('chr2', random_sequence(1, 3000))])
+        # the same stages one after another through files on disk
+        self.stem = os.path.join(self.tmp_dir, 'staged')
+        subprocess.run([sys.executable, blockParseScript, '-f', self.fasta, '-o', self.stem],
+                       check=True, stdout=subprocess.DEVNULL)
+        with open(self.stem + '.sam', 'w') as sam:
+            subprocess.run([sys.executable, FAKE_ALIGNER, '-U', self.stem + '.fastq'],
+                           check=True, stdout=sam)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def read(self, filename):
+        with open(filename) as file:
+            return file.read()
+
+    # the pipe chain gives the output and SAM of the staged run in every mode
+    def test_pipeline_matches_staged(self):
+        for unique, zero in [(False, False), (True, False), (False, True)]:
+            with self.subTest(unique=unique, zero=zero):
+                staged = self.stem + '_clean'
+                piped = os.path.join(self.tmp_dir, 'piped')
+                with contextlib.redirect_stdout(io.StringIO()):
+                    cleanOutput(self.stem + '.sam', unique, zero, 0.5, 42, 390, 50, False,
+                                False, False, staged, 0)
+                    runPipeline(self.fasta, [sys.executable, FAKE_ALIGNER, '-U', '-'], piped,
+                                piped + '.sam', uniqueVal=unique, zeroVal=zero)
+                self.assertTrue(self.read(staged + '.bed'))
+                self.assertEqual(self.read(piped + '.bed'), self.read(staged + '.bed'))
+                self.assertEqual(self.read(piped + '.sam'), self.read(self.stem + '.sam'))
+
+    # SAM is read the same way from a file, standard input and an in-process stream
+    def test_sam_from_stdin_and_stream(self):
+        with open(self.stem + '.sam', 'rb') as file:
+            data = file.read()
+        expected = list(readSam(self.stem + '.sam'))
+        self.assertTrue(expected)
+        self.assertEqual(list(readSam(io.BytesIO(data))), expected)
+        self.assertEqual(list(readSam(io.StringIO(data.decode()))), expected)
+        staged = self.stem + '_clean'
+        with contextlib.redirect_stdout(io.StringIO()):
+            cleanOutput(self.stem + '.sam', False, False, 0.5, 42, 390, 50, False, False,
+                        False, staged, 0)
+        subprocess.run([sys.executable, OUTPUT_CLEAN, '-f', '-', '-o', self.stem + '_stdin'],
+                       input=data, check=True, stdout=subprocess.DEVNULL)
+        self.assertEqual(self.read(self.stem + '_stdin.bed'), self.read(staged + '.bed'))
+
+    # records with candidates at the same starts keep all of them, in record order, as if each
+    # record was run on its own, piped, deduplicated, from SAM and with workers
+    def test_multi_record(self):
+        records = [('chrB', random_sequence(2, 4000)), ('chrA', random_sequence(2, 4000)),
+                   ('chr1', random_sequence(3, 3000))]
+        fasta = os.path.join(self.tmp_dir, 'multi.fa')
+        write_fasta(fasta, records)
+        aligner = [sys.executable, FAKE_ALIGNER, '-U', '-']
+        for unique, zero in [(False, False), (True, False), (False, True)]:
+            with self.subTest(unique=unique, zero=zero):
+                beds = []
+                with contextlib.redirect_stdout(io.StringIO()):
+                    for k, record in enumerate(records):
+                        single = os.path.join(self.tmp_dir, 'single%d' % k)
+                        write_fasta(single + '.fa', [record])
+                        runPipeline(single + '.fa', aligner, single, uniqueVal=unique,
+                                    zeroVal=zero)
+                        beds.append(self.read(single + '.bed'))
+                    piped = os.path.join(self.tmp_dir, 'piped')
+                    runPipeline(fasta, aligner, piped, piped + '.sam', uniqueVal=unique,
+                                zeroVal=zero)
+                    deduped = os.path.join(self.tmp_dir, 'deduped')
+                    runPipeline(fasta, aligner, deduped, uniqueVal=unique, zeroVal=zero,
+                                dedupVal=True)
+                    for workers in (1, 2):
+                        cleanOutput(piped + '.sam', unique, zero, 0.5, 42, 390, 50, False,
+                                    False, False, '%s_%d' % (piped, workers), 0,
+                                    workersVal=workers)
+                self.assertEqual(beds[0].replace('chrB', 'chrA'), beds[1])
+                expected = '\n'.join(bed for bed in beds if bed)
+                self.assertIn('\nchrA\t', expected)
+                for name in (piped, deduped, piped + '_1', piped + '_2'):
+                    self.assertEqual(self.read(name + '.bed'), expected)
+
+    # a failing aligner stops the pipeline with its exit status
+    def test_aligner_failure(self):
+        with self.assertRaises(subprocess.CalledProcessError) as cm:
+            with contextlib.redirect_stdout(io.StringIO()):
+                runPipeline(self.fasta, [sys.executable, FAKE_ALIGNER, '--fail'],
+                            os.path.join(self.tmp_dir, 'failed'))
+        self.assertEqual(cm.exception.returncode, 3)
+
+if __name__ == '__main__':
+    unittest.main()
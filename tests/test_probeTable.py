@@ -0,0 +1,67 @@
+import unittest
+import os
+import shutil
+import tempfile
+import numpy as np
+from DNAProbeDesigner.probeTable import newTable, parseProbes, readProbes, tablePath, writeProbes
+
+# a table of probes with random sequences and probabilities
+def random_table(seed, count):
+    rng = np.random.default_rng(seed)
+    seqs = [''.join(rng.choice(list('GATC'), rng.integers(30, 43))) for _ in range(count)]
+    starts = rng.integers(0, 10 ** 6, count)
+    return newTable(seqs, rng.uniform(0, 1, (count, 6)), ['chr%d' % k for k in rng.integers(1, 23, count)],
+                    starts, starts + [len(seq) for seq in seqs], rng.uniform(40, 50, count))
+
+class TestProbeTable(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmp_dir, 'probes_pDup_filtered.bed')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    # the sidecar is loaded memory-mapped with every field as written
+    def test_sidecar_round_trip(self):
+        table = random_table(0, 200)
+        table['MFE'] = np.linspace(-5, 0, 200)
+        writeProbes(self.filename, '200 probes\n', table)
+        self.assertEqual(tablePath(self.filename), os.path.join(self.tmp_dir, 'probes_pDup_filtered.npy'))
+        loaded = readProbes(self.filename)
+        self.assertIsInstance(loaded, np.memmap)
+        self.assertEqual(loaded.dtype, table.dtype)
+        np.testing.assert_array_equal(loaded, table)
+
+    # the text export parses back to the same probes, rounded, and carries the MFE once set
+    def test_text_export(self):
+        table = random_table(1, 50)
+        table['MFE'] = -np.arange(50) / 4
+        writeProbes(self.filename, '50 probes\n', table)
+        with open(self.filename) as file:
+            lines = file.readlines()
+        self.assertEqual(lines[1].split(' \t ')[:2], ['1', table['seq'][0].decode()])
+        parsed = parseProbes(self.filename)
+        np.testing.assert_array_equal(parsed['number'], table['number'])
+        np.testing.assert_array_equal(parsed['seq'], table['seq'])
+        np.testing.assert_allclose(parsed['probs'], table['probs'], atol=1e-8)
+        np.testing.assert_array_equal(parsed['MFE'], table['MFE'])
+
+    # a sidecar older than its text file is ignored
+    def test_stale_sidecar(self):
+        writeProbes(self.filename, '10 probes\n', random_table(2, 10))
+        writeProbes(os.path.join(self.tmp_dir, 'other.bed'), '5 probes\n', random_table(3, 5))
+        shutil.copy(os.path.join(self.tmp_dir, 'other.bed'), self.filename)
+        mtime = os.path.getmtime(tablePath(self.filename))
+        os.utime(self.filename, (mtime + 10, mtime + 10))
+        table = readProbes(self.filename)
+        self.assertNotIsInstance(table, np.memmap)
+        self.assertEqual(len(table), 5)
+
+    # an empty probe set gives an empty table
+    def test_empty(self):
+        writeProbes(self.filename, '0 probes\n', newTable([], np.zeros((0, 6))))
+        self.assertEqual(len(readProbes(self.filename)), 0)
+        self.assertEqual(len(parseProbes(self.filename)), 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,11 +2,20 @@ import unittest
 import numpy as np
 import sys
 import os
+import shutil
+import tempfile
+import random
+import seqfold
+from unittest.mock import patch
 
 current_path = os.path.dirname(os.path.abspath(__file__))
 relative_path = os.path.normpath(os.path.join(current_path, '../DNA-Probe-Designer'))
 sys.path.append(relative_path)
-from secondary_structure import filter_secondary_structure
+from secondary_structure import calc_MFEs, filter_secondary_structure, mfe_lower_bounds
+from duplex_prob import filter_duplex_prob
+from probeTable import readProbes
+from mfeCache import MfeCache
+from tests.test_duplex_prob import write_probeset
 
 # test secondary structure check
 class TestSecondaryStructure(unittest.TestCase):
@@ -63,5 +72,150 @@ class TestSecondaryStructure(unittest.TestCase):
             filter_secondary_structure(self.valid_bed_filename, invalid_MFE)
         self.assertEqual(str(error.exception), (f"MFE must be a float, unacceptable value: {invalid_MFE}"))
 
+# test the MFE filter on the sidecar written by the duplex probability filter
+class TestSecondaryStructureSidecar(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.stem = os.path.join(self.tmp_dir, 'probes')
+        write_probeset(self.stem, 60)
+        filter_duplex_prob(self.stem + '.sam', self.stem + '.bed', 32, 0.005)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    # each probe that passes is kept with its own number, coordinates and MFE
+    def test_sidecar_mfe(self):
+        probes = readProbes(self.stem + '_pDup_filtered.bed')
+        filter_secondary_structure(self.stem + '_pDup_filtered.bed', -1)
+        table = readProbes(self.stem + '_pDup_MFE_filtered.bed')
+        self.assertIsInstance(table, np.memmap)
+        MFEs = np.array([seqfold.dg(seq.decode()) for seq in probes['seq']])
+        self.assertTrue(0 < len(table) < len(probes))
+        np.testing.assert_array_equal(table[['number', 'seq', 'chrom', 'start', 'stop']],
+                                      probes[MFEs > -1][['number', 'seq', 'chrom', 'start', 'stop']])
+        np.testing.assert_array_equal(table['MFE'], MFEs[MFEs > -1])
+        with open(self.stem + '_pDup_MFE_filtered.bed') as file:
+            lines = file.readlines()
+        self.assertEqual(int(lines[0].split(' ')[0]), len(table))
+        for line, probe in zip(lines[1:], table):
+            parts = [part.strip() for part in line.split('\t')]
+            self.assertEqual((int(parts[0]), parts[1], float(parts[3])),
+                             (probe['number'], probe['seq'].decode(), probe['MFE']))
+
+    # prescreening passes the same probes, folding only those that could fail
+    def test_prescreen(self):
+        filter_secondary_structure(self.stem + '_pDup_filtered.bed', -5)
+        table = readProbes(self.stem + '_pDup_MFE_filtered.bed')
+        with patch('secondary_structure.seqfold.dg', wraps=seqfold.dg) as mock_dg:
+            filter_secondary_structure(self.stem + '_pDup_filtered.bed', -5, prescreen=True)
+        screened = readProbes(self.stem + '_pDup_MFE_filtered.bed')
+        np.testing.assert_array_equal(screened['number'], table['number'])
+        folded = ~np.isnan(screened['MFE'])
+        self.assertGreater(np.sum(~folded), 0)
+        self.assertLess(mock_dg.call_count, len(set(readProbes(self.stem + '_pDup_filtered.bed')['seq'])))
+        np.testing.assert_array_equal(screened['MFE'][folded], table['MFE'][folded])
+
+# test the MFE calculation in worker processes
+class TestCalcMFEs(unittest.TestCase):
+    def setUp(self):
+        rand = random.Random(0)
+        self.seqs = [''.join(rand.choice('GATC') for _ in range(rand.randint(36, 41))) for _ in range(300)]
+        self.expected = [seqfold.dg(seq) for seq in self.seqs]
+
+    # the pool gives the MFEs of every sequence in input order, reporting progress after each chunk
+    def test_parallel(self):
+        calls = []
+        MFEs = calc_MFEs(self.seqs, workers=2, progress=lambda done, total: calls.append((done, total)),
+                         min_parallel=0)
+        np.testing.assert_array_equal(MFEs, self.expected)
+        self.assertGreater(len(calls), 1)
+        self.assertEqual(calls[-1], (300, 300))
+        self.assertEqual([done for done, total in calls], sorted(done for done, total in calls))
+
+    # small inputs and a single worker are folded without starting a pool
+    @patch('secondary_structure.ProcessPoolExecutor')
+    def test_serial_fallback(self, mock_executor):
+        calls = []
+        np.testing.assert_array_equal(calc_MFEs(self.seqs, workers=4, progress=lambda *args: calls.append(args)),
+                                      self.expected)
+        np.testing.assert_array_equal(calc_MFEs(self.seqs, workers=1, min_parallel=0), self.expected)
+        self.assertEqual(len(calc_MFEs([], workers=4, min_parallel=0)), 0)
+        mock_executor.assert_not_called()
+        self.assertEqual(calls[-1], (300, 300))
+
+    # repeated sequences are folded once, and a second run takes every MFE from the cache
+    def test_dedup_and_cache(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        path = os.path.join(tmp_dir, 'mfe.sqlite')
+        seqs = self.seqs + self.seqs[:100]
+        with patch('secondary_structure.seqfold.dg', wraps=seqfold.dg) as mock_dg:
+            np.testing.assert_array_equal(calc_MFEs(seqs, workers=1, cache=path), self.expected + self.expected[:100])
+            self.assertEqual(mock_dg.call_count, 300)
+            cache = MfeCache(path)
+            np.testing.assert_array_equal(calc_MFEs(seqs[::-1], workers=1, cache=cache),
+                                          (self.expected + self.expected[:100])[::-1])
+            self.assertEqual(mock_dg.call_count, 300)
+        self.assertEqual((cache.hits, cache.misses), (300, 0))
+        # another temperature is folded again
+        np.testing.assert_array_equal(calc_MFEs(self.seqs[:10], 42, workers=1, cache=cache),
+                                      [seqfold.dg(seq, 42) for seq in self.seqs[:10]])
+        self.assertEqual(cache.misses, 10)
+
+    # the NumPy engine gives the same MFEs in input order, folded here and in worker processes
+    def test_numpy_engine(self):
+        np.testing.assert_array_equal(calc_MFEs(self.seqs, workers=1, engine='numpy'), self.expected)
+        np.testing.assert_array_equal(calc_MFEs(self.seqs, workers=2, min_parallel=0, engine='numpy'),
+                                      self.expected)
+        with self.assertRaises(ValueError):
+            calc_MFEs(self.seqs, engine='vienna')
+
+# random and repeat-rich probes, with short and unpairable ones, for the MFE bounds
+def bound_corpus(seed, count):
+    rand = random.Random(seed)
+    randomSeq = lambda length, bases='GATC': ''.join(rand.choice(bases) for _ in range(length))
+    complement = lambda seq: seq[::-1].translate(str.maketrans('GATC', 'CTAG'))
+    seqs = [randomSeq(rand.randint(36, 41)) for _ in range(count)]
+    for _ in range(count):
+        length = rand.randint(36, 41)
+        kind = rand.randrange(4)
+        if kind == 0:
+            seq = randomSeq(rand.randint(1, 6)) * 41
+        elif kind == 1:
+            stem = randomSeq(rand.randint(4, 18))
+            seq = randomSeq(rand.randint(0, 8)) + stem + randomSeq(rand.randint(3, 8)) + complement(stem) + randomSeq(41)
+        elif kind == 2:
+            seq = randomSeq(41, rand.sample('GATC', 2))
+        else:
+            seq = ''
+            while len(seq) < length:
+                stem = randomSeq(rand.randint(3, 6), 'GC')
+                seq += stem + rand.choice(['TTT', 'GAAA', 'TTTT']) + complement(stem) + rand.choice(['', 'A', 'TT'])
+        seqs.append(seq[:length])
+    seqs += [randomSeq(rand.randint(5, 30), rand.choice(['GATC', 'CT', 'ACT', 'CGT'])) for _ in range(count // 4)]
+    return seqs
+
+# test the lower bounds of the MFEs used to skip folding
+class TestMfeLowerBounds(unittest.TestCase):
+    # no probe is ever bounded above its MFE, so prescreening never changes which probes pass
+    def test_conservative(self):
+        seqs = bound_corpus(0, 1500)
+        bounds = mfe_lower_bounds(seqs)
+        MFEs = np.array([seqfold.dg(seq) for seq in seqs])
+        self.assertEqual([seq for (seq, bound, MFE) in zip(seqs, bounds, MFEs) if bound > MFE], [])
+        for threshold in (-1, -3, -5, -8):
+            with self.subTest(threshold=threshold):
+                self.assertFalse(((bounds > threshold) & (MFEs <= threshold)).any())
+        # most random probes are cleared at a usual threshold #
+        self.assertGreater(np.mean(bounds[:1500] > -5), 0.3)
+
+    # sequences without T, or with bases other than A/C/G/T, are always folded
+    def test_unbounded(self):
+        bounds = mfe_lower_bounds(['GGGCCCAAAGGGCCC' * 2, 'ACGTNACGTACGTACGTACGT', 'CCCCAAAAGGGGT', 'ACGT'])
+        np.testing.assert_array_equal(bounds[:2], -np.inf)
+        self.assertTrue(np.isfinite(bounds[2]))
+        self.assertEqual(bounds[3], -np.inf)
+        self.assertEqual(len(mfe_lower_bounds([])), 0)
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,68 @@
+import unittest
+import math
+import random
+import numpy as np
+from Bio.SeqUtils import MeltingTemp as mt
+from DNAProbeDesigner.tmEngine import TmEngine, getTmEngine
+
+# conditions covering every NN table, salt, formamide and strand concentrations
+CONDITIONS = [(mt.DNA_NN3, 50, 0, 25, 25),
+              (mt.DNA_NN3, 390, 50, 25, 25),
+              (mt.DNA_NN4, 100, 10, 500, 20),
+              (mt.DNA_NN1, 50, 0, 25, 25),
+              (mt.DNA_NN2, 300, 0, 50, 0)]
+
+def random_seqs(seed, count, min_len=2, max_len=80):
+    rnd = random.Random(seed)
+    return [''.join(rnd.choice('ACGT') for _ in range(rnd.randint(min_len, max_len)))
+            for _ in range(count)] + ['AAAA', 'TTTTAT', 'GCGC', 'TA', 'AT', 'acgtAC']
+
+class TestTmEngine(unittest.TestCase):
+    # single sequences give exactly the Tm_NN value
+    def test_scalar_matches_tm_nn(self):
+        for k, (table, na, fmd, dnac1, dnac2) in enumerate(CONDITIONS):
+            engine = TmEngine(table, na, fmd, dnac1, dnac2)
+            for seq in random_seqs(k, 200):
+                with self.subTest(condition=k, seq=seq):
+                    self.assertEqual(engine.tm(seq), mt.Tm_NN(seq, nn_table=table, Na=na,
+                                                             dnac1=dnac1, dnac2=dnac2))
+
+    # batches of mixed lengths match the scalar values exactly
+    def test_batch_matches_tm_nn(self):
+        for k, (table, na, fmd, dnac1, dnac2) in enumerate(CONDITIONS):
+            engine = TmEngine(table, na, fmd, dnac1, dnac2)
+            seqs = random_seqs(k + 10, 2000)
+            expected = [mt.Tm_NN(seq, nn_table=table, Na=na, dnac1=dnac1, dnac2=dnac2)
+                        for seq in seqs]
+            self.assertEqual(engine.tmBatch(seqs).tolist(), expected)
+
+    # every window along a block matches Tm_NN of the sliced window
+    def test_windows_match_tm_nn(self):
+        block = random_seqs(20, 1, 1500, 1500)[0]
+        for k, (table, na, fmd, dnac1, dnac2) in enumerate(CONDITIONS):
+            engine = TmEngine(table, na, fmd, dnac1, dnac2)
+            for length in (20, 37):
+                expected = [mt.Tm_NN(block[i:i + length], nn_table=table, Na=na,
+                                     dnac1=dnac1, dnac2=dnac2)
+                            for i in range(len(block) - length + 1)]
+                self.assertEqual(engine.tmWindows(block, length).tolist(), expected)
+
+    # other bases fall back to Tm_NN for single sequences and give NaN in batches
+    def test_other_bases(self):
+        engine = getTmEngine(mt.DNA_NN3, 390, 50)
+        self.assertEqual(engine.tm('ACGTACGTAC'), mt.Tm_NN('ACGTACGTAC', Na=390))
+        tmvals = engine.tmBatch(['ACGTN', 'A', 'ACGTACGT'])
+        self.assertTrue(math.isnan(tmvals[0]) and math.isnan(tmvals[1]))
+        self.assertEqual(tmvals[2], mt.Tm_NN('ACGTACGT', Na=390))
+        windows = engine.tmWindows('ACGTACGTNACGTACGTA', 8)
+        self.assertEqual(int(np.isnan(windows).sum()), 8)
+
+    # engines are shared per set of conditions and correct for formamide like Biopython
+    def test_engine_cache(self):
+        engine = getTmEngine(mt.DNA_NN3, 390, 50, 25, 25)
+        self.assertIs(getTmEngine(mt.DNA_NN3, 390, 50, 25, 25), engine)
+        self.assertIsNot(getTmEngine(mt.DNA_NN3, 390, 30, 25, 25), engine)
+        self.assertEqual(engine.chemCorrect(71.23), mt.chem_correction(71.23, fmd=50))
+
+if __name__ == '__main__':
+    unittest.main()